@@ -0,0 +1,160 @@
+"""Asyncio STIX2 TypeDB Source/Sink"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from .typedb import TypeDBSink, TypeDBSource
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class _AsyncRunner:
+    """Runs blocking TypeDB calls on an executor, with a bound on the number of calls in flight.
+
+    Args:
+        - max_concurrency (int): The maximum number of calls running at once
+        - executor (Executor): The executor to run the calls on. If None, a thread pool
+            sized to max_concurrency is created, and shut down on close
+
+    """
+    def __init__(self, max_concurrency=8, executor=None):
+        self.max_concurrency = max_concurrency
+        self._own_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_concurrency,
+                                                        thread_name_prefix="stixorm-typedb")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run(self, func, *args, **kwargs):
+        """
+            Run a blocking call on the executor, once a concurrency slot is free
+        """
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def close(self):
+        """
+            Shut down the executor, if it was created here, waiting for running calls to finish
+        """
+        if self._own_executor:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, functools.partial(self._executor.shutdown, wait=True))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+class AsyncTypeDBSink(_AsyncRunner):
+    """Asyncio interface for adding/pushing STIX objects to TypeDB.
+
+    Wraps a TypeDBSink, running its gRPC work on an executor so that the event
+    loop is never blocked. Build it with ``await AsyncTypeDBSink.create(...)`` to
+    also keep the database initialisation off the event loop.
+
+    Args:
+        - connection is a dict, as for TypeDBSink
+        - clear (bool): If True, clear the TypeDB before adding objects.
+        - import_type (str): It forces the parser to use either the stix2.1, or mitre att&ck
+        - max_concurrency (int): The maximum number of adds in flight at once
+        - executor (Executor): The executor to run the blocking calls on
+        - any other keyword arguments are passed on to the TypeDBSink
+
+    """
+    def __init__(self, connection, clear=False, import_type="STIX21", max_concurrency=8, executor=None,
+                 sink=None, **kwargs):
+        super(AsyncTypeDBSink, self).__init__(max_concurrency, executor)
+        self._sink = sink or TypeDBSink(connection, clear=clear, import_type=import_type, **kwargs)
+
+    @classmethod
+    async def create(cls, connection, clear=False, import_type="STIX21", max_concurrency=8, executor=None,
+                     **kwargs):
+        """Build the sink, initialising the database on a worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        sink = await loop.run_in_executor(executor, functools.partial(
+            TypeDBSink, connection, clear=clear, import_type=import_type, **kwargs))
+        return cls(connection, clear, import_type, max_concurrency, executor, sink=sink)
+
+    @property
+    def sink(self):
+        return self._sink
+
+    async def add(self, stix_data=None, **kwargs):
+        """Add STIX objects to the typedb server, see TypeDBSink.add.
+
+        Returns:
+            report {}: a dict of stix-id to the number of the batch the object
+                was committed in
+        """
+        return await self._run(self._sink.add, stix_data, **kwargs)
+
+    async def add_file(self, path, **kwargs):
+        """Stream the STIX objects of a bundle file into the typedb server, see TypeDBSink.add_file.
+        """
+        return await self._run(self._sink.add_file, path, **kwargs)
+
+
+class AsyncTypeDBSource(_AsyncRunner):
+    """Asyncio interface for searching/retrieving STIX objects from a TypeDB Database.
+
+    Wraps a TypeDBSource, running each retrieval on an executor so that many gets
+    can be in flight at once, up to max_concurrency. Only get and iter_get are
+    offered, as TypeDBSource does not implement query or all_versions.
+
+    Args:
+        - connection is a dict, as for TypeDBSource
+        - import_type (str): It forces the parser to use either the stix2.1, or mitre att&ck
+        - max_concurrency (int): The maximum number of retrievals in flight at once
+        - executor (Executor): The executor to run the blocking calls on
+        - any other keyword arguments are passed on to the TypeDBSource
+
+    """
+    def __init__(self, connection, import_type="STIX21", max_concurrency=8, executor=None, source=None, **kwargs):
+        super(AsyncTypeDBSource, self).__init__(max_concurrency, executor)
+        self._source = source or TypeDBSource(connection, import_type=import_type, **kwargs)
+
+    @property
+    def source(self):
+        return self._source
+
+    async def get(self, stix_id, _composite_filters=None):
+        """Retrieve STIX object via STIX ID, see TypeDBSource.get.
+        """
+        return await self._run(self._source.get, stix_id, _composite_filters)
+
+    async def iter_get(self, stix_ids):
+        """Retrieve many STIX objects concurrently, yielding each as soon as it arrives.
+
+        At most max_concurrency retrievals are scheduled at a time, so a long list
+        of ids does not create a task per id up front.
+
+        Args:
+            stix_ids (list): the STIX IDs of the objects to be retrieved
+
+        Returns:
+            (STIX object): each object found, in the order the retrievals complete
+
+        """
+        stix_ids = iter(stix_ids)
+        pending = set()
+        try:
+            while True:
+                for stix_id in stix_ids:
+                    pending.add(asyncio.ensure_future(self.get(stix_id)))
+                    if len(pending) >= self.max_concurrency:
+                        break
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stix_obj = task.result()
+                    if stix_obj is not None:
+                        yield stix_obj
+        finally:
+            # the consumer stopped early, so drop the retrievals that have not started
+            for task in pending:
+                task.cancel()
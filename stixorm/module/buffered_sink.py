@@ -0,0 +1,149 @@
+"""Write-behind buffered sink, committing objects to TypeDB on a background thread"""
+import queue
+import threading
+import time
+from collections.abc import Mapping
+
+from stix2.base import _STIXBase
+from stix2.datastore import DataSink
+
+from .ingest_pipeline import iter_stix_objects
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class BufferedTypeDBSink(DataSink):
+    """Write-behind front for a TypeDBSink, so that producers do not wait for commits.
+
+    add puts the objects on a bounded queue and returns, while a background flusher
+    groups them into batches, of batch_size objects or whatever arrived within
+    flush_interval seconds of the first, and writes each batch through the sink, with
+    its retries, pending references and dead-letter file. When the queue is full, add
+    blocks, so that a producer faster than the database is held back rather than
+    filling memory.
+
+    An error writing a batch is raised from the next add, flush or close. The objects
+    of that batch are lost, unless the sink has a dead-letter file, which is
+    recommended for this mode.
+
+    Args:
+        - sink (TypeDBSink): The sink that writes the batches
+        - batch_size (int): The number of objects written in one transaction
+        - flush_interval (float): Seconds after the first object of a batch arrives that
+            the batch is written, however few objects it has
+        - max_queue (int): The number of objects waiting to be written before add blocks
+
+    The sink must not have a journal, as each flush is a separate add, and a journal
+    holds a single ingest.
+
+    """
+    def __init__(self, sink, batch_size=500, flush_interval=1.0, max_queue=10000):
+        super(BufferedTypeDBSink, self).__init__()
+        if getattr(sink, "journal", None) is not None:
+            raise ValueError("a buffered sink writes each flush as a separate add, which a journal cannot hold")
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.counts = {"objects": 0, "batches": 0}
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._errors = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._flush_loop, name="stixorm-flusher", daemon=True)
+        self._thread.start()
+
+    def add(self, stix_data, timeout=None):
+        """Queue STIX objects to be written, returning as soon as they are queued.
+
+        Args:
+            stix_data (STIX object OR dict OR str OR list): STIX content, as for TypeDBSink.add
+            timeout (float): Seconds to wait for room on a full queue, before raising queue.Full,
+                None to wait as long as it takes
+
+        """
+        self._raise_errors()
+        if self._closed:
+            raise ValueError("cannot add to a closed buffered sink")
+        for stix_obj in iter_stix_objects(stix_data):
+            self._queue.put(stix_obj, timeout=timeout)
+
+    def flush(self, timeout=None):
+        """Write every object queued so far, waiting until they are committed.
+
+        Args:
+            timeout (float): Seconds to wait for the writes, None to wait as long as it takes
+
+        Returns:
+            bool: True if every queued object was written within the timeout
+
+        """
+        if self._closed:
+            self._raise_errors()
+            return True
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        done = flushed.wait(timeout)
+        self._raise_errors()
+        return done
+
+    def close(self):
+        """Write the queued objects and stop the flusher.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _flush_loop(self):
+        """
+            Background flusher, writing a batch when it is full, when its time window ends, or
+            on a flush, until it receives None
+        """
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = False
+            if isinstance(item, (_STIXBase, Mapping)):
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+            self._write(batch)
+            batch = []
+            deadline = None
+            if item is None:
+                return
+            if isinstance(item, threading.Event):
+                item.set()
+
+    def _write(self, batch):
+        """
+            Write one batch through the sink, keeping the error for the producer
+        """
+        if not batch:
+            return
+        try:
+            self.sink.add(batch, batch_size=len(batch))
+            self.counts["objects"] += len(batch)
+            self.counts["batches"] += 1
+        except Exception as e:
+            logger.error(f'buffered write of {len(batch)} objects failed: {e}')
+            self._errors.append(e)
+
+    def _raise_errors(self):
+        if self._errors:
+            raise self._errors.pop(0)
+
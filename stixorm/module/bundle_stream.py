@@ -0,0 +1,162 @@
+"""Incremental reader for STIX bundle files, streams and pipes"""
+import gzip
+import io
+import json
+import re
+
+import logging
+logger = logging.getLogger(__name__)
+
+_whitespace = re.compile(r'\s*')
+_decoder = json.JSONDecoder()
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_bundle(path):
+    """
+        Open a bundle file for streaming, transparently decompressing it if it is gzipped
+    Args:
+        path (): the path of a json, or gzipped json, file
+
+    Returns:
+        stream: a text stream, to be closed by the caller
+    """
+    return open_stream(open(path, 'rb'))
+
+
+def open_stream(stream):
+    """
+        Wrap a binary or text stream as a text stream, decompressing gzip content
+    Args:
+        stream (): a file, pipe or socket stream
+
+    Returns:
+        stream: a text stream
+    """
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        stream = gzip.GzipFile(fileobj=stream)
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+
+def iter_bundle_objects(stream, chunk_size=65536):
+    """
+        Yield the STIX objects of a bundle one at a time, without reading the whole bundle into memory.
+        The stream can hold a bundle, a json list of objects, or a single object
+    Args:
+        stream (): a text stream
+        chunk_size (): the number of characters read from the stream at a time
+
+    Returns:
+        stix_dict {}: each of the STIX objects, as a dict
+    """
+    reader = _StreamReader(stream, chunk_size)
+    first = reader.peek()
+    if first == '[':
+        yield from reader.iter_array()
+    elif first == '{':
+        # walk the keys of the top level object, streaming the objects list when it is found
+        reader.expect('{')
+        top_level = {}
+        found_objects = False
+        while reader.peek() != '}':
+            key = reader.decode()
+            reader.expect(':')
+            if key == 'objects':
+                found_objects = True
+                yield from reader.iter_array()
+            else:
+                top_level[key] = reader.decode()
+            if reader.peek() == ',':
+                reader.expect(',')
+        reader.expect('}')
+        if not found_objects and top_level.get('type') != 'bundle':
+            yield top_level
+    elif first == '':
+        logger.warning('empty STIX stream')
+    else:
+        raise ValueError(f'STIX stream must hold a json object or list, not {first!r}')
+
+
+class _StreamReader:
+    """Buffered json tokenizer over a text stream, holding at most one value plus one chunk in memory.
+    """
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size):
+        """
+            Read more of the stream onto the buffer, dropping what has already been consumed
+        """
+        chunk = self.stream.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+            Skip whitespace and return the next character, or '' at the end of the stream
+        """
+        while True:
+            self.pos = _whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                return ''
+
+    def expect(self, char):
+        """
+            Consume the next character, which must be char
+        """
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'expected {char!r} in STIX stream, found {found!r}')
+        self.pos += 1
+
+    def decode(self):
+        """
+            Decode the next complete json value, reading more of the stream until it is complete
+        """
+        read_size = self.chunk_size
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # a value running to the end of the buffer (e.g. a number) may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            if not self._fill(read_size):
+                continue
+            # double the read size, so that very large objects are not re-scanned once per chunk
+            read_size *= 2
+
+    def iter_array(self):
+        """
+            Yield each value of the json array at the current position
+        """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            found = self.peek()
+            self.pos += 1
+            if found == ']':
+                return
+            if found != ',':
+                raise ValueError(f'expected "," or "]" in STIX objects list, found {found!r}')
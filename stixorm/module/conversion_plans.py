@@ -0,0 +1,109 @@
+"""Per-type conversion plans, compiled once from the STIX mappings and shared by every conversion"""
+from types import MappingProxyType
+
+from .definitions.stix21 import stix_models
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def compile_plan(obj_tql, base_tql, is_list, extra_tql=None):
+    """
+        Compile the conversion plan of a STIX type, from its own mapping and the generic one of its kind
+    Args:
+        obj_tql (): the STIX property name to typeql name mapping of the type
+        base_tql (): the mapping of the properties common to its kind, which win over the type's own
+        is_list (): the STIX property names that are lists
+        extra_tql (): a mapping of further properties, such as those ATT&CK adds to a STIX type
+
+    Returns:
+        plan {}: a read-only dict, of typeql, the merged mapping, properties and relations, the
+            STIX property names stored as attributes and as sub-objects, and is_list
+    """
+    typeql = dict(obj_tql)
+    typeql.update(extra_tql or {})
+    typeql.update(base_tql)
+    return MappingProxyType({
+        "typeql": MappingProxyType(typeql),
+        "properties": frozenset(prop for prop, tql_name in typeql.items() if tql_name != ""),
+        "relations": frozenset(prop for prop, tql_name in typeql.items() if tql_name == ""),
+        "is_list": frozenset(is_list),
+    })
+
+
+def _compile_plans():
+    """
+        Compile the plan of every SDO, SCO and SRO type, for STIX and for ATT&CK
+    Returns:
+        plans {}: a read-only dict of import type to a read-only dict of the STIX type, or for an
+            SRO, relationship or sighting, to its plan
+    """
+    dispatch = stix_models["dispatch_stix"]
+    dispatch_attack = stix_models["dispatch_attack"]
+    sdo_is_list = stix_models["sdo_is_list"]
+    sco_is_list = stix_models["sco_is_list"]
+    sro_is_list = stix_models["sro_is_list"]
+    stix_plans = {}
+    for obj_type in stix_models["sdo_obj"]:
+        stix_plans[obj_type] = compile_plan(dispatch[obj_type], stix_models["sdo_typeql_dict"],
+                                            sdo_is_list["sdo"] + sdo_is_list.get(obj_type, []))
+    for obj_type in stix_models["sco_obj"]:
+        stix_plans[obj_type] = compile_plan(dispatch[obj_type], stix_models["sco_base_typeql_dict"],
+                                            sco_is_list["sco"] + sco_is_list.get(obj_type, []))
+    stix_plans["relationship"] = compile_plan(dispatch["relationship"], stix_models["sro_base_typeql_dict"],
+                                              sro_is_list["sro"])
+    stix_plans["sighting"] = compile_plan(dispatch["sighting"], stix_models["sro_base_typeql_dict"],
+                                          sro_is_list["sro"] + sro_is_list["sighting"])
+
+    # ATT&CK adds its own properties to the STIX SDOs, and has SDOs of its own
+    attack_plans = dict(stix_plans)
+    for obj_type, attack_tql in dispatch_attack.items():
+        attack_plans[obj_type] = compile_plan(dispatch.get(obj_type, {}), stix_models["sdo_typeql_dict"],
+                                              sdo_is_list["sdo"] + sdo_is_list.get(obj_type, []), attack_tql)
+
+    return MappingProxyType({"STIX21": MappingProxyType(stix_plans), "ATT&CK": MappingProxyType(attack_plans)})
+
+
+plans = _compile_plans()
+
+
+def conversion_plan(obj_type, import_type="STIX21"):
+    """
+        Get the compiled plan of a STIX type
+    Args:
+        obj_type (): the STIX type, relationship or sighting for an SRO
+        import_type (): the type of import STIX21 or ATT&CK
+
+    Returns:
+        plan {}: the read-only plan, see compile_plan
+    """
+    if import_type not in plans:
+        raise ValueError(f'import type {import_type} not supported')
+    plan = plans[import_type].get(obj_type)
+    if plan is None:
+        raise ValueError(f'obj_type type {obj_type} not supported')
+    return plan
+
+
+def split_on_plan(total_props, plan):
+    """
+        Split the Stix object properties into flat properties and sub objects, by the plan of its type
+    Args:
+        total_props (): the total properties for this object
+        plan (): the plan of its type
+
+    Returns:
+        prop_list, a list of the flat properties
+        rel_list, a list of the sub objects
+    """
+    prop_list = []
+    rel_list = []
+    for prop in total_props:
+        if prop in plan["properties"]:
+            prop_list.append(prop)
+        elif prop in plan["relations"]:
+            rel_list.append(prop)
+        else:
+            raise ValueError(f'property not known, prop -> {prop}')
+
+    return prop_list, rel_list
@@ -0,0 +1,115 @@
+"""Dead-letter file for STIX objects that fail to parse, convert or commit"""
+import json
+import threading
+import traceback
+from datetime import datetime, timezone
+
+from stix2.serialization import STIXJSONEncoder
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class DeadLetterQueue:
+    """Append-only, json lines file of the objects an ingest could not write.
+
+    Each record holds the stage that failed (parse, convert or commit), the stix-id,
+    type and input index of the object, the exception and its message, the TypeQL if
+    it was generated, and the object itself, so that the file can be replayed once
+    the cause is fixed.
+
+    Args:
+        - path (str): The path of the dead-letter file, appended to if it exists
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __len__(self):
+        return self.count
+
+    def record(self, stage, error, stix_obj=None, entry=None, index=None):
+        """
+            Write a failed object to the dead-letter file
+        Args:
+            stage (): the stage that failed, parse, convert or commit
+            error (): the exception raised, or its description from describe_error
+            stix_obj (): the object, as a python STIX object or dict, if it is known
+            entry (): the batch entry of the object, if its TypeQL was generated
+            index (): the position of the object in the input, if there is no entry
+        """
+        if entry is not None:
+            stix_obj = entry.get("object", stix_obj)
+            index = entry.get("index")
+        if isinstance(error, BaseException):
+            error = describe_error(error)
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "stage": stage,
+            "stix_id": entry["stix_id"] if entry else _get(stix_obj, "id"),
+            "stix_type": entry["stix_type"] if entry else _get(stix_obj, "type"),
+            "index": index,
+            **error,
+            "typeql": entry["match"] + entry["insert"] if entry else None,
+            "object": stix_obj,
+        }
+        line = json.dumps(record, cls=STIXJSONEncoder)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            self.count += 1
+        logger.warning(f'{stage} failed for {record["stix_id"]}, written to dead-letter file {self.path}: {record["reason"]}')
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def describe_error(error):
+    """
+        Describe an exception as plain strings, which can be sent back from a worker process,
+        unlike some exception classes
+    Args:
+        error (): the exception raised
+
+    Returns:
+        description {}: the reason, exception name and traceback
+    """
+    return {
+        "reason": str(error),
+        "exception": type(error).__name__,
+        "traceback": "".join(traceback.format_exception(type(error), error, error.__traceback__)),
+    }
+
+
+def read_dead_letters(path):
+    """
+        Read back the records of a dead-letter file
+    Args:
+        path (): the path of the dead-letter file
+
+    Returns:
+        record {}: each dead-letter record in turn
+    """
+    with open(path, encoding='utf-8') as dead_letter_file:
+        for line in dead_letter_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _get(stix_obj, key):
+    """
+        Get a property of an object that may not be a mapping, such as a string that failed to parse
+    """
+    try:
+        return stix_obj[key]
+    except (KeyError, TypeError, IndexError):
+        return None
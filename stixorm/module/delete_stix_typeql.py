@@ -0,0 +1,245 @@
+"""Delete STIX objects, and the sub-objects they own, from TypeDB"""
+from .definitions.stix21 import stix_models
+from .import_stix_utilities import val_tql
+from .iid_cache import content_keys_query
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _owned_relations():
+    """
+        Build the map of each sub-object relation to the role its owner plays in it, from the
+        mappings used to insert them
+    Returns:
+        owned {}: the typeql relation name to the set of its owner role names
+    """
+    owned = {}
+    for ex in stix_models["embedded_relations_typeql"]:
+        owned.setdefault(ex["typeql"], set()).add(ex["owner"])
+    for config in stix_models["list_of_object_typeql"]:
+        owned.setdefault(config["typeql"], set()).add(config["owner"])
+    for config in stix_models["key_value_typeql_list"]:
+        owned.setdefault(config["typeql"], set()).add(config["owner"])
+    for ext in stix_models["ext_typeql_dict_list"]:
+        owned.setdefault(ext["relation"], set()).add(ext["owner"])
+    owned.setdefault("hashes", set()).add("owner")
+    owned.setdefault("granular-marking", set()).add("object")
+    return owned
+
+
+owned_relations = _owned_relations()
+
+
+def sub_object_relations(prop, value):
+    """
+        Find the typeql relations that hold a sub-object property of a STIX object
+    Args:
+        prop (): the STIX property name
+        value (): the value of the property, used for extensions, which hold one relation per extension
+
+    Returns:
+        relations set(): the typeql relation names
+    """
+    if prop in ("hashes", "file_header_hashes"):
+        return {"hashes"}
+    if prop == "granular_markings":
+        return {"granular-marking"}
+    if prop == "extensions":
+        return {ext["relation"] for ext in stix_models["ext_typeql_dict_list"] if ext["stix"] in value}
+    for ex in stix_models["embedded_relations_typeql"]:
+        if ex["rel"] == prop:
+            return {ex["typeql"]}
+    for config in stix_models["list_of_object_typeql"] + stix_models["key_value_typeql_list"]:
+        if config["name"] == prop:
+            return {config["typeql"]}
+    for ext in stix_models["ext_typeql_dict_list"]:
+        if ext["stix"] == prop:
+            return {ext["relation"]}
+    raise ValueError(f'relation type not known, rel -> {prop}')
+
+
+def owned_sub_graph(thing, tx, relation_types=None):
+    """
+        Collect the relations a STIX object owns, and the sub-objects they hold, at any depth.
+        A relation is owned when the object plays its owner role, and a sub-object is an entity
+        player of an owned relation that has no stix-id of its own, such as a hash, a kill chain
+        phase, an external reference or an extension. Other STIX objects are never collected, and
+        nor are sub-objects shared by content key that other objects still hold
+    Args:
+        thing (): the typedb concept of the STIX object
+        tx (): the transaction
+        relation_types (): if given, only the owned relations of these types are followed
+            from the object itself, while everything is followed from its sub-objects
+
+    Returns:
+        relations []: the IIDs of the owned relations
+        entities []: the IIDs of the sub-objects
+    """
+    stix_id = tx.concepts().get_attribute_type("stix-id")
+    content_key = tx.concepts().get_attribute_type("content-key")
+    relations = []
+    entities = []
+    seen = {thing.get_iid()}
+    to_visit = [(thing, relation_types)]
+    while to_visit:
+        owner, types = to_visit.pop()
+        for rel in owner.as_remote(tx).get_relations():
+            rel_type = rel.get_type().get_label().name()
+            if rel.get_iid() in seen or rel_type not in owned_relations:
+                continue
+            if types is not None and rel_type not in types:
+                continue
+            players = rel.as_remote(tx).get_players_by_role_type()
+            owner_roles = owned_relations[rel_type]
+            if not any(role.get_label().name() in owner_roles and owner.get_iid() in {p.get_iid() for p in things}
+                       for role, things in players.items()):
+                continue
+            seen.add(rel.get_iid())
+            relations.append(rel.get_iid())
+            for role, things in players.items():
+                if role.get_label().name() in owner_roles:
+                    continue
+                for player in things:
+                    if not player.is_entity() or player.get_iid() in seen:
+                        continue
+                    if any(True for _ in player.as_remote(tx).get_has(attribute_type=stix_id)):
+                        continue
+                    # a sub-object shared by content key stays while other objects hold it
+                    if (any(True for _ in player.as_remote(tx).get_has(attribute_type=content_key))
+                            and any(other.get_iid() != rel.get_iid()
+                                    for other in player.as_remote(tx).get_relations([role]))):
+                        continue
+                    seen.add(player.get_iid())
+                    entities.append(player.get_iid())
+                    to_visit.append((player, None))
+
+    return relations, entities
+
+
+def delete_iids_queries(iids, chunk_size=500):
+    """
+        Assemble the typeql queries that delete things by IID, relations before the entities they hold
+    Args:
+        iids (): the IIDs, in the order to delete them
+        chunk_size (): the number of things deleted in one query
+
+    Returns:
+        queries []: the typeql delete statements
+    """
+    queries = []
+    for start in range(0, len(iids), chunk_size):
+        chunk = iids[start:start + chunk_size]
+        match = ''.join(f' $t{i} iid {iid};' for i, iid in enumerate(chunk))
+        delete = ''.join(f' $t{i} isa thing;' for i in range(len(chunk)))
+        queries.append('match' + match + '\ndelete' + delete)
+    return queries
+
+
+def delete_attribute_query(iid, tql_prop_name):
+    """
+        Assemble the typeql query that removes every value of an attribute from an object, leaving
+        the attribute values themselves, which other objects may own
+    """
+    return f'match $x iid {iid}, has {tql_prop_name} $a;\ndelete $x has $a;'
+
+
+def delete_role_players_query(iid, role):
+    """
+        Assemble the typeql query that removes the players of a role from a relation, such as the
+        where-sighted role of a sighting
+    """
+    return f'match $x iid {iid}; $x ({role}:$p);\ndelete $x ({role}:$p);'
+
+
+def delete_object_queries(thing, tx):
+    """
+        Assemble the typeql queries that delete a STIX object with the sub-graph it owns. The
+        relations it plays other roles in, such as the object_refs of a report that refers to
+        it, lose it as a role player, and the STIX objects at their other ends are kept
+    Args:
+        thing (): the typedb concept of the STIX object
+        tx (): the transaction
+
+    Returns:
+        queries []: the typeql delete statements, in the order to run them
+    """
+    relations, entities = owned_sub_graph(thing, tx)
+    iid = thing.get_iid()
+    # the stix-id value belongs to this object alone, so it goes too, and lookups of it match nothing
+    queries = [f'match $x iid {iid}, has stix-id $id;\ndelete $id isa stix-id;']
+    return queries + delete_iids_queries(relations + entities + [iid])
+
+
+def merge_shared_sub_objects(tx, keys, chunk_size=500):
+    """
+        Merge the sub-objects inserted for the same content key by concurrent transactions, once
+        they have committed. The sub-object with the lowest IID is kept, so that concurrent merges
+        agree, and the others are replaced by it in the relations that hold them, then deleted,
+        with the relations they own, of which the kept sub-object owns the same
+    Args:
+        tx (): a write transaction
+        keys (): the content keys of the sub-objects that were just inserted
+        chunk_size (): the number of content keys read in one query
+
+    Returns:
+        kept {}: the content key to the IID of the sub-object kept
+        merged (int): the number of duplicate sub-objects deleted
+    """
+    keys = sorted(set(keys))
+    found = {}
+    for start in range(0, len(keys), chunk_size):
+        for answer in tx.query().match(content_keys_query(keys[start:start + chunk_size])):
+            found.setdefault(answer.get("k").get_value(), []).append(answer.get("s"))
+    kept = {}
+    merged = 0
+    for key, things in found.items():
+        things = sorted(things, key=lambda thing: thing.get_iid())
+        kept[key] = things[0].get_iid()
+        for duplicate in things[1:]:
+            owned = _replace_player(tx, duplicate, things[0])
+            for query in delete_iids_queries(owned + [duplicate.get_iid()]):
+                tx.query().delete(query)
+            merged += 1
+    if merged:
+        logger.info(f'merged {merged} duplicate shared sub-objects')
+    return kept, merged
+
+
+def _replace_player(tx, duplicate, keep):
+    """
+        Put keep in the place of duplicate in the relations it plays a held role in
+
+    Returns:
+        owned []: the IIDs of the relations that duplicate owns, which are not moved
+    """
+    owned = []
+    for rel in duplicate.as_remote(tx).get_relations():
+        owner_roles = owned_relations.get(rel.get_type().get_label().name(), set())
+        remote = rel.as_remote(tx)
+        for role, things in remote.get_players_by_role_type().items():
+            player_iids = {thing.get_iid() for thing in things}
+            if duplicate.get_iid() not in player_iids:
+                continue
+            if role.get_label().name() in owner_roles:
+                owned.append(rel.get_iid())
+                break
+            if keep.get_iid() not in player_iids:
+                remote.add_player(role, keep)
+            remote.remove_player(role, duplicate)
+    return owned
+
+
+def revoke_queries(iid, modified):
+    """
+        Assemble the typeql queries that mark a stored STIX object as revoked, as a new version
+    Args:
+        iid (): the IID of the STIX object
+        modified (): the modified timestamp of the new version
+
+    Returns:
+        queries []: the ("delete" or "insert", typeql) queries, the deletes of the old values, then the insert
+    """
+    return [("delete", delete_attribute_query(iid, "revoked")),
+            ("delete", delete_attribute_query(iid, "modified")),
+            ("insert", f'match $x iid {iid};\ninsert $x has revoked true, has modified {val_tql(modified)};')]
@@ -1,6 +1,7 @@
 import json
 import datetime
 from .definitions.stix21 import stix_models
+from .conversion_plans import conversion_plan
 from .export_typeql_to_intermediate import convert_ans_to_res, embedded_relations, standard_relations, list_of_objects, key_value_relations, extension_relations
 
 import logging
@@ -84,44 +85,18 @@ def make_sdo(res, import_type):
     """
     stix_dict = {}
     obj_type = res["T_name"]
-    # 1.B) get the specific typeql names for an object into a dictionary
-    # - stix import
-    if import_type == 'STIX21':
-        if obj_type in stix_models["dispatch_stix"]:
-            obj_tql = stix_models["dispatch_stix"][obj_type]
-        else:
-            logger.error(f'obj_type type {obj_type} not supported')
-            return ''
-    # - mitre attack import
-    elif import_type == 'ATT&CK':
-        if obj_type[0:6] == "x-mitre":
-            if obj_type in dispatch_mitre:
-                # dispatch specific mitre properties plus generic sdo properties
-                obj_tql = dispatch_mitre[obj_type]
-            else:
-                logger.error(f'obj_type type {obj_type} not in dispatch mitre')
-                return ''
-        else:
-            if obj_type in stix_models["dispatch_stix"]:
-                # dispatch specific stix properties plus mitre properties plus generic sdo properties
-                obj_tql = stix_models["dispatch_stix"][obj_type]
-                obj_tql2 = dispatch_mitre[obj_type]
-                obj_tql.update(obj_tql2)
-            else:
-                logger.error(f'obj_type type {obj_type} not in stix_models["dispatch_stix"] or dispatch mitre')
-                return ''
-
-    else:
-        logger.error(f'import type {import_type} not supported')
+    # 1.B) get the compiled plan of the object type, holding the specific and the standard object properties
+    try:
+        plan = conversion_plan(obj_type, import_type)
+    except ValueError as e:
+        logger.error(f'{e}')
         return ''
-
-    # 1.C) Add the standard object properties to the specific ones, and split them into properties and relations
-    obj_tql.update(stix_models["sdo_typeql_dict"])
+    obj_tql = plan["typeql"]
     # 2.A) get the typeql properties and relations
     props = res["has"]
     relns = res["relns"]
     # 2.B) get the is_list list, the list of properties that are lists for that object
-    is_list = stix_models["sdo_is_list"]["sdo"] + stix_models["sdo_is_list"][obj_type]
+    is_list = plan["is_list"]
     # 3.A) add the properties onto the the object
     stix_dict = make_properties(props, obj_tql, stix_dict, is_list)
     # 3.B) add the relations onto the object
@@ -142,18 +117,18 @@ def make_sro(res, import_type):
     """
     stix_dict = {}
     obj_type = res["T_name"]
+    # - get the compiled plan, with the generic sro properties
     if obj_type == "sighting":
-        obj_tql = stix_models["dispatch_stix"]["sighting"]
+        plan = conversion_plan("sighting", import_type)
 
     elif obj_type in standard_relations:
-        obj_tql = stix_models["dispatch_stix"]["relationship"]
+        plan = conversion_plan("relationship", import_type)
 
     else:
         logger.error(f'relationship type {obj_type} not supported')
         return ''
-
-    # - add on the generic sro properties
-    obj_tql.update(stix_models["sro_base_typeql_dict"])
+    obj_tql = plan["typeql"]
+    is_list = plan["is_list"]
 
     # 2.A) get the typeql properties and relations
     props = res["has"]
@@ -168,7 +143,6 @@ def make_sro(res, import_type):
                 target_role = stix_rel["target"]
                 break
 
-        is_list = stix_models["sro_is_list"]["sro"]
         for edge in edges:
             players = edge["player"]
             if edge["role"] == source_role:
@@ -186,7 +160,6 @@ def make_sro(res, import_type):
 
     # B. If it is a Sighting then match the object to the sighting
     elif obj_type == 'sighting':
-        is_list = stix_models["sro_is_list"]["sro"] + stix_models["sro_is_list"]["sighting"]
         for edge in edges:
             players = edge["player"]
             if edge["role"] == "sighting-of":
@@ -235,16 +208,15 @@ def make_sco(res, import_type):
     # - work out the type of object
     stix_dict = {}
     obj_type = res["T_name"]
-    # - get the object-specific typeql names, sighting or relationship
-    obj_tql = stix_models["dispatch_stix"][obj_type]
-    # - add on the generic sro properties
-    obj_tql.update(stix_models["sco_base_typeql_dict"])
+    # - get the compiled plan of the object type, with the generic sco properties
+    plan = conversion_plan(obj_type, import_type)
+    obj_tql = plan["typeql"]
 
     # 2.A) get the typeql properties and relations
     props = res["has"]
     relns = res["relns"]
 
-    is_list = stix_models["sco_is_list"]["sco"] + stix_models["sco_is_list"][obj_type]
+    is_list = plan["is_list"]
     # 3.A) add the properties onto the the object
     stix_dict = make_properties(props, obj_tql, stix_dict, is_list)
     # 3.B) add the relations onto the object
@@ -155,6 +155,9 @@ def process_props(props_obj):
     props = []
     for a in props_obj:
         prop = {"typeql": a.get_type().get_label().name()}
+        # the content key of a shared sub-object is not part of its STIX value
+        if prop["typeql"] == "content-key":
+            continue
         if a.is_datetime():
             nt_obj = a.get_value()
             dt_obj = nt_obj.astimezone(timezone.utc)
@@ -354,7 +357,7 @@ def get_list_of_objects(r, r_tx):
     Returns:
         roles []: list of dict objects
     """
-    reln_name = r.get_type().get_label().name()
+    reln_name = list_reln_name = r.get_type().get_label().name()
     for lot in stix_models["list_of_object_typeql"]:
         if reln_name == lot["typeql"]:
             reln_pointed_to = lot["pointed_to"]
@@ -380,6 +383,9 @@ def get_list_of_objects(r, r_tx):
                 for rel in reln_types:
                     reln = {}
                     reln_name = rel.get_type().get_label().name()
+                    # a shared sub-object is held by the list relations of other objects too
+                    if reln_name == list_reln_name:
+                        continue
 
                     reln['T_name'] = reln_name
                     reln['T_id'] = rel.get_iid()
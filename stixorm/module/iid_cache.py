@@ -0,0 +1,151 @@
+"""Client-side cache of stix-id to TypeDB IID, for matching references by iid"""
+import re
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# the attribute lookup that get_embedded_match and embedded_relation write for each reference
+stix_id_match_pattern = re.compile(r'(\$[\w-]+) isa [\w-]+, has stix-id "([^"]+)";')
+
+# the lookup that shared_sub_object writes for each sub-object shared by content key
+content_key_match_pattern = re.compile(r'(\$[\w-]+) isa [\w-]+, has content-key "([0-9a-f]+)";')
+
+
+def object_var(stix_type):
+    """
+        The typeql variable, without the $, that the insert of a STIX object binds it to
+    """
+    if stix_type == "marking-definition":
+        return "marking"
+    return stix_type
+
+
+def match_vars(match):
+    """
+        Find the variables of a match statement that are bound by stix-id
+    Args:
+        match (): a typeql match statement
+
+    Returns:
+        vars {}: the variable, without the $, to the stix-id it is bound to
+    """
+    return {var[1:]: stix_id for var, stix_id in stix_id_match_pattern.findall(match)}
+
+
+def content_keys_query(keys):
+    """
+        Assemble the typeql query that finds the stored sub-objects with any of the content keys
+    Args:
+        keys (): the content keys to look for
+
+    Returns:
+        match: the typeql match statement, getting the $k of each one found, and the sub-object $s owning it
+    """
+    if len(keys) == 1:
+        return 'match $s has content-key $k; $k = "' + keys[0] + '"; get $s, $k;'
+    options = ' or '.join('{$k = "' + key + '";}' for key in keys)
+    return 'match $s has content-key $k; ' + options + '; get $s, $k;'
+
+
+def rewrite_content_keys(match, iids):
+    """
+        Replace the content key lookups of a match statement with iid matches, where the IID is known
+    Args:
+        match (): a typeql match statement
+        iids (): a dict of content key to the IID of the shared sub-object
+
+    Returns:
+        match: the rewritten statement
+    """
+    def by_iid(lookup):
+        iid = iids.get(lookup.group(2))
+        if iid is None:
+            return lookup.group(0)
+        return f'{lookup.group(1)} iid {iid};'
+
+    return content_key_match_pattern.sub(by_iid, match)
+
+
+class IIDCache:
+    """Bounded, least recently used map of stix-id to the IID of the object in TypeDB.
+
+    Hub objects such as identities and TLP markings are referred to by thousands of
+    objects, and each reference is an attribute lookup on the server. Once the IID of
+    an object is known, from the answer to its insert or to a read, the lookup can be
+    replaced by a match on the IID.
+
+    IIDs are only valid while the object exists, so deletes must invalidate them, and a
+    query that matches nothing with IIDs from the cache should be retried without them.
+
+    Args:
+        - max_size (int): The number of stix-ids held, least recently used first out
+
+    """
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self._iids = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._iids)
+
+    def get(self, stix_id):
+        with self._lock:
+            iid = self._iids.get(stix_id)
+            if iid is None:
+                self.misses += 1
+                return None
+            self._iids.move_to_end(stix_id)
+            self.hits += 1
+            return iid
+
+    def put_many(self, iids):
+        """
+            Add stix-id to IID pairs, evicting the least recently used beyond max_size
+        Args:
+            iids (): a dict of stix-id to IID
+        """
+        with self._lock:
+            for stix_id, iid in iids.items():
+                self._iids[stix_id] = iid
+                self._iids.move_to_end(stix_id)
+            while len(self._iids) > self.max_size:
+                self._iids.popitem(last=False)
+
+    def invalidate(self, stix_ids):
+        """
+            Forget the IIDs of objects that have been deleted, or may have been
+        """
+        with self._lock:
+            for stix_id in stix_ids:
+                self._iids.pop(stix_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._iids.clear()
+
+    def rewrite_match(self, match):
+        """
+            Replace the stix-id lookups of a match statement with iid matches, where the IID is cached
+        Args:
+            match (): a typeql match statement
+
+        Returns:
+            match: the rewritten statement
+            used []: the stix-ids that were matched by iid
+        """
+        used = []
+
+        def by_iid(lookup):
+            iid = self.get(lookup.group(2))
+            if iid is None:
+                return lookup.group(0)
+            used.append(lookup.group(2))
+            return f'{lookup.group(1)} iid {iid};'
+
+        return stix_id_match_pattern.sub(by_iid, match), used
@@ -8,7 +8,8 @@ from stix2.utils import is_object, is_stix_type, get_type_from_id, is_sdo, is_sc
 from stix2.parsing import parse
 from .definitions.stix21 import stix_models
 
-from .import_stix_utilities import clean_props,get_embedded_match,split_on_activity_type,add_property_to_typeql,add_relation_to_typeql, val_tql
+from .import_stix_utilities import clean_props,get_embedded_match,add_property_to_typeql,add_relation_to_typeql, val_tql
+from .conversion_plans import conversion_plan, split_on_plan
 
 import logging
 logger = logging.getLogger(__name__)
@@ -59,15 +60,71 @@ def raw_stix2_to_typeql(stix_object, import_type='STIX21'):
         match, insert = sro_to_typeql(stix_object, import_type)
     elif is_sco(stix_object):
         match, insert = sco_to_typeql(stix_object, import_type)
-    elif stix_object.type == 'marking-definition':
+    elif stix_object['type'] == 'marking-definition':
         match, insert = marking_definition_to_typeql(stix_object, import_type)
     else:
-        logger.error(f'object type not supported: {stix_object.type}, import type {import_type}')
-        match, insert = ''
+        raise ValueError(f'object type not supported: {stix_object["type"]}, import type {import_type}')
         
     return match, insert
 
 
+# the ref lists of a sighting are role players of the sighting itself, rather than of an embedded relation
+sighting_ref_roles = {"observed_data_refs": "observed", "where_sighted_refs": "where-sighted"}
+
+
+def split_ref_lists(stix_object, max_refs):
+    """
+    Split the reference lists of an object that are longer than max_refs, so that each part
+    can be written in its own transaction. The object is trimmed to the first max_refs of
+    each list, and the rest are returned as follow-up queries, each adding up to max_refs
+    role players to the relation inserted with the object
+
+    Args:
+        stix_object (): valid Stix2 object, or STIX dict
+        max_refs (): the largest number of references written in one query
+
+    Returns:
+        stix_object: the object, or a trimmed dict copy of it if any list was split
+        followups: a list of (match, insert) typeql pairs, to run after the object is inserted
+
+    """
+    long_lists = [prop for prop, value in stix_object.items()
+                  if prop.endswith("_refs") and isinstance(value, list) and len(value) > max_refs]
+    if not long_lists:
+        return stix_object, []
+
+    trimmed = dict(stix_object)
+    followups = []
+    owner_var, owner_match = get_embedded_match(stix_object["id"], '')
+    for prop in long_lists:
+        refs = stix_object[prop]
+        trimmed[prop] = refs[:max_refs]
+        if prop in sighting_ref_roles and stix_object["type"] == "sighting":
+            relation_match = ''
+            relation_var = owner_var
+            role = sighting_ref_roles[prop]
+        else:
+            for ex in stix_models["embedded_relations_typeql"]:
+                if ex["rel"] == prop:
+                    break
+            else:
+                raise ValueError(f'relation type not known, rel -> {prop}')
+            relation_var = '$' + ex["typeql"]
+            relation_match = f' {relation_var} ({ex["owner"]}:{owner_var}) isa {ex["typeql"]};\n'
+            role = ex["pointed-to"]
+        for start in range(max_refs, len(refs), max_refs):
+            match = 'match \n' + owner_match + relation_match
+            role_players = []
+            for i, ref in enumerate(refs[start:start + max_refs]):
+                ref_var, ref_match = get_embedded_match(ref, i)
+                match += ref_match
+                role_players.append(role + ':' + ref_var)
+            insert = 'insert \n ' + relation_var + ' (' + ', '.join(role_players) + ');\n'
+            followups.append((match, insert))
+
+    return trimmed, followups
+
+
 #-------------------------------------------------------------
 # 1.1) SDO Object Method to convert a Python object --> typeql string
 #                 -   
@@ -87,49 +144,20 @@ def sdo_to_typeql(sdo, import_type='STIX21'):
     """
     # 1.A) get configuration parameters
     # - variable for use in typeql statements
-    sdo_var = '$' + sdo.type
+    sdo_var = '$' + sdo['type']
     # - list of property names that have values
-    total_props = sdo._inner
+    total_props = list(sdo)
     total_props = clean_props(total_props)
     # - work out the type of object
-    obj_type = sdo.type
-    # 1.B) get the specific typeql names for an object into a dictionary
-    # - stix import
-    if import_type == 'STIX21':
-        if obj_type in stix_models["dispatch_stix"]:
-            obj_tql = stix_models["dispatch_stix"][obj_type]
-        else:
-            logger.error(f'obj_type type {obj_type} not supported')
-            return ''
-    # - mitre attack import
-    elif import_type == 'ATT&CK':
-        if obj_type[0:6] == "x-mitre":
-            if obj_type in dispatch_attack:
-                # dispatch specific mitre properties plus generic sdo properties
-                obj_tql = dispatch_attack[obj_type]
-            else:
-                logger.error(f'obj_type type {obj_type} not in dispatch mitre')
-                return ''
-        else:
-            if obj_type in stix_models["dispatch_stix"]:
-                # dispatch specific stix properties plus mitre properties plus generic sdo properties
-                obj_tql = stix_models["dispatch_stix"][obj_type]
-                obj_tql2 = dispatch_attack[obj_type]
-                obj_tql.update(obj_tql2)
-            else:
-                logger.error(f'obj_type type {obj_type} not in stix_models["dispatch_stix"] or dispatch mitre')
-                return ''              
-        
-    else:
-        logger.error(f'import type {import_type} not supported')
-        return ''	
-    
-    # 1.C) Add the standard object properties to the specific ones, and split them into properties and relations
-    obj_tql.update(stix_models["sdo_typeql_dict"])
-    properties, relations = split_on_activity_type(total_props, obj_tql)   
+    obj_type = sdo['type']
+    # 1.B) get the compiled plan of the object type, holding the specific and the standard object
+    # properties, for a stix or a mitre attack import, and split them into properties and relations
+    plan = conversion_plan(obj_type, import_type)
+    obj_tql = plan["typeql"]
+    properties, relations = split_on_plan(total_props, plan)
     
     # 2.) setup the typeql statement for the sdo entity
-    type_ql = 'insert ' + sdo_var + ' isa ' + sdo.type 
+    type_ql = 'insert ' + sdo_var + ' isa ' + sdo['type'] 
     type_ql_props = match = insert = '' 
     
     # 3.) add each of the properties and values of the properties to the typeql statement
@@ -178,17 +206,16 @@ def sro_to_typeql(sro, import_type='STIX21'):
     """
     # 1.) get configuration parameters
     # - variable for use in typeql statements
-    sro_var = '$' + sro.type
+    sro_var = '$' + sro['type']
     # - list of property names that have values, and do not include False values
-    total_props = sro._inner
+    total_props = list(sro)
     total_props = clean_props(total_props)
     
     # - work out the type of object
-    obj_type = sro.type
-    # - get the object-specific typeql names, sighting or relationship
-    obj_tql = stix_models["dispatch_stix"][obj_type]
-    # - add on the generic sro properties
-    obj_tql.update(stix_models["sro_base_typeql_dict"])
+    obj_type = sro['type']
+    # - get the compiled plan of the object type, sighting or relationship, with the generic sro properties
+    plan = conversion_plan(obj_type, import_type)
+    obj_tql = plan["typeql"]
     #initialise the typeql insert statement
     type_ql = 'insert '    
     
@@ -196,9 +223,9 @@ def sro_to_typeql(sro, import_type='STIX21'):
     # A. If it is a Relationship then find the source and target roles for the relation, and match them in
     type_ql_sro_match = 'match \n'     
     if obj_type == 'relationship':
-        source_id = sro.source_ref
+        source_id = sro['source_ref']
         source_var, source_match = get_embedded_match(source_id)
-        target_id = sro.target_ref 
+        target_id = sro['target_ref']
         target_var, target_match = get_embedded_match(target_id)
         type_ql_sro_match += source_match + target_match
         # 3.)  then setup the typeql statement to insert the specific sro relation, from the dict, with the matches
@@ -211,7 +238,7 @@ def sro_to_typeql(sro, import_type='STIX21'):
                 break              
     # B. If it is a Sighting then match the object to the sighting
     elif obj_type == 'sighting':
-        sighting_of_id = sro.sighting_of_ref  
+        sighting_of_id = sro['sighting_of_ref']
         sighting_of_var, sighting_of_match = get_embedded_match(sighting_of_id)
         type_ql_sro_match += ' \n' + sighting_of_match
         type_ql +=  '\n' + sro_var + ' (sighting-of:' + sighting_of_var 
@@ -225,19 +252,18 @@ def sro_to_typeql(sro, import_type='STIX21'):
         # if there is a list of who and where the sighting's occured, then match it in
         where_sighted_list = sro.get("where_sighted_refs")
         if (where_sighted_list != None) and (len(where_sighted_list) > 0):
-            for where_sighted_id in where_sighted_list:
-                where_sighted_var, where_sighted_match = get_embedded_match(where_sighted_id)
+            for i, where_sighted_id in enumerate(where_sighted_list):
+                where_sighted_var, where_sighted_match = get_embedded_match(where_sighted_id, 'w' + str(i))
                 type_ql_sro_match += where_sighted_match
                 type_ql += ', where-sighted:' + where_sighted_var
         
         # then finalise the typeql statement for the sro sighting
         type_ql += ') isa sighting'
     else:
-      logger.error(f'relationship type {obj_type} not supported')
-      return ''
+      raise ValueError(f'relationship type {obj_type} not supported')
     
     # 4.) next, split total properties into actual properties and nested structures (Relations)
-    properties, relations = split_on_activity_type(total_props, obj_tql) 
+    properties, relations = split_on_plan(total_props, plan)
     match = type_ql_props = insert = ''
     
     # 5.) add each of the properties and values of the properties to the typeql statement
@@ -283,33 +309,25 @@ def sco_to_typeql(sco, import_type='STIX21'):
     """
     # 1.) get configuration parameters
     # - variable for use in typeql statements
-    sco_var = '$' + sco.type
+    sco_var = '$' + sco['type']
     # - list of property names that have values
-    total_props = sco._inner
+    total_props = list(sco)
     total_props = clean_props(total_props)
     # print(properties)
     # - work out the type of object
-    obj_type = sco.type
-    # - get the object-specific typeql names, sighting or relationship
-    obj_tql = stix_models["dispatch_stix"][obj_type]
-    # - add on the generic sro properties
-    obj_tql.update(stix_models["sco_base_typeql_dict"])
-    # initialise the typeql insert statement
-    type_ql = 'insert '
-
-    # 1.C) Split them into properties and relations
-    properties, relations = split_on_activity_type(total_props, obj_tql)
+    obj_type = sco['type']
+    # - get the compiled plan of the object type, with the generic sco properties
+    plan = conversion_plan(obj_type, import_type)
+    obj_tql = plan["typeql"]
 
     # 2.) setup the typeql statement for the sco entity
-    type_ql = 'insert \n' + sco_var + ' isa ' + sco.type
+    type_ql = 'insert \n' + sco_var + ' isa ' + sco['type']
     type_ql_props = match = insert = ''
 
     # 3.) add each of the properties and values of the properties to the typeql statement
 
     # 4.) next, split total properties into actual properties and nested structures (Relations)
-    properties, relations = split_on_activity_type(total_props, obj_tql)
-    type_ql_props = insert = ''
-    match = ''
+    properties, relations = split_on_plan(total_props, plan)
 
     # 5.) add each of the properties and values of the properties to the typeql statement
     prop_var_list = []
@@ -356,15 +374,15 @@ def marking_definition_to_typeql(stix_object, import_type="STIX21"):
 
     """
     # if the marking is a colour, match it in, else it is a statement type
-    if stix_object.definition_type == "statement":
+    if stix_object["definition_type"] == "statement":
         type_ql = '\n insert $marking isa statement-marking'
-        type_ql += ',\n has statement ' + val_tql(stix_object.definition.statement)
+        type_ql += ',\n has statement ' + val_tql(stix_object["definition"]["statement"])
         type_ql += ',\n has stix-type "marking-definition"'
-        type_ql += ',\n has stix-id ' + val_tql(stix_object.id)
-        type_ql += ',\n has created ' + val_tql(stix_object.created)
-        type_ql += ',\n has spec-version ' + val_tql(stix_object.spec_version)
+        type_ql += ',\n has stix-id ' + val_tql(stix_object["id"])
+        type_ql += ',\n has created ' + val_tql(stix_object["created"])
+        type_ql += ',\n has spec-version ' + val_tql(stix_object["spec_version"])
         type_ql += ';\n'
-    elif stix_object.definition_type == "tlp":
+    elif stix_object["definition_type"] == "tlp":
         type_ql = ''
 
     match = ''
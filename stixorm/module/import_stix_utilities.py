@@ -1,11 +1,17 @@
+import contextlib
+import contextvars
+import hashlib
 import json
 import types
 import datetime
+import pkgutil
+import re
 
 from stix2 import *
 from stix2.v21 import *
-from stix2.utils import is_object, is_stix_type, get_type_from_id, is_sdo, is_sco, is_sro
+from stix2.utils import is_object, is_stix_type, get_type_from_id, is_sdo, is_sco, is_sro, parse_into_datetime
 from stix2.parsing import parse
+from stix2.serialization import STIXJSONEncoder
 from .definitions.stix21 import stix_models
 
 import logging
@@ -48,11 +54,11 @@ def add_property_to_typeql(prop, obj_tql, obj, prop_var_list):
     type_ql = type_ql_props = ''
     tql_prop_name = obj_tql[prop]
     # if property is defanged, summary or revoked, and the value is false, then don't add it to typedb description
-    if prop == "defanged" and obj.defanged == False:
+    if prop == "defanged" and obj["defanged"] == False:
         return type_ql, type_ql_props, prop_var_list
-    elif prop == "revoked" and obj.revoked == False:
+    elif prop == "revoked" and obj["revoked"] == False:
         return type_ql, type_ql_props, prop_var_list
-    elif prop == "summary" and obj.summary == False:
+    elif prop == "summary" and obj["summary"] == False:
         return type_ql, type_ql_props, prop_var_list
     
     # or else add the property to the typeql statement
@@ -86,7 +92,7 @@ def add_property_to_typeql(prop, obj_tql, obj, prop_var_list):
 # 1.6) Sub Object Methods for adding embedded structures
 #                -  e.g. hasehs, kill-chain-phases, created_by, external_references, object_marking_refs etc.
 #--------------------------------------------------
-# Giant Switch statement to add the embedded relations to the typeql statement
+# Dispatch each embedded relation to its method, through the sub_object_handlers registry
 
 def add_relation_to_typeql(rel, obj, obj_var, prop_var_list=[], inc=-1):
     """
@@ -102,95 +108,12 @@ def add_relation_to_typeql(rel, obj, obj_var, prop_var_list=[], inc=-1):
         match: the typeql match string
         insert: the typeql insert string
     """
-    if rel == "granular_markings":
-        match, insert = granular_markings( rel, obj[rel], obj_var, prop_var_list)
-    
-    # hashes type
-    elif (rel == "hashes"
-          or rel == "file_header_hashes"):
-        match, insert = hashes( rel, obj[rel], obj_var)
-
-    # insert key value store
-    elif (rel == "additional_header_fields"
-          or rel == "document_info_dict"
-          or rel == "exif_tags"
-          or rel == "ipfix"
-          or rel == "request_header"
-          or rel == "options"
-          or rel == "environment_variables"
-          or rel == "startup_info"):
-        match, insert = key_value_store( rel, obj[rel], obj_var)
-    
-    # insert list of object relation
-    elif (rel == "body_multipart"
-          or rel == "external_references"
-          or rel == "kill_chain_phases"
-          or rel == "sections"
-          or rel == "alternate_data_streams"
-          or rel == "values"):
-        match, insert = list_of_object( rel, obj[rel], obj_var)
-    
-    # insert embedded relations based on stix-id
-    elif (rel == "object_refs"
-          or rel == "created_by_ref"
-          or rel == "object_marking_refs"
-          or rel == "sample_refs"
-          or rel == "host_vm_ref"
-          or rel == "operating_system_ref"
-          or rel == "installed_software_refs"
-          or rel == "analysis_sco_refs"
-          or rel == "sample_ref"
-          or rel == "contains_refs"
-          or rel == "resolves_to_refs"
-          or rel == "belongs_to_ref"
-          or rel == "belongs_to_refs"
-          or rel == "raw_email_ref"
-          or rel == "from_ref"
-          or rel == "sender_ref"
-          or rel == "to_refs"
-          or rel == "cc_refs"
-          or rel == "bcc_refs"
-          or rel == "body_raw_ref"
-          or rel == "raw_email_ref"
-          or rel == "content_ref"
-          or rel == "parent_directory_ref"
-          or rel == "src_ref"
-          or rel == "dst_ref"
-          or rel == "src_payload_ref"
-          or rel == "dst_payload_ref"
-          or rel == "encapsulates_refs"
-          or rel == "encapsulated_by_ref"
-          or rel == "message_body_data_ref"
-          or rel == "opened_connection_refs"
-          or rel == "creator_user_ref"
-          or rel == "image_ref"
-          or rel == "parent_ref"
-          or rel == "child_refs"
-          or rel == "service_dll_refs"): 
-        match, insert = embedded_relation( rel, obj[rel], obj_var, inc)
-    
-    # insert plain sub-object with relation
-    elif (rel == "x509_v3_extensions"
-          or rel == "optional_header"):
-        match, insert = load_object( rel, obj[rel], obj_var)
-        
-    # insert  SCO Extensions here, a possible dict of sub-objects
-    elif rel == "extensions":
-        match, insert = extensions( rel, obj[rel], obj_var)
-    
-    # ignore the following relations as they are already processed, for Relationships, Sightings and Extensions
-    elif (rel == "sighting_of_ref" 
-          or rel == "observed_data_refs" 
-          or rel == "where_sighted_refs"
-          or rel == "source_ref" 
-          or rel == "target_ref"):
-        match = insert = ''
-    
-    else:
-        logger.error(f'relation type not known, rel -> {rel}')
-        match = insert = ""
-        
-    return match, insert
+    handler = sub_object_handlers.get(rel)
+    if handler is None:
+        logger.error(f'relation type not known, rel -> {rel}, on {obj_var[1:]} {obj.get("id", "")}')
+        return '', ''
+    method, config = handler
+    return method(rel, obj[rel], obj_var, prop_var_list, inc, config)
 
 
 #---------------------------------------------------
@@ -215,24 +138,24 @@ def extensions(prop_name, prop_dict, parent_var):
     # for each key in the dict (extension type)
     #logger.debug('--------------------- extensions ----------------------------')
     for ext_type in prop_dict:
-        for ext_type_ql in stix_models["ext_typeql_dict_list"]:
-            if ext_type == ext_type_ql["stix"]:
-                match2, insert2 = load_object(ext_type, prop_dict[ext_type], parent_var)
-                match = match + match2
-                insert = insert + insert2
-                break
+        config = ext_typeql_configs.get(ext_type)
+        if config is not None:
+            match2, insert2 = load_object(ext_type, prop_dict[ext_type], parent_var, config)
+            match = match + match2
+            insert = insert + insert2
         
     return match, insert
 
 
 
-def load_object(prop_name, prop_dict, parent_var):
+def load_object(prop_name, prop_dict, parent_var, config=None):
     """
         Create the Typeql for a sub object
     Args:
         prop_name (): the name of the extension
         prop_dict (): the dict for the extension
         parent_var (): the var of the Stix object that is the owner
+        config (): the ext_typeql_dict_list mapping of the sub object, looked up by name if not given
 
     Returns:
         match: the typeql match string
@@ -241,41 +164,40 @@ def load_object(prop_name, prop_dict, parent_var):
     match = insert = type_ql = type_ql_props = ''
     # as long as it is predefined, load the object
     #logger.debug('------------------- load object ------------------------------')
-    for prop_type in stix_models["ext_typeql_dict_list"]:
-        if prop_name == prop_type["stix"]:
-            tot_prop_list = [tot for tot in prop_dict.keys()]
-            obj_tql = prop_type["dict"]
-            obj_var = '$' + prop_type["object"]
-            reln = prop_type["relation"]
-            rel_var = '$' + reln
-            rel_owner = prop_type["owner"]
-            rel_pointed_to = prop_type["pointed-to"]
-            type_ql += ' ' + obj_var + ' isa ' + prop_type["object"]
-            # Split them into properties and relations
-            properties, relations = split_on_activity_type(tot_prop_list, obj_tql)     
-            prop_var_list = []
-            for prop in properties:
-                # split off for properties processing
-                type_ql2, type_ql_props2, prop_var_list = add_property_to_typeql(prop, obj_tql, prop_dict, prop_var_list)
-                # then add them all together
-                type_ql += type_ql2
-                type_ql_props += type_ql_props2        
-            # add a terminator on the end of the insert statement
-            type_ql += ";\n" +  type_ql_props + "\n\n"
+    prop_type = config or ext_typeql_configs.get(prop_name)
+    if prop_type is not None:
+        tot_prop_list = [tot for tot in prop_dict.keys()]
+        obj_tql = prop_type["dict"]
+        obj_var = '$' + prop_type["object"]
+        reln = prop_type["relation"]
+        rel_var = '$' + reln
+        rel_owner = prop_type["owner"]
+        rel_pointed_to = prop_type["pointed-to"]
+        type_ql += ' ' + obj_var + ' isa ' + prop_type["object"]
+        # Split them into properties and relations
+        properties, relations = split_on_activity_type(tot_prop_list, obj_tql)     
+        prop_var_list = []
+        for prop in properties:
+            # split off for properties processing
+            type_ql2, type_ql_props2, prop_var_list = add_property_to_typeql(prop, obj_tql, prop_dict, prop_var_list)
+            # then add them all together
+            type_ql += type_ql2
+            type_ql_props += type_ql_props2        
+        # add a terminator on the end of the insert statement
+        type_ql += ";\n" +  type_ql_props + "\n\n"
+        
+        # add each of the relations to the match and insert statements
+        for rel in relations:        
+            # split off for relation processing
+            match2, insert2 = add_relation_to_typeql(rel, prop_dict, obj_var, prop_var_list)
+            # then add it back together    
+            match = match +  match2
+            insert = insert + "\n" + insert2                   
             
-            # add each of the relations to the match and insert statements
-            for rel in relations:        
-                # split off for relation processing
-                match2, insert2 = add_relation_to_typeql(rel, prop_dict, obj_var, prop_var_list)
-                # then add it back together    
-                match = match +  match2
-                insert = insert + "\n" + insert2                   
-                
-            # finally, connect the local object to the parent object
-            type_ql += ' ' + rel_var + ' (' + rel_owner + ':' + parent_var 
-            type_ql += ', ' + rel_pointed_to + ':' + obj_var + ')'
-            type_ql += ' isa ' + reln + ';\n'
-            break            
+        # finally, connect the local object to the parent object
+        type_ql += ' ' + rel_var + ' (' + rel_owner + ':' + parent_var 
+        type_ql += ', ' + rel_pointed_to + ':' + obj_var + ')'
+        type_ql += ' isa ' + reln + ';\n'
         
     insert =  type_ql + "\n" + insert
     return match, insert
@@ -283,42 +205,47 @@ def load_object(prop_name, prop_dict, parent_var):
 
 
 
-def list_of_object(prop_name, prop_value_list, parent_var):
+def list_of_object(prop_name, prop_value_list, parent_var, config=None):
     """
         Create the Typeql for the list of object sub object
     Args:
         prop_name (): the name of the object
         prop_value_list (): the list of object
         parent_var (): the var of the Stix object that is the owner
+        config (): the list_of_object_typeql mapping of the list, looked up by name if not given
 
     Returns:
         match: the typeql match string
         insert: the typeql insert string
     """
-    for config in stix_models["list_of_object_typeql"]:
-        if config["name"] == prop_name:
-            rel_typeql = config["typeql"]
-            obj_props_tql = config["typeql_props"]
-            role_owner = config["owner"]
-            role_pointed = config["pointed_to"]
-            typeql_obj = config["object"]
-            break
+    config = config or list_of_object_configs[prop_name]
+    rel_typeql = config["typeql"]
+    obj_props_tql = config["typeql_props"]
+    role_owner = config["owner"]
+    role_pointed = config["pointed_to"]
+    typeql_obj = config["object"]
         
     lod_list = []
     match = rel_insert = rel_match = insert = ''
     for i, dict_instance in enumerate(prop_value_list):
         lod_var = '$' + typeql_obj + str(i)
         lod_list.append(lod_var)
-        insert += lod_var + ' isa ' + typeql_obj
+        lod_insert = lod_var + ' isa ' + typeql_obj
+        lod_match = lod_rel_insert = ''
         for key in dict_instance:
             typeql_prop = obj_props_tql[key]
             if typeql_prop == '':
                 rel_match2, rel_insert2 = add_relation_to_typeql(key, dict_instance, lod_var, [], i)    
-                rel_insert += rel_insert2
-                rel_match += rel_match2                            
+                lod_rel_insert += rel_insert2
+                lod_match += rel_match2                            
             else:
-                insert += ',\n has ' + typeql_prop + ' ' + val_tql(dict_instance[key])
-        insert += ';\n'
+                lod_insert += ',\n has ' + typeql_prop + ' ' + val_tql(dict_instance[key])
+        if _shared_sub_objects.get() is None or prop_name not in shared_list_of_objects:
+            insert += lod_insert + ';\n'
+            rel_insert += lod_rel_insert
+            rel_match += lod_match
+        else:
+            match += shared_sub_object(lod_var, typeql_obj, dict_instance, lod_insert, lod_match, lod_rel_insert)
         
     insert += '\n $' + rel_typeql + ' (' + role_owner + ':' + parent_var 
     for lod_var in lod_list:
@@ -328,26 +255,25 @@ def list_of_object(prop_name, prop_value_list, parent_var):
     match += rel_match
     return match, insert
 
-def key_value_store( prop, prop_value_dict, obj_var):
+def key_value_store( prop, prop_value_dict, obj_var, config=None):
     """
         Create the Typeql for the key-value store sub object
     Args:
         prop (): the name of the object
         prop_value_dict (): the dict of object
         obj_var (): the var of the Stix object that is the owner
+        config (): the key_value_typeql_list mapping of the store, looked up by name if not given
 
     Returns:
         match: the typeql match string
         insert: the typeql insert string
     """
-    for config in stix_models["key_value_typeql_list"]:
-        if config["name"] == prop:
-            rel_typeql = config["typeql"]
-            role_owner = config["owner"]
-            role_pointed = config["pointed_to"]
-            d_key = config["key"]
-            d_value = config["value"]
-            break
+    config = config or key_value_configs[prop]
+    rel_typeql = config["typeql"]
+    role_owner = config["owner"]
+    role_pointed = config["pointed_to"]
+    d_key = config["key"]
+    d_value = config["value"]
     
     match = ''
     insert = '\n'
@@ -391,7 +317,12 @@ def hashes(prop_name, prop_dict, parent_var):
         hash_var = '$hash' + str(i)
         hash_var_list.append(hash_var)
         if key in stix_models["hash_typeql_dict"]:
-            insert += ' ' + hash_var + ' isa ' + stix_models["hash_typeql_dict"][key] + ', has hash-value ' + val_tql(prop_dict[key]) + ';\n'        
+            hash_type = stix_models["hash_typeql_dict"][key]
+            hash_insert = ' ' + hash_var + ' isa ' + hash_type + ', has hash-value ' + val_tql(prop_dict[key])
+            if _shared_sub_objects.get() is None:
+                insert += hash_insert + ';\n'
+            else:
+                match += shared_sub_object(hash_var, hash_type, prop_dict[key], hash_insert)
         else:
           logger.error(f'Unknown hash type {key}')
           
@@ -435,6 +366,69 @@ def granular_markings(prop_name, prop_value_List, parent_var, prop_var_list):
     return match, insert
 
 
+# the sub-objects shared by content key in the conversion running in this context, or None when not sharing
+# hashes are always shared then, and of the lists of objects, only these
+shared_list_of_objects = ("kill_chain_phases", "external_references")
+_shared_sub_objects = contextvars.ContextVar("shared_sub_objects", default=None)
+
+
+@contextlib.contextmanager
+def collect_shared_sub_objects():
+    """
+        Share identical hashes, kill chain phases and external references between the objects
+        converted in this context, instead of inserting a copy for each. Each sub-object is
+        matched in by its content key, and its own insert is collected, to be run first if no
+        sub-object with that key is stored yet
+    Returns:
+        shared []: the collected sub-objects, each a dict of its content key, its typeql
+            variable, and the match and insert statements that create it, nested ones first
+    """
+    shared = []
+    token = _shared_sub_objects.set(shared)
+    try:
+        yield shared
+    finally:
+        _shared_sub_objects.reset(token)
+
+
+def content_key(typeql_obj, value):
+    """
+        Compute the content key of a sub-object, the same for every sub-object of the same type and value
+    Args:
+        typeql_obj (): the typeql entity type of the sub-object
+        value (): the STIX value of the sub-object
+
+    Returns:
+        key: the hex digest identifying the content
+    """
+    content = json.dumps([typeql_obj, value], sort_keys=True, cls=STIXJSONEncoder)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def shared_sub_object(var, typeql_obj, value, entity_insert, match='', insert=''):
+    """
+        Collect a sub-object to be shared by content key, and match it in its place
+    Args:
+        var (): the typeql variable of the sub-object
+        typeql_obj (): the typeql entity type of the sub-object
+        value (): the STIX value of the sub-object
+        entity_insert (): the insert of the sub-object entity and its properties, without a terminator
+        match (): the match statement of the references of its own sub-objects
+        insert (): the insert statement of the relations to its own sub-objects
+
+    Returns:
+        match: the typeql match string that finds the shared sub-object
+    """
+    key = content_key(typeql_obj, value)
+    _shared_sub_objects.get().append({
+        "key": key,
+        "var": var.strip()[1:],
+        "match": match,
+        "insert": entity_insert + ',\n has content-key "' + key + '";\n' + insert,
+    })
+    return ' ' + var.strip() + ' isa ' + typeql_obj + ', has content-key "' + key + '";\n'
+
+
 def get_selector_var(selector, prop_var_list):
     """
         Get the typeql variable for the property
@@ -474,24 +468,24 @@ def get_selector_var(selector, prop_var_list):
 # analysis_sco_refs
 # etc.
 
-def embedded_relation(prop, prop_value, obj_var, inc):
+def embedded_relation(prop, prop_value, obj_var, inc, config=None):
     """
         Create the Typeql for the embedded relation sub object
     Args:
         prop (): the name of the object
         prop_value (): the value of object
         obj_var (): the var of the Stix object that is the owner
+        inc (): an incrementing variable that is used to add to the var string
+        config (): the embedded_relations_typeql mapping of the relation, looked up by name if not given
 
     Returns:
         match: the typeql match string
         insert: the typeql insert string
     """
-    for ex in stix_models["embedded_relations_typeql"]:
-      if ex["rel"] == prop:
-        owner = ex["owner"]
-        pointed_to = ex["pointed-to"]
-        relation = ex["typeql"]
-        break
+    ex = config or embedded_relation_configs[prop]
+    owner = ex["owner"]
+    pointed_to = ex["pointed-to"]
+    relation = ex["typeql"]
     
     prop_var_list = []
     match = ''
@@ -525,6 +519,75 @@ def embedded_relation(prop, prop_value, obj_var, inc):
     return match, insert
 
 
+#---------------------------------------------------
+#        SUB-OBJECT DISPATCH REGISTRY
+#---------------------------------------------------
+
+
+def _configs_by_name(configs, name_key):
+    """
+        Index a list of sub-object mappings by their STIX name, keeping the first of any repeated name
+    """
+    indexed = {}
+    for config in configs:
+        indexed.setdefault(config[name_key], config)
+    return indexed
+
+
+embedded_relation_configs = _configs_by_name(stix_models["embedded_relations_typeql"], "rel")
+list_of_object_configs = _configs_by_name(stix_models["list_of_object_typeql"], "name")
+key_value_configs = _configs_by_name(stix_models["key_value_typeql_list"], "name")
+ext_typeql_configs = _configs_by_name(stix_models["ext_typeql_dict_list"], "stix")
+# the references that sro_to_typeql has already matched, as role players of the relationship or sighting
+sro_role_refs = ("sighting_of_ref", "observed_data_refs", "where_sighted_refs", "source_ref", "target_ref")
+
+
+def _handler(method, *args, config=None):
+    """
+        Make a sub_object_handlers entry, calling method with the property name, its value and the
+        object variable, followed by the named ones of prop_var_list, inc and config
+    Returns:
+        handler: the (method, config) pair
+    """
+    def handle(rel, value, obj_var, prop_var_list, inc, config):
+        extra = {"prop_var_list": prop_var_list, "inc": inc, "config": config}
+        return method(rel, value, obj_var, *(extra[arg] for arg in args))
+    return handle, config
+
+
+def _sub_object_handlers():
+    """
+        Build the map of each STIX sub-object property name to the method that converts it, and
+        its mapping from stix_models, so that add_relation_to_typeql needs one dict lookup. Where a
+        name is in more than one mapping list, the first kind of method below wins
+    Returns:
+        handlers {}: the STIX property name to a (method, config) pair, each method taking
+            (rel, value, obj_var, prop_var_list, inc, config)
+    """
+    handlers = {
+        "granular_markings": _handler(granular_markings, "prop_var_list"),
+        "hashes": _handler(hashes),
+        "file_header_hashes": _handler(hashes),
+        "extensions": _handler(extensions),
+    }
+    for name, config in key_value_configs.items():
+        handlers.setdefault(name, _handler(key_value_store, "config", config=config))
+    for name, config in list_of_object_configs.items():
+        handlers.setdefault(name, _handler(list_of_object, "config", config=config))
+    for name, config in embedded_relation_configs.items():
+        handlers.setdefault(name, _handler(embedded_relation, "inc", "config", config=config))
+    # extension keys are hyphenated, and reached through extensions, the rest are sub-object properties
+    for name, config in ext_typeql_configs.items():
+        if "-" not in name:
+            handlers.setdefault(name, _handler(load_object, "config", config=config))
+    for name in sro_role_refs:
+        handlers.setdefault(name, _handler(lambda rel, value, obj_var: ('', '')))
+    return handlers
+
+
+sub_object_handlers = _sub_object_handlers()
+
+
 def get_embedded_match(source_id, i=1):
     """
         Assemble the typeql variable and match statement given the stix-id, and the increment
@@ -592,6 +655,77 @@ def val_tql(val):
         return logger.error(f'value  not supported: {val}')
 
 
+def _timestamp_properties():
+    """
+        Find the Stix property names that map onto a datetime attribute in the schema
+    Returns:
+        timestamp_props, a frozenset of Stix property names
+    """
+    schema = pkgutil.get_data("stixorm.schema", "cti-schema-v2.tql").decode("utf-8")
+    tql_timestamps = set(re.findall(r'^\s*([\w-]+) sub stix-attribute-timestamp', schema, re.MULTILINE))
+    mappings = list(stix_models["dispatch_stix"].values())
+    mappings += [stix_models["sdo_typeql_dict"], stix_models["sro_base_typeql_dict"], stix_models["sco_base_typeql_dict"]]
+    mappings += [ext["dict"] for ext in stix_models["ext_typeql_dict_list"]]
+    mappings += [lot["typeql_props"] for lot in stix_models["list_of_object_typeql"]]
+    return frozenset(stix_name for mapping in mappings
+                     for stix_name, tql_name in mapping.items() if tql_name in tql_timestamps)
+
+
+timestamp_props = _timestamp_properties()
+
+
+def apply_parse_defaults(stix_dict):
+    """
+        Fill in the defaults that the stix2 parse gives a top level Stix dict, that are stored: the
+        spec_version, and the pattern_version of an indicator with a STIX pattern. The parse also
+        defaults a missing created, modified or valid_from to the current time, which is left out,
+        as a trusted dict is expected to have them. The flags that default to False, such as
+        revoked and defanged, are not stored when False, so they need no default
+    Args:
+        stix_dict (): the coerced Stix dict, which is changed in place
+
+    Returns:
+        stix_dict {}: the same dict
+    """
+    if "type" in stix_dict and "id" in stix_dict:
+        stix_dict.setdefault("spec_version", "2.1")
+        if stix_dict["type"] == "indicator" and stix_dict.get("pattern") and stix_dict.get("pattern_type") == "stix":
+            stix_dict.setdefault("pattern_version", "2.1")
+    return stix_dict
+
+
+def coerce_trusted_dict(stix_dict):
+    """
+        Prepare a plain, already validated, Stix dict for conversion without parsing it into a
+        python Stix object, by turning its timestamp strings into datetimes, at any depth, and
+        filling in the defaults the parse would, see apply_parse_defaults
+    Args:
+        stix_dict (): the Stix dict, as loaded from json
+
+    Returns:
+        coerced {}: a copy of the dict, ready for conversion to typeql
+    """
+    return apply_parse_defaults(_coerce_timestamps(stix_dict))
+
+
+def _coerce_timestamps(stix_dict):
+    """
+        Copy a Stix dict, turning its timestamp strings into datetimes, at any depth
+    """
+    coerced = {}
+    for key, value in stix_dict.items():
+        if key in timestamp_props and isinstance(value, str):
+            coerced[key] = parse_into_datetime(value)
+        elif isinstance(value, dict):
+            coerced[key] = _coerce_timestamps(value)
+        elif isinstance(value, list):
+            coerced[key] = [_coerce_timestamps(v) if isinstance(v, dict) else v for v in value]
+        else:
+            coerced[key] = value
+
+    return coerced
+
+
 def split_on_activity_type(total_props, obj_tql):
     """
         Split the Stix object properties into flat properties and sub objects
@@ -606,6 +740,8 @@ def split_on_activity_type(total_props, obj_tql):
     prop_list = []
     rel_list = []
     for prop in total_props:
+      if prop not in obj_tql:
+        raise ValueError(f'property not known, prop -> {prop}')
       tql_prop_name = obj_tql[prop]
       
       if tql_prop_name == "":
@@ -0,0 +1,154 @@
+"""Reference graph of a STIX bundle, used to order the objects for ingest"""
+from collections.abc import Mapping
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def get_object_refs(stix_obj):
+    """
+        Collect the stix-id's that a STIX object refers to, at any depth.
+        This covers created_by_ref, object_refs, source_ref and target_ref, sighting_of_ref,
+        the marking_ref of granular markings, and the refs held inside extensions and sub objects
+    Args:
+        stix_obj (): a STIX object, either a python STIX object or a dict
+
+    Returns:
+        refs set(): the set of referenced stix-id's
+    """
+    refs = set()
+    _collect_refs(stix_obj, refs)
+    refs.discard(stix_obj.get("id"))
+    return refs
+
+
+def _collect_refs(value, refs):
+    """
+        Walk a STIX value, adding the values of every *_ref and *_refs key onto the refs set
+    """
+    if isinstance(value, Mapping):
+        for key, sub_value in value.items():
+            if key.endswith("_ref") and isinstance(sub_value, str):
+                refs.add(sub_value)
+            elif key.endswith("_refs") and isinstance(sub_value, list):
+                refs.update(ref for ref in sub_value if isinstance(ref, str))
+            else:
+                _collect_refs(sub_value, refs)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_refs(item, refs)
+
+
+def build_reference_graph(stix_objects):
+    """
+        Build the dependency graph of a collection of STIX objects. Only references to objects
+        that are in the collection are kept, as anything else must already be in the database
+    Args:
+        stix_objects (): an iterable of STIX objects
+
+    Returns:
+        graph {}: a dict of stix-id to the set of in-collection stix-id's it depends on
+    """
+    stix_objects = list(stix_objects)
+    graph = {stix_obj["id"]: set() for stix_obj in stix_objects}
+    for stix_obj in stix_objects:
+        refs = get_object_refs(stix_obj)
+        graph[stix_obj["id"]].update(ref for ref in refs if ref in graph)
+
+    return graph
+
+
+def topological_waves(graph):
+    """
+        Split a dependency graph into waves, where every object in a wave only depends on
+        objects in earlier waves, so each wave can be written concurrently
+    Args:
+        graph (): a dict of stix-id to the set of stix-id's it depends on
+
+    Returns:
+        waves []: a list of lists of stix-id's, in the order they should be written
+        cycles []: a list of the reference cycles found, each a list of stix-id's. The objects
+            in, or depending on, a cycle are not in any wave
+    """
+    dependants = {node: [] for node in graph}
+    remaining = {}
+    for node, deps in graph.items():
+        remaining[node] = len(deps)
+        for dep in deps:
+            dependants[dep].append(node)
+
+    waves = []
+    wave = sorted(node for node, count in remaining.items() if count == 0)
+    while wave:
+        waves.append(wave)
+        next_wave = []
+        for node in wave:
+            del remaining[node]
+            for dependant in dependants[node]:
+                remaining[dependant] -= 1
+                if remaining[dependant] == 0:
+                    next_wave.append(dependant)
+        wave = sorted(next_wave)
+
+    cycles = []
+    if remaining:
+        blocked = {node: graph[node] & remaining.keys() for node in remaining}
+        cycles = find_cycles(blocked)
+        logger.warning(f'{len(remaining)} objects are in or behind {len(cycles)} reference cycles')
+
+    return waves, cycles
+
+
+def find_cycles(graph):
+    """
+        Find the reference cycles in a dependency graph, as its strongly connected components
+        (Tarjan's algorithm, written iteratively so that long chains do not hit the recursion limit)
+    Args:
+        graph (): a dict of stix-id to the set of stix-id's it depends on
+
+    Returns:
+        cycles []: a list of cycles, each a sorted list of stix-id's
+    """
+    index = {}
+    low_link = {}
+    on_stack = set()
+    stack = []
+    cycles = []
+    counter = 0
+    for root in graph:
+        if root in index:
+            continue
+        work = [(root, iter(graph[root]))]
+        index[root] = low_link[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low_link[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(graph[child])))
+                    break
+                elif child in on_stack:
+                    low_link[node] = min(low_link[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low_link[parent] = min(low_link[parent], low_link[node])
+                if low_link[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in graph[node]:
+                        cycles.append(sorted(component))
+
+    return cycles
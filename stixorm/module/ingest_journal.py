@@ -0,0 +1,155 @@
+"""Checkpoint journal of committed batches, so that an interrupted ingest can resume"""
+import json
+import os
+import threading
+from bisect import bisect_right
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class IngestJournal:
+    """Append-only, on-disk record of the batches committed by a TypeDBSink.
+
+    Each line of the journal is a json record of one committed batch, listing the
+    index of each object in the input together with its stix-id. Reopening the
+    journal on a restarted ingest of the same input lets the sink skip every object
+    that was already committed.
+
+    In memory, the committed indexes are kept as ranges, and the stix-ids of a sample
+    of them, one index in sample_every, so that a large ingest does not hold every
+    stix-id. The stix-id is checked at the sampled indexes, index 0 among them, and
+    on the first mismatch the journal is taken to belong to different input, and
+    nothing more is skipped.
+
+    A crash part way through writing a record leaves a truncated last line, which
+    is cut off on load, so its batch is simply written again, and the next record
+    starts on a line of its own.
+
+    Args:
+        - path (str): The path of the journal file, created if it does not exist
+        - sample_every (int): One index in this many has its stix-id kept and checked
+
+    """
+    def __init__(self, path, sample_every=64):
+        self.path = path
+        self.sample_every = sample_every
+        self._starts = []
+        self._ends = []
+        self._samples = {}
+        self._mismatched = False
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(path, 'a', encoding='utf-8')
+        if self._starts:
+            logger.info(f'resuming ingest, {len(self)} objects already committed, '
+                        f'continuing from object {self.resume_index}')
+
+    def _load(self):
+        """
+            Read the committed objects from an existing journal file, and cut off an incomplete last line
+        """
+        if not os.path.exists(self.path):
+            return
+        complete = 0
+        with open(self.path, 'rb') as journal_file:
+            for line_no, line in enumerate(journal_file):
+                if not line.endswith(b'\n'):
+                    logger.warning(f'cutting off the incomplete journal record at line {line_no} of {self.path}')
+                    break
+                complete += len(line)
+                try:
+                    record = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    logger.warning(f'ignoring corrupt journal record at line {line_no} of {self.path}')
+                    continue
+                for index, stix_id in record["objects"]:
+                    self._add(index, stix_id)
+        if complete < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(complete)
+
+    def _add(self, index, stix_id):
+        """
+            Add a committed index to the ranges, keeping its stix-id if it is sampled
+        """
+        if index is None:
+            return
+        if index % self.sample_every == 0:
+            self._samples[index] = stix_id
+        i = bisect_right(self._starts, index) - 1
+        if i >= 0 and index < self._ends[i]:
+            return
+        joins_left = i >= 0 and self._ends[i] == index
+        joins_right = i + 1 < len(self._starts) and self._starts[i + 1] == index + 1
+        if joins_left and joins_right:
+            self._ends[i] = self._ends.pop(i + 1)
+            del self._starts[i + 1]
+        elif joins_left:
+            self._ends[i] = index + 1
+        elif joins_right:
+            self._starts[i + 1] = index
+        else:
+            self._starts.insert(i + 1, index)
+            self._ends.insert(i + 1, index + 1)
+
+    def _contains(self, index):
+        i = bisect_right(self._starts, index) - 1
+        return i >= 0 and index < self._ends[i]
+
+    def __len__(self):
+        return sum(end - start for start, end in zip(self._starts, self._ends))
+
+    @property
+    def resume_index(self):
+        """
+            The index of the first object in the input that has not been committed
+        """
+        if self._starts and self._starts[0] == 0:
+            return self._ends[0]
+        return 0
+
+    def is_committed(self, index, stix_id):
+        """
+            Check whether the object at this index of the input has already been committed
+        Args:
+            index (): the position of the object in the input
+            stix_id (): the stix-id of the object
+
+        Returns:
+            bool: True if the object can be skipped
+        """
+        with self._lock:
+            if self._mismatched or index is None or not self._contains(index):
+                return False
+            committed_id = self._samples.get(index)
+            if committed_id is not None and committed_id != stix_id:
+                logger.warning(f'journal mismatch at object {index}, {committed_id} was committed, found {stix_id}, '
+                               f'the journal {self.path} is ignored from here on')
+                self._mismatched = True
+                return False
+            return True
+
+    def record(self, batch_no, batch):
+        """
+            Durably record that a batch has been committed
+        Args:
+            batch_no (): the number of the batch
+            batch (): the list of committed entries, each holding its index and stix-id
+        """
+        record = {"batch": batch_no, "objects": [[entry["index"], entry["stix_id"]] for entry in batch]}
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            for entry in batch:
+                self._add(entry["index"], entry["stix_id"])
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,340 @@
+"""Pipelined ingest: TypeQL generation on a process pool, feeding TypeDB writer threads"""
+import json
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from collections.abc import Iterator, Mapping
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+from stix2.base import _STIXBase
+from stix2.parsing import parse
+
+from .import_stix_to_typeql import raw_stix2_to_typeql, split_ref_lists
+from .import_stix_utilities import coerce_trusted_dict, collect_shared_sub_objects
+from .dead_letter import describe_error
+from .ingest_graph import get_object_refs
+from .kill_chains import kill_chain_phase_vars
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def make_entry(stix_obj, import_type, index=None, keep_object=False, max_refs=None, share_sub_objects=False):
+    """
+        Convert a STIX object, or a trusted dict, into the batch entry written by the sink
+    Args:
+        stix_obj (): a python STIX object or a coerced STIX dict
+        import_type (): the type of import STIX21 or ATT&CK
+        index (): the position of the object in the input
+        keep_object (): if True, the entry also holds the object, for the dead-letter file
+        max_refs (): if given, reference lists longer than this are split, and the entry
+            holds followups, the (match, insert) queries adding the rest of the references
+        share_sub_objects (): if True, hashes, kill chain phases and external references are
+            matched by content key, and the entry holds shared, the sub-objects to create first
+
+    Returns:
+        entry {}: the stix-id, type and input index of the object, the stix-ids it refers to,
+            and its typeql match and insert statements, and the variables of its kill chain
+            phases, to the name of the kill chain each belongs to, if any
+    """
+    followups = []
+    converted_obj = stix_obj
+    if max_refs:
+        converted_obj, followups = split_ref_lists(stix_obj, max_refs)
+    with collect_shared_sub_objects() if share_sub_objects else nullcontext() as shared:
+        match_tql, insert_tql = raw_stix2_to_typeql(converted_obj, import_type)
+    entry = {
+        "stix_id": stix_obj["id"],
+        "stix_type": stix_obj["type"],
+        "index": index,
+        "refs": sorted(get_object_refs(stix_obj)),
+        "match": match_tql,
+        "insert": insert_tql,
+    }
+    if followups:
+        entry["followups"] = followups
+    if shared:
+        entry["shared"] = shared
+    phase_vars = kill_chain_phase_vars(stix_obj)
+    if phase_vars:
+        entry["kill_chains"] = phase_vars
+    if keep_object:
+        entry["object"] = stix_obj
+    return entry
+
+
+def convert_chunk(indexed_dicts, import_type, trusted, allow_custom, dead_letter=False, max_refs=None,
+                  share_sub_objects=False):
+    """
+        Convert a chunk of STIX dicts into batch entries. This runs in the worker processes,
+        so it takes plain dicts, which are cheap to pickle, and does the parse there
+    Args:
+        indexed_dicts (): a list of (input index, STIX dict) pairs
+        import_type (): the type of import STIX21 or ATT&CK
+        trusted (): if True, skip the stix2 parse
+        allow_custom (): allow custom objects in the stix2 parse
+        dead_letter (): if True, an object that fails is returned as a failure, holding its
+            stage and error, instead of raising, and entries hold their STIX dict
+        max_refs (): the longest reference list written in one query, see make_entry
+        share_sub_objects (): share sub-objects by content key, see make_entry
+
+    Returns:
+        entries []: a list of batch entries and failures
+    """
+    entries = []
+    for index, stix_dict in indexed_dicts:
+        stage = "parse"
+        try:
+            if trusted:
+                stix_obj = coerce_trusted_dict(stix_dict)
+            else:
+                stix_obj = parse(stix_dict, allow_custom=allow_custom)
+            stage = "convert"
+            entry = make_entry(stix_obj, import_type, index, max_refs=max_refs, share_sub_objects=share_sub_objects)
+        except Exception as e:
+            if not dead_letter:
+                raise
+            entries.append({"failed": stage, "error": describe_error(e), "index": index, "object": stix_dict})
+            continue
+        if dead_letter:
+            entry["object"] = stix_dict
+        entries.append(entry)
+
+    return entries
+
+
+def convert_in_processes(indexed_dicts, processes, chunk_size, import_type, trusted, allow_custom,
+                         dead_letter=False, max_refs=None, share_sub_objects=False):
+    """
+        Convert STIX dicts into batch entries on a process pool, yielding them in input order,
+        with a bounded number of chunks in flight so that memory stays flat
+    Args:
+        indexed_dicts (): an iterable of (input index, STIX dict) pairs
+        processes (): the number of processes
+        chunk_size (): the number of objects sent to a process at a time
+        import_type (): the type of import STIX21 or ATT&CK
+        trusted (): if True, skip the stix2 parse
+        allow_custom (): allow custom objects in the stix2 parse
+        dead_letter (): if True, failures are yielded instead of raised, see convert_chunk
+        max_refs (): the longest reference list written in one query, see make_entry
+        share_sub_objects (): share sub-objects by content key, see make_entry
+
+    Returns:
+        entry {}: each batch entry or failure in turn
+    """
+    in_flight = max(2 * processes, 1)
+    # a forked process would inherit the gRPC channels of the pooled TypeDB clients, which do not survive a fork
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        pending = deque()
+        for chunk in _chunked(indexed_dicts, chunk_size):
+            pending.append(executor.submit(convert_chunk, chunk, import_type, trusted, allow_custom, dead_letter,
+                                           max_refs, share_sub_objects))
+            if len(pending) >= in_flight:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def iter_stix_dicts(stix_data):
+    """
+        Flatten STIX input into plain STIX dicts, without parsing them
+    Args:
+        stix_data (): a STIX object, dict, json string, bundle, or a list or iterator of these
+
+    Returns:
+        stix_dict {}: each STIX object, as a dict
+    """
+    if isinstance(stix_data, _STIXBase):
+        stix_data = json.loads(stix_data.serialize())
+    elif isinstance(stix_data, str):
+        stix_data = json.loads(stix_data)
+
+    if isinstance(stix_data, Mapping):
+        if stix_data.get("type") == "bundle":
+            for stix_obj in stix_data.get("objects", []):
+                yield from iter_stix_dicts(stix_obj)
+        else:
+            yield stix_data
+    elif isinstance(stix_data, (list, Iterator)):
+        for stix_obj in stix_data:
+            yield from iter_stix_dicts(stix_obj)
+    else:
+        raise TypeError(
+            "stix_data must be a STIX object (or list of), "
+            "JSON formatted STIX (or list of), "
+            "or a JSON formatted STIX bundle",
+        )
+
+
+def iter_stix_objects(stix_data):
+    """
+        Flatten STIX input into single objects, leaving python STIX objects and dicts as they are,
+        without the parse or serialisation that iter_stix_dicts costs. A string that is not
+        json is passed on as it is, for the parse that follows to report
+    Args:
+        stix_data (): a STIX object, dict, json string, bundle, or a list or iterator of these
+
+    Returns:
+        stix_obj: each STIX object, as a python STIX object or a dict
+    """
+    if isinstance(stix_data, str):
+        try:
+            stix_data = json.loads(stix_data)
+        except ValueError:
+            yield stix_data
+            return
+
+    if isinstance(stix_data, (_STIXBase, Mapping)):
+        if stix_data.get("type") == "bundle":
+            for stix_obj in stix_data.get("objects", []):
+                yield from iter_stix_objects(stix_obj)
+        else:
+            yield stix_data
+    elif isinstance(stix_data, (list, Iterator)):
+        for stix_obj in stix_data:
+            yield from iter_stix_objects(stix_obj)
+    else:
+        raise TypeError(
+            "stix_data must be a STIX object (or list of), "
+            "JSON formatted STIX (or list of), "
+            "or a JSON formatted STIX bundle",
+        )
+
+
+class IngestPipeline:
+    """Two stage ingest for large imports through a TypeDBSink.
+
+    A process pool parses objects and generates their TypeQL, while a pool of writer
+    threads commits the resulting batches on pooled sessions. A bounded queue between
+    the stages, and a bounded number of chunks in flight on the process pool, keep
+    memory flat however large the input is.
+
+    Objects are written in the order their batches reach a free writer, so references
+    between objects in the input are not ordered; use the ordered sink mode for that.
+
+    The processes are spawned rather than forked, so a script running the pipeline must
+    guard its entry point with if __name__ == '__main__'.
+
+    Args:
+        - sink (TypeDBSink): The sink whose batching and writing is used
+        - processes (int): The number of TypeQL generation processes
+        - writers (int): The number of writer threads, each with its own session
+        - chunk_size (int): The number of objects sent to a process at a time
+        - queue_size (int): The number of batches waiting for a writer before generation blocks
+
+    """
+    def __init__(self, sink, processes=4, writers=4, chunk_size=64, queue_size=16):
+        self.sink = sink
+        self.processes = processes
+        self.writers = writers
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+
+    def run(self, stix_data, batch_size, max_batch_bytes=None, report=None):
+        """
+            Convert and write all of the STIX input
+        Args:
+            stix_data (): a STIX object, dict, json string, bundle, or a list or iterator of these
+            batch_size (): the number of objects written per transaction
+            max_batch_bytes (): the maximum size of the TypeQL sent in one transaction
+            report (): if given, a dict that is filled with stix-id to the number of the batch
+                the object was committed in
+
+        Returns:
+            counts {}: the number of objects and batches written
+        """
+        counts = {"objects": 0, "batches": 0}
+        errors = []
+        batch_queue = queue.Queue(maxsize=self.queue_size)
+        sizer = self.sink._new_sizer(batch_size)
+        threads = [threading.Thread(target=self._write, args=(batch_queue, counts, sizer, report, errors), daemon=True)
+                   for i in range(self.writers)]
+        for thread in threads:
+            thread.start()
+
+        try:
+            entries = self._convert(stix_data)
+            for batch_no, batch in enumerate(self.sink._batch_entries(entries, batch_size, max_batch_bytes, sizer)):
+                self._put(batch_queue, (batch_no, batch), errors)
+        finally:
+            for thread in threads:
+                self._put(batch_queue, None, [])
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+        return counts
+
+    def _convert(self, stix_data):
+        """
+            Yield the batch entries in input order, keeping a bounded number of chunks in flight
+        """
+        # committed objects are dropped here, before they cost a parse or a process round trip
+        stix_dicts = self.sink._skip_committed(enumerate(iter_stix_dicts(stix_data)))
+        entries = convert_in_processes(stix_dicts, self.processes, self.chunk_size, self.sink.import_type,
+                                       self.sink.trusted, self.sink.allow_custom, self.sink.dead_letter is not None,
+                                       self.sink.max_refs, self.sink.share_sub_objects)
+        return dead_letter_failures(entries, self.sink.dead_letter)
+
+    def _write(self, batch_queue, counts, sizer, report, errors):
+        """
+            Writer thread, committing batches from the queue until it receives None
+        """
+        while True:
+            item = batch_queue.get()
+            if item is None:
+                return
+            if errors:
+                # another writer has failed, so drain the queue without writing
+                continue
+            batch_no, batch = item
+            try:
+                self.sink._submit_pooled_batch(batch_no, batch, sizer, report)
+                with self._lock:
+                    counts["objects"] += len(batch)
+                    counts["batches"] += 1
+            except Exception as e:
+                errors.append(e)
+
+    @staticmethod
+    def _put(batch_queue, item, errors):
+        """
+            Put an item on the queue, blocking while it is full, but stopping if a writer has failed
+        """
+        while True:
+            if errors:
+                raise errors[0]
+            try:
+                batch_queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+
+def dead_letter_failures(entries, dead_letter):
+    """
+        Write the failures returned by convert_chunk to the dead-letter file, yielding the entries
+    """
+    for entry in entries:
+        if "failed" in entry:
+            dead_letter.record(entry["failed"], entry["error"], entry["object"], index=entry["index"])
+        else:
+            yield entry
+
+
+def _chunked(iterable, size):
+    """
+        Split an iterable into lists of at most size items
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
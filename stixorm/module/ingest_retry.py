@@ -0,0 +1,194 @@
+"""Retry of conflicting TypeDB writes, with adaptive batch sizing"""
+import random
+import re
+import threading
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# A TypeDB error code, such as TXN08, which the client puts in brackets at the start of a server error,
+# and keeps inside its own error when it wraps one, as it does when a transaction closes with errors.
+# The message of a code runs up to the next one
+error_code_pattern = re.compile(r"\[([A-Z]{3}[0-9]{2})\]([^\[]*)")
+# The TypeDB server reports a transaction that conflicts with a concurrent one, on commit, with one of the
+# isolation violations of its transaction family, whose codes start with TXN. The rest of the family, such
+# as a closed transaction, an illegal commit or a session type violation, fails again on a retry, as does
+# an error of any other server family, such as a TypeQL error. The client family, CLI, only wraps them
+conflict_code_family = "TXN"
+isolation_pattern = re.compile(r"isolation|concurrent", re.IGNORECASE)
+wrapper_code_family = "CLI"
+# gRPC rejects a message over its size limit with this status, or only in the error text once the
+# TypeDB client has wrapped the error
+oversize_status = "RESOURCE_EXHAUSTED"
+oversize_pattern = re.compile(r"larger than max|message too large", re.IGNORECASE)
+
+
+def error_messages(error):
+    """
+        Find the TypeDB error codes of an exception, its own and those of the errors it wraps, with
+        the message of each
+    Args:
+        error (): the exception raised by the TypeDB client
+
+    Returns:
+        messages []: a list of (code, message) pairs, such as ("TXN08", "Transaction isolation violation ...")
+    """
+    messages = error_code_pattern.findall(str(error))
+    error_message = getattr(error, "error_message", None)
+    if error_message is not None and error_message.code() not in {code for code, message in messages}:
+        messages.append((error_message.code(), str(error)))
+    return messages
+
+
+def error_codes(error):
+    """
+        Find the TypeDB error codes of an exception, its own and those of the errors it wraps
+    Args:
+        error (): the exception raised by the TypeDB client
+
+    Returns:
+        codes set(): the error codes, such as CLI04 and TXN08
+    """
+    return {code for code, message in error_messages(error)}
+
+
+def grpc_status(error):
+    """
+        Find the gRPC status of an exception, from the gRPC error it was raised from, if any
+    Args:
+        error (): the exception raised by the TypeDB client
+
+    Returns:
+        status: the name of the status code, such as RESOURCE_EXHAUSTED, or None
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        code = getattr(error, "code", None)
+        if callable(code):
+            try:
+                return getattr(code(), "name", None)
+            except Exception:
+                pass
+        error = error.__cause__
+    return None
+
+
+def is_conflict_error(error):
+    """
+        Check whether a failed commit was a write conflict with another transaction, by its error codes.
+        It is one if an isolation violation is reported, and no other error besides the client's own
+    Args:
+        error (): the exception raised by the transaction
+
+    Returns:
+        bool: True if the write can succeed on a retry
+    """
+    conflict = False
+    for code, message in error_messages(error):
+        if code.startswith(conflict_code_family) and isolation_pattern.search(message):
+            conflict = True
+        elif not code.startswith(wrapper_code_family):
+            return False
+    return conflict
+
+
+def is_oversize_error(error):
+    """
+        Check whether a failed commit was rejected for being too large to send, by its gRPC status,
+        or its text if the status was lost when the client wrapped the error
+    Args:
+        error (): the exception raised by the transaction
+
+    Returns:
+        bool: True if the write can succeed in smaller batches
+    """
+    status = grpc_status(error)
+    if status is not None:
+        return status == oversize_status
+    return oversize_pattern.search(str(error)) is not None
+
+
+class RetryPolicy:
+    """Jittered exponential backoff for retrying conflicting writes.
+
+    The delay before each retry is drawn uniformly between zero and an exponentially
+    growing cap, so that writers which conflicted with each other do not collide
+    again on the retry.
+
+    Args:
+        - max_attempts (int): The number of consecutive failures before the error is raised
+        - base_delay (float): The cap on the first delay, in seconds
+        - max_delay (float): The largest cap on any delay, in seconds
+        - multiplier (float): The growth of the cap for each further attempt
+
+    """
+    def __init__(self, max_attempts=6, base_delay=0.05, max_delay=5.0, multiplier=2.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+
+    def backoff(self, attempt):
+        """
+            The delay before a retry
+        Args:
+            attempt (): the number of failures so far, from 1
+
+        Returns:
+            delay (float): the number of seconds to wait
+        """
+        cap = min(self.max_delay, self.base_delay * self.multiplier ** (attempt - 1))
+        return random.uniform(0, cap)
+
+
+class AdaptiveBatchSizer:
+    """Batch size shared by the writers of an ingest, adapting to the errors they hit.
+
+    The size is halved on a conflict or an oversize error, and after grow_after
+    commits in a row without one, it grows back by a quarter, up to the configured
+    batch size. Parallel writers back off together when they contend, and recover
+    their peak batch size once the contention is gone.
+
+    Args:
+        - maximum (int): The configured batch size, which is also the starting size
+        - minimum (int): The smallest size to shrink to
+        - grow_after (int): The number of successful commits in a row before growing
+
+    """
+    def __init__(self, maximum, minimum=1, grow_after=4):
+        self.maximum = max(maximum, minimum)
+        self.minimum = minimum
+        self.grow_after = grow_after
+        self._size = self.maximum
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self._size
+
+    def shrink(self):
+        """
+            Halve the batch size after a conflict or oversize error
+        """
+        with self._lock:
+            self._successes = 0
+            size = max(self.minimum, self._size // 2)
+            if size != self._size:
+                logger.info(f'reducing batch size from {self._size} to {size}')
+                self._size = size
+            return self._size
+
+    def success(self):
+        """
+            Count a successful commit, growing the batch size after enough of them in a row
+        """
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.grow_after and self._size < self.maximum:
+                self._successes = 0
+                self._size = min(self.maximum, self._size + max(1, self._size // 4))
+                logger.debug(f'increasing batch size to {self._size}')
+            return self._size
@@ -0,0 +1,147 @@
+"""Ingest-time materialisation of the kill-chain grouping, instead of inferring it with rules"""
+from .import_stix_utilities import val_tql, list_of_object_configs
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def kill_chain_phase_vars(stix_obj):
+    """
+        Find the typeql variables that the kill chain phases of a STIX object are inserted, or
+        matched, as, with the kill chain name of each
+    Args:
+        stix_obj (): a python STIX object or a STIX dict
+
+    Returns:
+        phase_vars {}: the variable name, without the $, to the kill chain name of the phase
+    """
+    typeql_obj = list_of_object_configs["kill_chain_phases"]["object"]
+    return {typeql_obj + str(i): phase["kill_chain_name"]
+            for i, phase in enumerate(stix_obj.get("kill_chain_phases", ()))}
+
+
+def collect_phases(phases, answer, phase_vars):
+    """
+        Add the IIDs of the kill chain phases in an insert answer to phases
+    Args:
+        phases (): the dict of kill chain name to the set of phase IIDs, that is added to
+        answer (): the concept map answer of the insert
+        phase_vars (): the variables of the phases, to their kill chain names, see kill_chain_phase_vars
+    """
+    concepts = answer.map()
+    for var, name in phase_vars.items():
+        concept = concepts.get(var)
+        if concept is not None:
+            phases.setdefault(name, set()).add(concept.get_iid())
+
+
+def kill_chain_query(name):
+    """
+        Assemble the typeql query that finds the materialised kill-chain relation of a kill chain name
+    """
+    return f'match $k isa kill-chain, has kill-chain-name {val_tql(name)}; get $k; limit 1;'
+
+
+def kill_chains_query(name):
+    """
+        Assemble the typeql query that finds every kill-chain relation of a kill chain name, of which
+        there is more than one if two transactions created it at once
+    """
+    return f'match $k isa kill-chain, has kill-chain-name {val_tql(name)}; get $k;'
+
+
+def kill_chain_phases_query(name):
+    """
+        Assemble the typeql query that finds every kill chain phase with a kill chain name
+    """
+    return f'match $p isa kill-chain-phase, has kill-chain-name {val_tql(name)}; get $p;'
+
+
+def new_kill_chain_query(name, phase_iids):
+    """
+        Assemble the typeql query that inserts the kill-chain relation of a kill chain name, holding
+        the phases with the IIDs, and owning the name, as the part-of-one-kill-chain rules infer it
+    """
+    match = ''.join(f' $p{i} iid {iid};' for i, iid in enumerate(phase_iids))
+    players = ', '.join(f'participating-kill-chain-phase: $p{i}' for i in range(len(phase_iids)))
+    return f'match{match}\ninsert $k ({players}) isa kill-chain, has kill-chain-name {val_tql(name)};'
+
+
+def join_kill_chain_query(kill_chain_iid, phase_iid):
+    """
+        Assemble the typeql query that adds the kill chain phase with the IID to a kill-chain relation,
+        unless it is in it already
+    """
+    return (f'match $k iid {kill_chain_iid}; $p iid {phase_iid};'
+            f' not {{ $k (participating-kill-chain-phase: $p); }};\n'
+            f'insert $k (participating-kill-chain-phase: $p);')
+
+
+def merge_kill_chain_query(kill_chain_iid, duplicate_iid):
+    """
+        Assemble the typeql query that adds the phases of a duplicate kill-chain relation to the one kept
+    """
+    return (f'match $k iid {kill_chain_iid}; $d iid {duplicate_iid}; $d (participating-kill-chain-phase: $p);'
+            f' not {{ $k (participating-kill-chain-phase: $p); }};\n'
+            f'insert $k (participating-kill-chain-phase: $p);')
+
+
+def materialise_kill_chains(tx, phases):
+    """
+        Bring the kill-chain relations up to date, in the transaction that has just inserted kill
+        chain phases. Each kill chain name has a single kill-chain relation, holding every phase with
+        the name once there are two of them, which answers the same queries as the pairwise relations
+        the rules would infer, with inference disabled. Only the phases of the transaction are joined
+        to an existing relation, matched by iid, and every phase with the name is only read when the
+        relation is created
+    Args:
+        tx (): the write transaction
+        phases (): a dict of kill chain name to the IIDs of the phases inserted, or matched, with it
+
+    Returns:
+        created []: the names whose kill-chain relation was created, which another transaction may
+            have created at the same time, see merge_kill_chains
+    """
+    created = []
+    for name in sorted(phases):
+        kill_chain = next(iter(tx.query().match(kill_chain_query(name))), None)
+        if kill_chain is None:
+            phase_iids = [answer.get("p").get_iid() for answer in tx.query().match(kill_chain_phases_query(name))]
+            if len(phase_iids) < 2:
+                continue
+            for _ in tx.query().insert(new_kill_chain_query(name, phase_iids)):
+                pass
+            created.append(name)
+            continue
+        kill_chain_iid = kill_chain.get("k").get_iid()
+        for phase_iid in sorted(phases[name]):
+            for _ in tx.query().insert(join_kill_chain_query(kill_chain_iid, phase_iid)):
+                pass
+    if created:
+        logger.debug(f'materialised kill chains {created}')
+    return created
+
+
+def merge_kill_chains(tx, names):
+    """
+        Merge the kill-chain relations created for the same name by concurrent transactions, once
+        they have committed. The relation with the lowest IID is kept, so that concurrent merges
+        agree, and the phases of the others are added to it before they are deleted
+    Args:
+        tx (): a write transaction
+        names (): the kill chain names whose kill-chain relation was just created
+
+    Returns:
+        merged (int): the number of duplicate relations deleted
+    """
+    merged = 0
+    for name in names:
+        kill_chain_iids = sorted(answer.get("k").get_iid() for answer in tx.query().match(kill_chains_query(name)))
+        for duplicate_iid in kill_chain_iids[1:]:
+            for _ in tx.query().insert(merge_kill_chain_query(kill_chain_iids[0], duplicate_iid)):
+                pass
+            tx.query().delete(f'match $d iid {duplicate_iid}; delete $d isa kill-chain;')
+            merged += 1
+    if merged:
+        logger.info(f'merged {merged} duplicate kill-chain relations of {names}')
+    return merged
@@ -0,0 +1,161 @@
+"""Counters and per-stage latency histograms for ingest and retrieval"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# the upper bounds, in seconds, of the latency histogram buckets
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# the stages timed by the sink and source
+stages = ("parse", "generate", "execute", "commit", "expand", "convert")
+
+
+class MetricsRegistry:
+    """Thread-safe counters and latency histograms, broken down by stage and STIX type.
+
+    The sink times the parse of each object, its TypeQL generation, the execution of
+    its match-insert and the commit of each batch. The source times the expansion of
+    the answer concepts over gRPC, and their conversion back into STIX. Objects
+    converted on a process pool are not timed at the generate stage, as the time is
+    spent in other processes.
+
+    A snapshot of the registry is a plain dict, and it can also be rendered in the
+    Prometheus text exposition format, to be served from a metrics endpoint.
+
+    Args:
+        - buckets (tuple): The upper bounds of the latency histogram buckets, in seconds
+
+    """
+    def __init__(self, buckets=default_buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, stix_type=None):
+        """
+            Add to a counter
+        Args:
+            name (): the counter name, such as objects_written
+            value (): the amount to add
+            stix_type (): the STIX type the count is for, if any
+        """
+        key = (name, stix_type or "")
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, stage, seconds, stix_type=None):
+        """
+            Record the latency of one run of a stage
+        Args:
+            stage (): the stage name, one of stages
+            seconds (): the time it took
+            stix_type (): the STIX type it was for, if any
+        """
+        key = (stage, stix_type or "")
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"count": 0, "sum": 0.0, "max": 0.0,
+                                                     "buckets": [0] * (len(self.buckets) + 1)}
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["max"] = max(histogram["max"], seconds)
+            histogram["buckets"][slot] += 1
+
+    @contextmanager
+    def timer(self, stage, stix_type=None):
+        """
+            Time the body of a with block as one run of a stage. The labels yielded can be
+            changed in the block, for when the STIX type is only known once it is parsed
+        Args:
+            stage (): the stage name, one of stages
+            stix_type (): the STIX type it is for, if any
+
+        Returns:
+            labels {}: the labels the time is recorded under
+        """
+        labels = {"stix_type": stix_type}
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(stage, time.perf_counter() - start, labels["stix_type"])
+
+    def snapshot(self):
+        """
+            Take a copy of every counter and histogram
+        Returns:
+            snapshot {}: the counters, as name to STIX type to value, and the stages, as stage to
+                STIX type to the count, sum, mean and max of their latencies, and the count of
+                each bucket, by its upper bound
+        """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(histogram, buckets=list(histogram["buckets"]))
+                          for key, histogram in self._histograms.items()}
+        snapshot = {"counters": {}, "stages": {}}
+        for (name, stix_type), value in sorted(counters.items()):
+            snapshot["counters"].setdefault(name, {})[stix_type] = value
+        for (stage, stix_type), histogram in sorted(histograms.items()):
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            snapshot["stages"].setdefault(stage, {})[stix_type] = {
+                "count": histogram["count"],
+                "sum": histogram["sum"],
+                "mean": histogram["sum"] / histogram["count"],
+                "max": histogram["max"],
+                "buckets": dict(zip(bounds, histogram["buckets"])),
+            }
+        return snapshot
+
+    def prometheus_text(self, prefix="stixorm"):
+        """
+            Render the registry in the Prometheus text exposition format
+        Args:
+            prefix (): the prefix of each metric name
+
+        Returns:
+            text: the counters, as <prefix>_<name>_total, and the stage latencies, as the
+                <prefix>_stage_seconds histogram, labelled by stage and stix_type
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, values in snapshot["counters"].items():
+            metric = f'{prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for stix_type, value in values.items():
+                lines.append(f'{metric}{_labels(stix_type=stix_type)} {value}')
+        if snapshot["stages"]:
+            metric = f'{prefix}_stage_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            for stage, types in snapshot["stages"].items():
+                for stix_type, histogram in types.items():
+                    cumulative = 0
+                    for bound, count in histogram["buckets"].items():
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{_labels(stage=stage, stix_type=stix_type, le=bound)} {cumulative}')
+                    lines.append(f'{metric}_sum{_labels(stage=stage, stix_type=stix_type)} {histogram["sum"]}')
+                    lines.append(f'{metric}_count{_labels(stage=stage, stix_type=stix_type)} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _labels(**labels):
+    """
+        Render the non-empty labels of a Prometheus sample
+    """
+    pairs = [f'{name}="{value}"' for name, value in labels.items() if value]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# the registry used by every sink and source that is not given one
+default_metrics = MetricsRegistry()
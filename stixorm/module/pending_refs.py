@@ -0,0 +1,163 @@
+"""Pending store for objects whose references have not been written yet"""
+import threading
+from collections import OrderedDict
+
+from .ingest_graph import topological_waves
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def existing_ids_query(stix_ids):
+    """
+        Assemble the typeql query that finds which of the stix-ids are in the database
+    Args:
+        stix_ids (): the stix-ids to look for
+
+    Returns:
+        match: the typeql match statement, getting the $id of each one found, and the object $x owning it
+    """
+    if len(stix_ids) == 1:
+        return 'match $x has stix-id $id; $id = "' + stix_ids[0] + '"; get $x, $id;'
+    options = ' or '.join('{$id = "' + stix_id + '";}' for stix_id in stix_ids)
+    return 'match $x has stix-id $id; ' + options + '; get $x, $id;'
+
+
+class PendingStore:
+    """Batch entries parked until the objects they refer to are written.
+
+    An entry whose references are not yet in the database would match nothing, so
+    its insert would do nothing. Instead, it is parked here, indexed by each stix-id
+    that it is missing. As objects are committed, resolve returns the entries that
+    are no longer missing anything, to be written in the next batch.
+
+    The store is bounded, unless max_pending is None. When it is full, the entry parked
+    longest is evicted and handed back, so that the caller can dead-letter or report it.
+
+    The stix-ids committed through the store are remembered, up to max_known of them,
+    so that references to recently written objects need no read from the database.
+
+    Args:
+        - max_pending (int): The largest number of entries parked at once, None for no limit
+        - max_known (int): The number of committed stix-ids remembered
+
+    """
+    def __init__(self, max_pending=100000, max_known=100000):
+        self.max_pending = max_pending
+        self.max_known = max_known
+        self._entries = OrderedDict()
+        self._waiting = {}
+        self._known = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_known(self, stix_id):
+        """
+            Check whether the stix-id was committed recently through the store
+        """
+        with self._lock:
+            return stix_id in self._known
+
+    def missing_ids(self):
+        """
+            The stix-ids that the parked entries are waiting for
+        """
+        with self._lock:
+            return list(self._waiting)
+
+    def park(self, entry, missing):
+        """
+            Park an entry until the stix-ids it is missing are committed
+        Args:
+            entry (): the batch entry
+            missing (): the set of stix-ids it refers to that are not in the database
+
+        Returns:
+            evicted []: the entries evicted to keep the store within max_pending
+        """
+        evicted = []
+        with self._lock:
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = (entry, set(missing))
+            for stix_id in missing:
+                self._waiting.setdefault(stix_id, set()).add(key)
+            while self.max_pending is not None and len(self._entries) > self.max_pending:
+                evicted.append(self._remove(next(iter(self._entries))))
+        logger.debug(f'parked {entry["stix_id"]}, waiting for {sorted(missing)}')
+        return evicted
+
+    def resolve(self, stix_ids):
+        """
+            Record that objects have been committed, and release the entries waiting only for them
+        Args:
+            stix_ids (): the stix-ids of the committed objects
+
+        Returns:
+            entries []: the parked entries that now have all of their references, in the order parked
+        """
+        ready = []
+        with self._lock:
+            for stix_id in stix_ids:
+                self._known[stix_id] = None
+                self._known.move_to_end(stix_id)
+                for key in self._waiting.pop(stix_id, ()):
+                    missing = self._entries[key][1]
+                    missing.discard(stix_id)
+                    if not missing:
+                        ready.append(key)
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+            entries = [self._remove(key) for key in sorted(ready)]
+        return entries
+
+    def forget(self, stix_ids):
+        """
+            Forget that objects were committed, once they have been deleted
+        """
+        with self._lock:
+            for stix_id in stix_ids:
+                self._known.pop(stix_id, None)
+
+    def take_blocked(self):
+        """
+            Remove the parked entries that can never be resolved, as they are in a reference cycle
+            with other parked entries, or wait for an entry that is
+        Returns:
+            entries []: the removed entries, in the order parked
+            cycles []: the reference cycles, each a sorted list of stix-ids
+        """
+        with self._lock:
+            keys_by_id = {}
+            for key, (entry, missing) in self._entries.items():
+                keys_by_id.setdefault(entry["stix_id"], []).append(key)
+            graph = {stix_id: set() for stix_id in keys_by_id}
+            for entry, missing in self._entries.values():
+                graph[entry["stix_id"]].update(stix_id for stix_id in missing if stix_id in graph)
+            waves, cycles = topological_waves(graph)
+            ordered = {stix_id for wave in waves for stix_id in wave}
+            blocked = sorted(key for stix_id, keys in keys_by_id.items() if stix_id not in ordered for key in keys)
+            entries = [self._remove(key) for key in blocked]
+        return entries, cycles
+
+    def drain(self):
+        """
+            Remove every parked entry
+        Returns:
+            entries []: the parked entries, in the order parked
+        """
+        with self._lock:
+            return [self._remove(key) for key in list(self._entries)]
+
+    def _remove(self, key):
+        entry, missing = self._entries.pop(key)
+        for stix_id in missing:
+            keys = self._waiting.get(stix_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._waiting[stix_id]
+        return entry
@@ -0,0 +1,338 @@
+"""Hash-sharded STIX store, spreading objects over several TypeDB databases or servers"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from typedb.client import *
+
+from stix2.datastore import DataSink, DataSource
+from stix2.utils import get_type_from_id
+
+from .typedb import TypeDBSink, TypeDBSource
+from .ingest_pipeline import iter_stix_objects
+from .ingest_graph import get_object_refs
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# the STIX types stored as TypeDB relations, which cannot be stood in for by a stub entity
+relation_types = ("relationship", "sighting")
+
+
+def shard_index(stix_id, shard_count):
+    """
+        Choose the shard of a STIX object, by a hash of its stix-id that is the same in every process
+    Args:
+        stix_id (): the stix-id of the object
+        shard_count (): the number of shards
+
+    Returns:
+        index: the index of the shard, from 0 to shard_count - 1
+    """
+    digest = hashlib.sha1(stix_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count
+
+
+def shard_path(path, shard_no):
+    """
+        Derive the path of a file of one shard, such as its journal or dead-letter file, from the
+        path given for the sharded sink, so that no two shards write to the same file
+    Args:
+        path (): the path given for the sharded sink
+        shard_no (): the index of the shard
+
+    Returns:
+        path: the path with .shard<N> added before its extension
+    """
+    root, ext = os.path.splitext(path)
+    return f'{root}.shard{shard_no}{ext}'
+
+
+def reference_stub_query(stix_id):
+    """
+        Assemble the typeql query that inserts a stub for an object stored in another shard, holding
+        only its type and stix-id, so that references to it can be matched in this shard
+    """
+    stix_type = get_type_from_id(stix_id)
+    return f'insert $x isa {stix_type}, has stix-id "{stix_id}";'
+
+
+def delete_stub_query(stix_id):
+    """
+        Assemble the typeql query that deletes the stub of an object stored in another shard
+    """
+    stix_type = get_type_from_id(stix_id)
+    return f'match $x isa {stix_type}, has stix-id "{stix_id}"; delete $x isa {stix_type};'
+
+
+class ShardedTypeDBSink(DataSink):
+    """Spread STIX objects over several TypeDB databases, by a stable hash of their stix-id.
+
+    Each object is written to the shard its stix-id hashes to. The objects an object
+    refers to may be stored in other shards, so before it is written, a stub holding
+    only the type and stix-id of each of them is written to its shard, if it is not
+    there already, and its references are matched to the stubs. The objects stored
+    in a shard are always the ones that hash to it, so a ShardedTypeDBSource reads
+    each object from its own shard, never from a stub.
+
+    Relationships and sightings are TypeDB relations, which cannot be stubbed, so an
+    object that refers to one in another shard, such as a report whose object_refs hold
+    it, is not written. It is reported as "unresolved", and written to the dead-letter
+    file of its shard, if there is one. Deleting an object deletes its stubs in the other
+    shards too.
+
+    The shards are written concurrently, one thread each.
+
+    Args:
+        - connections (list): The connection dicts of the shards, as for TypeDBSink, in a fixed
+            order, as it decides where each object is stored
+        - kwargs: The other TypeDBSink arguments, used for every shard. A journal or dead-letter
+            path is given to each shard with .shard<N> added, see shard_path. A journal or an IID
+            cache object cannot be shared by the shards, as each shard has its own input indexes
+            and IIDs, so only a path, or None, is accepted for them. As for TypeDBSink, a sink
+            with a journal takes a single ingest
+
+    """
+    def __init__(self, connections, **kwargs):
+        super(ShardedTypeDBSink, self).__init__()
+        if not connections:
+            raise ValueError("a sharded sink needs at least one connection")
+        if kwargs.get("journal") is not None and not isinstance(kwargs["journal"], str):
+            raise ValueError("a sharded sink takes a journal path, as its shards cannot share a journal")
+        if kwargs.get("iid_cache") is not None and kwargs["iid_cache"] is not False:
+            raise ValueError("a sharded sink cannot share an IID cache between its shards")
+        self.shards = []
+        for shard_no, connection in enumerate(connections):
+            shard_kwargs = dict(kwargs)
+            for name in ("journal", "dead_letter"):
+                if isinstance(kwargs.get(name), str):
+                    shard_kwargs[name] = shard_path(kwargs[name], shard_no)
+            self.shards.append(TypeDBSink(connection, **shard_kwargs))
+
+    def shard_for(self, stix_id):
+        """
+            The sink of the shard that stores the STIX object with the stix-id
+        """
+        return self.shards[shard_index(stix_id, len(self.shards))]
+
+    def add(self, stix_data, batch_size=None):
+        """Route STIX objects to their shards, stubbing the objects they refer to in other shards.
+
+        Args:
+            stix_data (STIX object OR dict OR str OR list): STIX content, as for TypeDBSink.add
+            batch_size (int): the number of objects written per transaction
+
+        Returns:
+            report {}: a dict of stix-id to the number of the batch the object was committed in,
+                within its shard, or "unresolved" if it refers to a relation in another shard
+
+        """
+        groups = self._route(iter_stix_objects(stix_data))
+        return self._each_shard(groups, lambda shard_no, stix_objects:
+                                self._add_to_shard(shard_no, stix_objects, batch_size))
+
+    def upsert(self, stix_data, batch_size=None):
+        """Route new versions of STIX objects to their shards, see TypeDBSink.upsert.
+        """
+        groups = self._route(iter_stix_objects(stix_data))
+        return self._each_shard(groups, lambda shard_no, stix_objects:
+                                self._upsert_in_shard(shard_no, stix_objects, batch_size))
+
+    def delete(self, stix_ids, batch_size=None):
+        """Delete STIX objects from their shards, and their stubs from the other shards, see TypeDBSink.delete.
+        """
+        if isinstance(stix_ids, str):
+            stix_ids = [stix_ids]
+        groups = self._route_ids(stix_ids)
+        report = self._each_shard(groups, lambda shard_no, ids: self.shards[shard_no].delete(ids, batch_size))
+        stubbed = [stix_id for stix_id in stix_ids if get_type_from_id(stix_id) not in relation_types]
+        if stubbed:
+            self._each_shard(dict.fromkeys(range(len(self.shards)), stubbed), self._delete_stubs)
+        return report
+
+    def revoke(self, stix_ids, batch_size=None):
+        """Revoke STIX objects in their shards, see TypeDBSink.revoke.
+        """
+        groups = self._route_ids(stix_ids)
+        return self._each_shard(groups, lambda shard_no, ids: self.shards[shard_no].revoke(ids, batch_size))
+
+    def resolve_pending(self):
+        """Write the objects parked in every shard whose references are stored, see TypeDBSink.resolve_pending.
+        """
+        report = {}
+        for shard in self.shards:
+            report.update(shard.resolve_pending())
+        return report
+
+    def flush_pending(self):
+        """Give up on the objects parked in every shard, see TypeDBSink.flush_pending.
+        """
+        return sum(shard.flush_pending() for shard in self.shards)
+
+    def _route(self, stix_objects):
+        """
+            Group the objects by the index of their shard, keeping their order within each shard
+        """
+        groups = {}
+        for stix_obj in stix_objects:
+            groups.setdefault(shard_index(stix_obj["id"], len(self.shards)), []).append(stix_obj)
+        return groups
+
+    def _route_ids(self, stix_ids):
+        if isinstance(stix_ids, str):
+            stix_ids = [stix_ids]
+        groups = {}
+        for stix_id in stix_ids:
+            groups.setdefault(shard_index(stix_id, len(self.shards)), []).append(stix_id)
+        return groups
+
+    def _each_shard(self, groups, write):
+        """
+            Run write on each shard with its group, concurrently, merging the reports
+        """
+        report = {}
+        with ThreadPoolExecutor(max_workers=len(self.shards)) as executor:
+            futures = [executor.submit(write, shard_no, group) for shard_no, group in groups.items()]
+            for future in futures:
+                report.update(future.result())
+        return report
+
+    def _add_to_shard(self, shard_no, stix_objects, batch_size):
+        return self._write_to_shard(shard_no, stix_objects, lambda writable:
+                                    self.shards[shard_no].add(writable, batch_size=batch_size))
+
+    def _upsert_in_shard(self, shard_no, stix_objects, batch_size):
+        return self._write_to_shard(shard_no, stix_objects, lambda writable:
+                                    self.shards[shard_no].upsert(writable, batch_size=batch_size))
+
+    def _write_to_shard(self, shard_no, stix_objects, write):
+        """
+            Stub the references of the objects, then write the ones that refer to no relation in
+            another shard, reporting the others as unresolved
+        """
+        unresolved = self._write_stubs(shard_no, stix_objects)
+        writable = [stix_obj for stix_obj in stix_objects if stix_obj["id"] not in unresolved]
+        report = write(writable) if writable else {}
+        report.update(dict.fromkeys(unresolved, "unresolved"))
+        return report
+
+    def _write_stubs(self, shard_no, stix_objects):
+        """
+            Write a stub to the shard for each object that the objects refer to in another shard,
+            unless it is there already, and give up on the objects that refer to a relation in
+            another shard, which cannot be stubbed
+
+        Returns:
+            unresolved set(): the stix-ids of the objects given up on
+        """
+        shard = self.shards[shard_no]
+        foreign = set()
+        unresolved = set()
+        for stix_obj in stix_objects:
+            refs = get_object_refs(stix_obj)
+            relation_refs = sorted(ref for ref in refs if get_type_from_id(ref) in relation_types
+                                   and shard_index(ref, len(self.shards)) != shard_no)
+            if relation_refs:
+                self._unresolved(shard, stix_obj, relation_refs)
+                unresolved.add(stix_obj["id"])
+                continue
+            foreign.update(ref for ref in refs if shard_index(ref, len(self.shards)) != shard_no)
+        if not foreign:
+            return unresolved
+
+        with shard._pool.session(shard.uri, shard.port, shard.database) as session:
+            missing = sorted(foreign - shard._existing_ids(foreign, session))
+            if not missing:
+                return unresolved
+            with session.transaction(TransactionType.WRITE) as write_transaction:
+                for stix_id in missing:
+                    write_transaction.query().insert(reference_stub_query(stix_id))
+                write_transaction.commit()
+        logger.debug(f'wrote {len(missing)} reference stubs to shard {shard_no}')
+        return unresolved
+
+    def _unresolved(self, shard, stix_obj, relation_refs):
+        """
+            Give up on an object that refers to relations in another shard
+        """
+        error = ValueError(f'{stix_obj["id"]} refers to {", ".join(relation_refs)} in another shard, '
+                           f'which cannot be stubbed')
+        if shard.dead_letter is not None:
+            shard.dead_letter.record("resolve", error, stix_obj)
+        else:
+            logger.error(f'{error}, object not written')
+
+    def _delete_stubs(self, shard_no, stix_ids):
+        """
+            Delete the stubs of the objects from the shard, leaving the objects it stores itself
+        """
+        shard = self.shards[shard_no]
+        stub_ids = {stix_id for stix_id in stix_ids if shard_index(stix_id, len(self.shards)) != shard_no}
+        if not stub_ids:
+            return {}
+        with shard._pool.session(shard.uri, shard.port, shard.database) as session:
+            stubs = sorted(shard._existing_ids(stub_ids, session))
+            if not stubs:
+                return {}
+            with session.transaction(TransactionType.WRITE) as write_transaction:
+                for stix_id in stubs:
+                    write_transaction.query().delete(delete_stub_query(stix_id))
+                write_transaction.commit()
+        if shard.iid_cache is not None:
+            shard.iid_cache.invalidate(stubs)
+        logger.debug(f'deleted {len(stubs)} reference stubs from shard {shard_no}')
+        return {}
+
+
+class ShardedTypeDBSource(DataSource):
+    """Read STIX objects from the shards written by a ShardedTypeDBSink.
+
+    get reads an object from the shard its stix-id hashes to, and if it is not there,
+    for instance after shards were added, from every other shard in parallel. Only get
+    is supported, as TypeDBSource implements no query or all_versions to fan out to, so
+    those raise NotImplementedError.
+
+    Args:
+        - connections (list): The connection dicts of the shards, in the order given to the sink
+        - kwargs: The other TypeDBSource arguments, used for every shard
+
+    """
+    def __init__(self, connections, **kwargs):
+        super(ShardedTypeDBSource, self).__init__()
+        if not connections:
+            raise ValueError("a sharded source needs at least one connection")
+        self.shards = [TypeDBSource(connection, **kwargs) for connection in connections]
+
+    def get(self, stix_id, _composite_filters=None):
+        """Retrieve a STIX object by its stix-id, from its own shard first.
+        """
+        owner = shard_index(stix_id, len(self.shards))
+        stix_obj = self.shards[owner].get(stix_id, _composite_filters)
+        if stix_obj is not None:
+            return stix_obj
+        others = [shard for shard_no, shard in enumerate(self.shards) if shard_no != owner]
+        for found in self._fan_out(lambda shard: shard.get(stix_id, _composite_filters), others):
+            if found is not None:
+                return found
+        return None
+
+    def all_versions(self, stix_id, version=None, _composite_filters=None):
+        """Not supported, as TypeDBSource does not implement all_versions.
+        """
+        raise NotImplementedError("a sharded source only supports get")
+
+    def query(self, query=None, version=None, _composite_filters=None):
+        """Not supported, as TypeDBSource does not implement query.
+        """
+        raise NotImplementedError("a sharded source only supports get")
+
+    def _fan_out(self, read, shards=None):
+        """
+            Run read on each shard in parallel, returning the results in shard order
+        """
+        shards = self.shards if shards is None else shards
+        if not shards:
+            return []
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            return list(executor.map(read, shards))
@@ -3,14 +3,35 @@ import errno
 import io
 import json
 import os
+import random
 import re
 import stat
+import time
+from datetime import datetime, timezone
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from typedb.client import *
 
 #from .stql import stix2_to_typeql, get_embedded_match, raw_stix2_to_typeql, convert_ans_to_stix
 from .import_stix_to_typeql import stix2_to_typeql, raw_stix2_to_typeql
-from .import_stix_utilities import get_embedded_match
-from .export_intermediate_to_stix import convert_ans_to_stix
+from .import_stix_utilities import get_embedded_match, coerce_trusted_dict, collect_shared_sub_objects
+from .export_intermediate_to_stix import convert_ans_to_stix, convert_res_to_stix
+from .export_typeql_to_intermediate import convert_ans_to_res
+from .typedb_pool import default_pool
+from .ingest_graph import build_reference_graph, topological_waves
+from .bundle_stream import open_bundle, open_stream, iter_bundle_objects
+from .ingest_pipeline import IngestPipeline, make_entry, iter_stix_objects
+from .ingest_journal import IngestJournal
+from .ingest_retry import RetryPolicy, AdaptiveBatchSizer, is_conflict_error, is_oversize_error
+from .dead_letter import DeadLetterQueue, read_dead_letters
+from .typeql_export import list_chunks, read_chunk
+from .pending_refs import PendingStore, existing_ids_query
+from .iid_cache import IIDCache, match_vars, object_var, content_keys_query, rewrite_content_keys
+from .update_stix_to_typeql import upsert_typeql
+from .metrics import default_metrics
+from .delete_stix_typeql import delete_object_queries, revoke_queries, merge_shared_sub_objects
+from .kill_chains import kill_chain_phase_vars, collect_phases, materialise_kill_chains, merge_kill_chains
 
 from stix2 import v21
 from stix2.base import _STIXBase
@@ -20,7 +41,7 @@ from stix2.datastore import (
 from stix2.datastore.filters import Filter, FilterSet, apply_common_filters
 from stix2.parsing import parse
 from stix2.serialization import fp_serialize
-from stix2.utils import format_datetime, get_type_from_id, parse_into_datetime
+from stix2.utils import format_datetime, get_type_from_id, parse_into_datetime, is_sdo, is_sro
 
 from stixorm.schema.initialise import initialise_database
 
@@ -44,9 +65,59 @@ class TypeDBSink(DataSink):
             - password (str): Password for TypeDB, if cluster, otherwise None
         - clear (bool): If True, clear the TypeDB before adding objects.
         - import_type (str): It forces the parser to use either the stix2.1, or mitre att&ck
+        - batch_size (int): The number of STIX objects written in each transaction
+        - max_batch_bytes (int): The maximum size of TypeQL sent in one transaction, None for no limit
+        - pool (TypeDBConnectionPool): The client and session pool to use, defaults to the shared pool
+        - workers (int): The number of sessions writing concurrently. Above 1, objects are written
+            in waves ordered by their references
+        - trusted (bool): If True, json and dict input is taken as already valid STIX and converted
+            directly, without being parsed into python STIX objects. The spec_version and pattern_version
+            defaults of the parse are filled in, but a missing created, modified or valid_from is not
+            defaulted to the current time, see apply_parse_defaults
+        - validate_sample (float): In trusted mode, the fraction of objects that are still parsed,
+            so that a bad feed is caught early
+        - processes (int): If above 0, TypeQL is generated on this many processes, feeding
+            workers writer threads, for large imports
+        - journal (str or IngestJournal): A checkpoint journal of committed batches. Objects already
+            recorded in it are skipped, so a restarted ingest of the same input resumes where it stopped.
+            It records the objects by their position in the input, so it holds a single ingest, and a
+            second add, add_file, add_stream, load_chunks or replay_dead_letters through it is refused
+        - retry (RetryPolicy): The backoff for retrying write conflicts, defaults to RetryPolicy()
+        - min_batch_size (int): The smallest batch size that conflicts and oversize errors shrink
+            batches to. Batches grow back towards batch_size as commits succeed
+        - dead_letter (str or DeadLetterQueue): A dead-letter file. If given, objects that fail to
+            parse, convert or commit are written to it, with the reason, and the ingest carries on
+        - max_refs (int): The longest reference list written in one query. The rest of a longer
+            list, such as the object_refs of a large report, is added to the relation in follow-up
+            transactions, after the object is committed. None to never split
+        - defer_missing (bool): If True, objects that refer to stix-ids not yet in the database are
+            parked, instead of being inserted without their references, and written once the objects
+            they refer to arrive, in this or a later add
+        - max_pending (int): The largest number of parked objects, None for no limit. Beyond it,
+            the object parked longest is written to the dead-letter file, or logged, as unresolved.
+            Parked objects are written as the objects they refer to are committed through the sink,
+            and resolve_pending checks the database for the ones written by other clients
+        - iid_cache (IIDCache): The cache of stix-id to IID, filled from inserts and reads, so that
+            references to known objects are matched by iid. Defaults to a cache for this sink,
+            and can be shared with another sink, or False to always match by stix-id
+        - share_sub_objects (bool): If True, identical hashes, kill chain phases and external
+            references are stored once, and shared by every object that has them, matched by a
+            content key instead of being inserted again for each object
+        - metrics (MetricsRegistry): The registry that the counters and stage timings of the sink
+            are recorded in, defaults to the shared default_metrics
+        - attach (bool): If True, an existing database is used without defining the schema again,
+            as long as its schema fingerprint matches the bundled schema, and is brought up to
+            date otherwise, so that many sinks and worker processes can start on one database
+        - materialise_kill_chains (bool): If True, the kill-chain relation of each kill chain name, and
+            the name it owns, are maintained as kill chain phases are written, in the same transaction,
+            so that the grouping the kill-chain rules infer can be queried with inference disabled
 
     """
-    def __init__(self, connection, clear=False, import_type="STIX21", **kwargs):	
+    def __init__(self, connection, clear=False, import_type="STIX21", batch_size=1, max_batch_bytes=None,
+                 pool=None, workers=1, trusted=False, validate_sample=0.0, processes=0, journal=None,
+                 retry=None, min_batch_size=1, dead_letter=None, max_refs=1000, defer_missing=True,
+                 max_pending=100000, iid_cache=None, share_sub_objects=False, metrics=None,
+                 attach=True, materialise_kill_chains=False, **kwargs):
         super(TypeDBSink, self).__init__()
 
         self._stix_connection = connection
@@ -57,13 +128,43 @@ class TypeDBSink(DataSink):
         self.password = connection["password"]
         self.clear = clear
         self.import_type = import_type
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self._pool = pool or default_pool
+        self.workers = workers
+        self.trusted = trusted
+        self.validate_sample = validate_sample
+        self.processes = processes
+        if isinstance(journal, str):
+            journal = IngestJournal(journal)
+        self.journal = journal
+        self._journal_claimed = False
+        self.retry = retry or RetryPolicy()
+        self.min_batch_size = min_batch_size
+        if isinstance(dead_letter, str):
+            dead_letter = DeadLetterQueue(dead_letter)
+        self.dead_letter = dead_letter
+        self.max_refs = max_refs
+        self.pending = PendingStore(max_pending) if defer_missing else None
+        if iid_cache is None:
+            iid_cache = IIDCache()
+        # an empty cache is falsy, so only False turns the cache off
+        self.iid_cache = None if iid_cache is False else iid_cache
+        self.share_sub_objects = share_sub_objects
+        self.metrics = metrics or default_metrics
+        self.materialise_kill_chains = materialise_kill_chains
+        # the content key to IID of the shared sub-objects known to be stored
+        self._shared_iids = IIDCache()
         if self.import_type == "STIX21":
             self.allow_custom = False
         else:
             self.allow_custom = True
         
         try:
-            initialise_database(self.uri, self.port, self.database, self.user, self.password, self.clear)
+            initialise_database(self.uri, self.port, self.database, self.user, self.password, self.clear, attach)
+            if self.clear:
+                # pooled sessions may point at a database that has just been deleted and re-created
+                self._pool.invalidate(self.uri, self.port, self.database)
             
         except Exception as e:
             logger.error(f'Initialise TypeDB Error: {e}')                    
@@ -73,7 +174,8 @@ class TypeDBSink(DataSink):
         return self._stix_connection
     
 
-    def add(self, stix_data=None, import_type="STIX21"):
+    def add(self, stix_data=None, import_type="STIX21", batch_size=None, max_batch_bytes=None, workers=None,
+            ordered=False, processes=None):
         """Add STIX objects to the typedb server.
 
         Args:
@@ -84,6 +186,25 @@ class TypeDBSink(DataSink):
                 or the mitre attack typeql description. Values can be either:
                         - "STIX21"
                         - "mitre"
+            batch_size (int): the number of objects written per transaction,
+                defaults to the batch size of the sink
+            max_batch_bytes (int): the maximum size of the TypeQL sent in one
+                transaction, defaults to the limit of the sink
+            workers (int): the number of sessions writing concurrently, defaults
+                to the workers of the sink
+            ordered (bool): If True, write the objects in waves ordered by their
+                references, so that referenced objects are written first. This is
+                always the case when more than one worker is used, unless
+                processes is set
+            processes (int): the number of TypeQL generation processes, defaults
+                to the processes of the sink. If above 0, the objects are converted
+                on a process pool and written by workers writer threads, unordered
+
+        Returns:
+            report {}: a dict of stix-id to the number of the batch the object
+                was committed in, or "existing" if it was stored already, as objects
+                are only added once, and are changed with upsert. Objects parked until
+                the objects they refer to arrive are not in it, see resolve_pending
 
         Note:
             ``stix_data`` can be a Bundle object, but each object in it will be
@@ -91,41 +212,236 @@ class TypeDBSink(DataSink):
             the Bundle contained, but not the Bundle itself.
 
         """
-        url = self.uri + ":" + self.port
-        with TypeDB.core_client(url) as client:
-            with client.session(self.database, SessionType.DATA) as session:
-                logger.debug(f'------------------------------------ TypeDB Sink Session Start --------------------------------------------')
-                self._separate_objects(stix_data, self.import_type, session)
-                session.close()
-                logger.debug(f'------------------------------------ TypeDB Sink Session Complete ---------------------------------')
+        batch_size = batch_size or self.batch_size
+        max_batch_bytes = max_batch_bytes or self.max_batch_bytes
+        workers = workers or self.workers
+        processes = processes or self.processes
+        self._claim_journal()
+        report = {}
+        if processes > 0:
+            pipeline = IngestPipeline(self, processes=processes, writers=workers)
+            pipeline.run(stix_data, batch_size, max_batch_bytes, report)
+        elif ordered or workers > 1:
+            report = self._add_in_waves(stix_data, batch_size, max_batch_bytes, workers)
+        else:
+            self._write_batches(enumerate(iter_stix_objects(stix_data)), batch_size, max_batch_bytes, report)
+        return report
+
+    def add_file(self, path, batch_size=None, max_batch_bytes=None, processes=None):
+        """Stream the STIX objects of a bundle file into the typedb server.
+
+        The objects list is parsed incrementally, so memory stays bounded by the
+        batch size rather than the size of the file.
+
+        Args:
+            path (str): path of a json, or gzipped json, file holding a bundle,
+                a list of objects or a single object
+            batch_size (int): the number of objects written per transaction
+            max_batch_bytes (int): the maximum size of the TypeQL sent in one transaction
+            processes (int): the number of TypeQL generation processes, see add
+
+        Returns:
+            counts {}: the number of objects and batches written
+
+        """
+        with open_bundle(path) as stream:
+            return self.add_stream(stream, batch_size, max_batch_bytes, processes)
+
+    def add_stream(self, stream, batch_size=None, max_batch_bytes=None, processes=None):
+        """Stream the STIX objects from a file object, pipe or gzip stream into the typedb server.
+
+        Args:
+            stream (file): a binary or text stream holding json STIX content,
+                optionally gzipped
+            batch_size (int): the number of objects written per transaction
+            max_batch_bytes (int): the maximum size of the TypeQL sent in one transaction
+            processes (int): the number of TypeQL generation processes, see add
+
+        Returns:
+            counts {}: the number of objects and batches written
+
+        Note:
+            Objects are written in the order they appear in the stream, as
+            reference ordering would need the whole bundle in memory.
+
+        """
+        batch_size = batch_size or self.batch_size
+        max_batch_bytes = max_batch_bytes or self.max_batch_bytes
+        processes = processes or self.processes
+        self._claim_journal()
+        stix_dicts = iter_bundle_objects(open_stream(stream))
+        if processes > 0:
+            pipeline = IngestPipeline(self, processes=processes, writers=self.workers)
+            counts = pipeline.run(stix_dicts, batch_size, max_batch_bytes)
+        else:
+            counts = self._write_batches(enumerate(stix_dicts), batch_size, max_batch_bytes)
+        return counts
+
+    def load_chunks(self, directory, batch_size=None, max_batch_bytes=None, workers=None):
+        """Load the TypeQL chunk files written offline by a TypeQLExport, in parallel.
+
+        Each chunk is loaded on its own pooled session, by up to workers threads, with
+        the retries, journal and dead-letter file of the sink. The objects within a chunk
+        are written in order, but the chunks are not, so references between objects in
+        different chunks may not be matched unless workers is 1.
+
+        Args:
+            directory (str): the export directory holding the chunk files
+            batch_size (int): the number of queries written per transaction
+            max_batch_bytes (int): the maximum size of the TypeQL sent in one transaction
+            workers (int): the number of chunks loaded concurrently, defaults to the
+                workers of the sink
+
+        Returns:
+            counts {}: the number of objects and batches written
+
+        """
+        batch_size = batch_size or self.batch_size
+        max_batch_bytes = max_batch_bytes or self.max_batch_bytes
+        workers = workers or self.workers
+        self._claim_journal()
+        sizer = self._new_sizer(batch_size)
+        counts = {"objects": 0, "batches": 0}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self._load_chunk, path, batch_size, max_batch_bytes, sizer)
+                       for path in list_chunks(directory)]
+            for future in as_completed(futures):
+                chunk_counts = future.result()
+                counts["objects"] += chunk_counts["objects"]
+                counts["batches"] += chunk_counts["batches"]
+
+        return counts
+
+    def _load_chunk(self, path, batch_size, max_batch_bytes, sizer):
+        """Write the entries of one chunk file in order, on one pooled session.
+        """
+        counts = {"objects": 0, "batches": 0}
+        logger.debug(f'loading TypeQL chunk {path}')
+        entries = (entry for entry in read_chunk(path)
+                   if self.journal is None or not self.journal.is_committed(entry["index"], entry["stix_id"]))
+        with self._pool.session(self.uri, self.port, self.database) as session:
+            for batch_no, batch in enumerate(self._batch_entries(entries, batch_size, max_batch_bytes, sizer)):
+                self._commit_batch(batch_no, batch, session, sizer)
+                counts["objects"] += len(batch)
+                counts["batches"] += 1
+
+        return counts
+
+    def _claim_journal(self):
+        """Mark the journal as holding the ingest that is starting, refusing it if it holds one already.
+
+        Each ingest numbers its input from 0, so the objects of a second ingest through the
+        same journal would be matched against the positions of the first, and skipped wrongly.
+        """
+        if self.journal is None:
+            return
+        if self._journal_claimed:
+            raise ValueError(f'the journal {self.journal.path} already holds an ingest through this sink, '
+                             f'a new ingest needs a new journal')
+        self._journal_claimed = True
+
+    def _write_batches(self, indexed_objects, batch_size, max_batch_bytes, report=None):
+        """Convert and write the objects in order, on one pooled session, committing once per batch.
+
+        The objects come numbered by their position in the input, before they are parsed, as
+        the pipeline numbers them, so that the journal has the same indexes on every path.
+        """
+        counts = {"objects": 0, "batches": 0}
+        with self._pool.session(self.uri, self.port, self.database) as session:
+            logger.debug('------------------------------------ TypeDB Sink Session Start --------------------------------------------')
+            sizer = self._new_sizer(batch_size)
+            stix_objects = self._parse_indexed(self._skip_committed(indexed_objects))
+            entries = self._convert_entries(stix_objects)
+            batches = self._batch_entries(entries, batch_size, max_batch_bytes, sizer)
+            for batch_no, batch in enumerate(batches):
+                self._commit_batch(batch_no, batch, session, sizer, report)
+                counts["objects"] += len(batch)
+                counts["batches"] += 1
+            logger.debug('------------------------------------ TypeDB Sink Session Complete ---------------------------------')
+
+        return counts
     
-    def _separate_objects(self, stix_data, import_type, session):
+    def _add_in_waves(self, stix_data, batch_size, max_batch_bytes, workers):
+        """Write the objects in topological waves of the reference graph, each wave concurrently.
+
+        Objects are only written once everything they refer to within the data has been
+        committed. Objects in, or depending on, a reference cycle cannot be ordered, so they
+        are logged and tried one at a time after the last wave, where they are parked, until
+        resolve_pending gives up on them.
         """
-          the details for the add details, checking what import_type of data object it is
+        stix_objects = {}
+        indexed_objects = enumerate(iter_stix_objects(stix_data))
+        for index, stix_obj in self._parse_indexed(self._skip_committed(indexed_objects)):
+            if stix_obj["id"] in stix_objects:
+                # stix-id is a key, so an object can only be stored once
+                logger.warning(f'duplicate of {stix_obj["id"]} at object {index}, skipping it')
+                continue
+            stix_objects[stix_obj["id"]] = (index, stix_obj)
+
+        graph = build_reference_graph(stix_obj for index, stix_obj in stix_objects.values())
+        waves, cycles = topological_waves(graph)
+        for cycle in cycles:
+            logger.error(f'Reference cycle, objects cannot be ordered -> {cycle}')
+        ordered_ids = {stix_id for wave in waves for stix_id in wave}
+        blocked = [stix_id for stix_id in graph if stix_id not in ordered_ids]
+
+        report = {}
+        batch_no = 0
+        sizer = self._new_sizer(batch_size)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for wave_no, wave in enumerate(waves + [[stix_id] for stix_id in blocked]):
+                logger.debug(f'----------------------------- Wave {wave_no}, {len(wave)} Objects -----------------------------')
+                entries = self._convert_entries(stix_objects[stix_id] for stix_id in wave)
+                futures = []
+                for batch in self._batch_entries(entries, batch_size, max_batch_bytes, sizer):
+                    futures.append(executor.submit(self._submit_pooled_batch, batch_no, batch, sizer, report))
+                    batch_no += 1
+                # the next wave depends on this one, so wait for every batch to commit
+                for future in as_completed(futures):
+                    future.result()
+
+        return report
+
+    def _separate_objects(self, stix_data, import_type, index=None):
+        """
+          the details for the add details, checking what import_type of data object it is,
+          and yielding each of the STIX objects in turn. The index of a single object in the
+          input, if known, is kept in the dead-letter file when it fails to parse
         """
         
         if isinstance(stix_data, (v21.Bundle)):
             # recursively add individual STIX objects
             for stix_obj in stix_data.get("objects", []):
-                self._separate_objects(stix_obj, import_type=import_type, session=session)
+                yield from self._separate_objects(stix_obj, import_type=import_type)
 
         elif isinstance(stix_data, _STIXBase):
             # adding python STIX object
-            self._submit_Stix_object(stix_data, import_type=import_type, session=session)
+            yield stix_data
+
+        elif isinstance(stix_data, (str, dict)) and self.trusted:
+            yield from self._separate_trusted(stix_data, import_type, index)
 
         elif isinstance(stix_data, (str, dict)):
-            parsed_data = parse(stix_data, allow_custom=self.allow_custom)
+            try:
+                with self.metrics.timer("parse") as labels:
+                    parsed_data = parse(stix_data, allow_custom=self.allow_custom)
+                    labels["stix_type"] = parsed_data.get("type")
+            except Exception as e:
+                if self.dead_letter is None:
+                    raise
+                self.dead_letter.record("parse", e, stix_data, index=index)
+                return
             if isinstance(parsed_data, _STIXBase):
-                logger.debug(f'STIX Base')
-                self._separate_objects(parsed_data, import_type=import_type, session=session)
+                logger.debug('STIX Base')
+                yield from self._separate_objects(parsed_data, import_type=import_type)
             else:
                 # custom unregistered object import_type
-                self._submit_Stix_object(parsed_data, import_type=import_type, session=session)
+                yield parsed_data
 
-        elif isinstance(stix_data, list):
-            # recursively add individual STIX objects
+        elif isinstance(stix_data, (list, Iterator)):
+            # recursively add individual STIX objects, from a list or a stream
             for stix_obj in stix_data:
-                self._separate_objects(stix_obj, import_type=import_type, session=session)
+                yield from self._separate_objects(stix_obj, import_type=import_type)
 
         else:
             raise TypeError(
@@ -134,36 +450,781 @@ class TypeDBSink(DataSink):
                 "or a JSON formatted STIX bundle",
             )    
             
-            
-    def _submit_Stix_object(self, stix_obj, import_type, session):
-        """Write the given STIX object to the TypeDB database.
+    def _separate_trusted(self, stix_data, import_type, index=None):
+        """
+          the trusted version of the str and dict branch, yielding plain dicts that skip the stix2 parse,
+          with a sample of them still parsed as a check on the feed. Objects that fail the check,
+          or the coercion, go to the dead-letter file, if there is one, as in the untrusted branch
         """
+        if isinstance(stix_data, str):
+            try:
+                stix_data = json.loads(stix_data)
+            except Exception as e:
+                if self.dead_letter is None:
+                    raise
+                self.dead_letter.record("parse", e, stix_data, index=index)
+                return
+
+        if isinstance(stix_data, list):
+            yield from self._separate_objects(stix_data, import_type=import_type)
+
+        elif stix_data.get("type") == "bundle":
+            for stix_obj in stix_data.get("objects", []):
+                yield from self._separate_trusted(stix_obj, import_type=import_type)
+
+        else:
+            try:
+                with self.metrics.timer("parse", stix_data.get("type")):
+                    if self.validate_sample and random.random() < self.validate_sample:
+                        parse(stix_data, allow_custom=self.allow_custom)
+                    stix_obj = coerce_trusted_dict(stix_data)
+            except Exception as e:
+                if self.dead_letter is None:
+                    raise
+                self.dead_letter.record("parse", e, stix_data, index=index)
+                return
+            yield stix_obj
+
+    def _parse_indexed(self, indexed_objects):
+        """
+          parse each of the (index, object) pairs of the flattened input, keeping the index, so
+          that an object sent to the dead-letter file does not shift the index of the next ones
+        """
+        for index, stix_obj in indexed_objects:
+            for parsed_obj in self._separate_objects(stix_obj, self.import_type, index):
+                yield index, parsed_obj
+
+    def _skip_committed(self, indexed_objects):
+        """
+          drop the objects that the journal records as already committed, keeping the
+          index of each object in the input
+        """
+        for index, stix_obj in indexed_objects:
+            if self.journal is not None and self.journal.is_committed(index, stix_obj["id"]):
+                continue
+            yield index, stix_obj
+
+    def _convert_entries(self, indexed_objects):
+        """
+          convert each of the (index, object) pairs into its batch entry, sending the objects
+          that fail to the dead-letter file, if there is one
+        """
+        for index, stix_obj in indexed_objects:
+            try:
+                yield self._convert_Stix_object(stix_obj, self.import_type, index)
+            except Exception as e:
+                if self.dead_letter is None:
+                    raise
+                self.dead_letter.record("convert", e, stix_obj, index=index)
+
+    def _convert_Stix_object(self, stix_obj, import_type, index=None):
+        """Convert the given STIX object, or trusted dict, into a batch entry holding its TypeQL.
+        """
+        logger.debug(f'----------------------------- Load {stix_obj["type"]} Object -----------------------------')
+        if logger.isEnabledFor(logging.DEBUG):
+            if isinstance(stix_obj, _STIXBase):
+                logger.debug(stix_obj.serialize(pretty=True))
+            else:
+                logger.debug(json.dumps(stix_obj, indent=4, default=str))
+        logger.debug('----------------------------- TypeQL Statements -----------------------------')
+        with self.metrics.timer("generate", stix_obj["type"]):
+            entry = make_entry(stix_obj, import_type, index, keep_object=self.dead_letter is not None,
+                               max_refs=self.max_refs, share_sub_objects=self.share_sub_objects)
+        logger.debug(f'query string?-> {entry["match"] + entry["insert"]}')
+        return entry
+
+    @staticmethod
+    def _batch_entries(entries, batch_size, max_batch_bytes=None, sizer=None):
+        """Group converted entries into batches, each of which is written in one transaction.
+
+        A batch is closed when it holds batch_size entries, or the current size of the
+        sizer if one is given, or when adding the next entry would take the TypeQL of the
+        batch over max_batch_bytes. An entry that is on its own larger than max_batch_bytes
+        is sent in a batch by itself.
+        """
+        batch = []
+        batch_bytes = 0
+        for entry in entries:
+            if not entry["match"] and not entry["insert"]:
+                logger.warning(f'Object type {entry["stix_type"]} already existent')
+                continue
+            entry_bytes = len(entry["match"].encode("utf-8")) + len(entry["insert"].encode("utf-8"))
+            over_size = max_batch_bytes is not None and batch_bytes + entry_bytes > max_batch_bytes
+            if sizer is not None:
+                batch_size = sizer.size
+            if batch and (len(batch) >= batch_size or over_size):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(entry)
+            batch_bytes += entry_bytes
+
+        if batch:
+            yield batch
+
+    def _submit_batch(self, batch, session):
+        """Write a batch of converted STIX objects to the TypeDB database, in a single transaction.
+
+        References with a cached IID are matched by iid. If a query matches nothing that way,
+        a cached IID may be stale, so it is invalidated and the query is run again by stix-id.
+        The IIDs in the answers are cached once the transaction commits.
+
+        Shared sub-objects that are not stored yet are inserted first, in the same transaction,
+        and every shared sub-object is then matched by iid. Another writer may insert the same
+        ones at the same time, so after the commit the inserted ones are merged with any
+        duplicates. When kill chains are materialised,
+        the kill chain phases of the batch are joined to their kill-chain relations before the commit.
+        """
+        insert_tql = ''
+        learned = {}
+        shared_iids = {}
+        inserted_keys = []
+        phases = {} if self.materialise_kill_chains else None
         try:
-            logger.debug(f'----------------------------- Load {stix_obj.type} Object -----------------------------')
-            logger.debug(stix_obj.serialize(pretty=True))
-            logger.debug(f'----------------------------- TypeQL Statements -----------------------------')
-            match_tql, insert_tql = raw_stix2_to_typeql(stix_obj, import_type)
-            logger.debug(f'query string?-> {match_tql+insert_tql}')
-            logger.debug(f'----------------------------- Object Loaded -----------------------------')
             with session.transaction(TransactionType.WRITE) as write_transaction:
-                if not match_tql:
-                    if not insert_tql:
-                        logger.warning(f'Object type {stix_obj.type} already existent')
-                        return
-                    else:
-                        insert_iterator = write_transaction.query().insert(insert_tql)
-                else:
-                    insert_iterator = write_transaction.query().insert(match_tql+insert_tql)                    
-                     
-                for result in insert_iterator:
-                    logger.debug(f'typedb response ->\n{result}')
-                
-                write_transaction.commit()
-                
+                shared_iids = self._ensure_shared(write_transaction, batch, inserted=inserted_keys)
+                for entry in batch:
+                    insert_tql = entry["insert"]
+                    match_tql, used = rewrite_content_keys(entry["match"], shared_iids), []
+                    if self.iid_cache is not None:
+                        match_tql, used = self.iid_cache.rewrite_match(match_tql)
+                    answered = self._run_insert(write_transaction, match_tql + insert_tql, entry, learned, phases)
+                    if used and not answered:
+                        self.iid_cache.invalidate(used)
+                        match_tql = rewrite_content_keys(entry["match"], shared_iids)
+                        self._run_insert(write_transaction, match_tql + insert_tql, entry, learned, phases)
+                created = materialise_kill_chains(write_transaction, phases) if phases else []
+
+                with self.metrics.timer("commit"):
+                    write_transaction.commit()
+                logger.debug(f'----------------------------- {len(batch)} Objects Loaded -----------------------------')
+            self.metrics.inc("batches_committed")
+            for entry in batch:
+                self.metrics.inc("objects_written", stix_type=entry["stix_type"])
+            if self.iid_cache is not None:
+                self.iid_cache.put_many(learned)
+            self._shared_iids.put_many(shared_iids)
+
         except Exception as e:
             logger.error(f'Stix Object Submission Error: {e}')
             logger.error(f'Query: {insert_tql}')
             raise
+        if inserted_keys:
+            self._retry_conflicts(self._submit_shared_merges, inserted_keys, session)
+        if created:
+            self._retry_conflicts(self._submit_kill_chain_merges, created, session)
+
+    def _submit_kill_chain_merges(self, names, session):
+        """Merge the kill-chain relations that concurrent writers created for the same names.
+        """
+        with session.transaction(TransactionType.WRITE) as write_transaction:
+            if merge_kill_chains(write_transaction, names):
+                write_transaction.commit()
+
+    def _submit_shared_merges(self, keys, session):
+        """Merge the shared sub-objects that concurrent writers inserted for the same content keys,
+        caching the IIDs of the ones kept.
+        """
+        with session.transaction(TransactionType.WRITE) as write_transaction:
+            kept, merged = merge_shared_sub_objects(write_transaction, keys)
+            if merged:
+                write_transaction.commit()
+        self._shared_iids.put_many(kept)
+
+    def _ensure_shared(self, write_transaction, batch, cached=True, inserted=None):
+        """Insert the shared sub-objects of a batch that are not stored yet, nested ones first.
+
+        Of the duplicates that concurrent writers may have stored for a content key, the one
+        with the lowest IID is used, as it is the one that merge_shared_sub_objects keeps.
+
+        Args:
+            write_transaction: the transaction the batch is written in
+            batch: the batch entries, whose shared lists hold the sub-objects
+            cached: if False, only the database is checked for stored sub-objects, not the
+                content keys known from earlier batches
+            inserted: a list that the content keys of the inserted sub-objects are added to
+
+        Returns:
+            iids {}: a dict of the content key of each shared sub-object of the batch to its IID
+        """
+        shared = {}
+        for entry in batch:
+            for sub_object in entry.get("shared", ()):
+                shared.setdefault(sub_object["key"], sub_object)
+        iids = {}
+        if not shared:
+            return iids
+        unknown = []
+        for key in shared:
+            iid = self._shared_iids.get(key) if cached else None
+            if iid is None:
+                unknown.append(key)
+            else:
+                iids[key] = iid
+        stored = {}
+        for start in range(0, len(unknown), 500):
+            for answer in write_transaction.query().match(content_keys_query(unknown[start:start + 500])):
+                key, iid = answer.get("k").get_value(), answer.get("s").get_iid()
+                stored[key] = min(iid, stored.get(key, iid))
+        iids.update(stored)
+        for key, sub_object in shared.items():
+            if key in iids:
+                continue
+            match = rewrite_content_keys(sub_object["match"], iids)
+            insert_tql = ('match' + match + '\n' if match else '') + 'insert ' + sub_object["insert"]
+            for answer in write_transaction.query().insert(insert_tql):
+                iids[key] = answer.get(sub_object["var"]).get_iid()
+            if inserted is not None:
+                inserted.append(key)
+
+        return iids
+
+    def _new_sizer(self, batch_size):
+        """Create the adaptive batch size shared by the writers of one ingest.
+        """
+        return AdaptiveBatchSizer(batch_size, minimum=self.min_batch_size)
+
+    def _commit_batch(self, batch_no, batch, session, sizer=None, report=None, record=True):
+        """Write a batch, parking the objects whose references are missing, then write the parked
+        objects that the batch resolves, in batches of the current size.
+        """
+        sizer = sizer or self._new_sizer(len(batch))
+        if not record:
+            self._commit_parts(batch_no, batch, session, sizer, report, record)
+            return
+
+        batch, stored = self._defer_unresolved(batch_no, batch, session, report)
+        batches = [batch]
+        # the objects found stored release the entries waiting for them, as committed ones do
+        committed = sorted(stored)
+        while True:
+            if self.pending is not None:
+                ready = self.pending.resolve(committed)
+                size = sizer.size
+                batches += [ready[i:i + size] for i in range(0, len(ready), size)]
+            if not batches:
+                break
+            committed = self._commit_parts(batch_no, batches.pop(0), session, sizer, report, record)
+
+    def _defer_unresolved(self, batch_no, batch, session, report=None):
+        """Drop the entries of a batch whose objects are stored already, and park the entries that
+        refer to stix-ids that are neither in the database nor written earlier in the batch,
+        returning the entries that can be written, and the stix-ids found stored.
+
+        The references of the whole batch are checked in one read, skipping the stix-ids known to
+        be stored, as the pending store knows they were just committed, or their IIDs are cached,
+        and the stix-ids of the batch are checked in the same read. When every reference is known,
+        there is no read. Without that read, only the objects known to be stored are dropped,
+        and _commit_parts reads the rest if the commit fails.
+        """
+        batch_ids = {entry["stix_id"] for entry in batch}
+        stored = {stix_id for stix_id in batch_ids if self._is_stored(stix_id)}
+        absent = set()
+        if self.pending is not None:
+            unknown = {ref for entry in batch for ref in entry.get("refs", ())
+                       if ref not in batch_ids and not self._is_stored(ref)}
+            if unknown:
+                existing = self._existing_ids(unknown | (batch_ids - stored), session)
+                stored |= existing & batch_ids
+                absent = unknown - existing
+        if stored:
+            batch = self._skip_existing(batch_no, batch, stored, report)
+        if self.pending is None:
+            return batch, stored
+
+        ready = []
+        written = set(stored)
+        for entry in batch:
+            missing = {ref for ref in entry.get("refs", ())
+                       if ref in absent or (ref in batch_ids and ref not in written)}
+            if missing:
+                self._unresolved(self.pending.park(entry, missing))
+            else:
+                ready.append(entry)
+                written.add(entry["stix_id"])
+
+        return ready, stored
+
+    def _is_stored(self, stix_id):
+        """Check whether the stix-id is known to be in the database, without reading it.
+        """
+        if self.pending is not None and self.pending.is_known(stix_id):
+            return True
+        return self.iid_cache is not None and self.iid_cache.get(stix_id) is not None
+
+    def _skip_existing(self, batch_no, batch, stored, report=None):
+        """Drop the entries of the objects already in the database, as stix-id is a key and they
+        cannot be inserted again, reporting them as existing, and recording them in the journal
+        so that a resumed ingest skips them. Stored objects are changed with upsert, not add.
+
+        Returns the entries left to write.
+        """
+        existing = [entry for entry in batch if entry["stix_id"] in stored]
+        if not existing:
+            return batch
+        logger.info(f'{len(existing)} objects of batch {batch_no} are stored already, skipping them')
+        for entry in existing:
+            self.metrics.inc("objects_existing", stix_type=entry["stix_type"])
+            if report is not None:
+                report[entry["stix_id"]] = "existing"
+        if self.journal is not None:
+            self.journal.record(batch_no, existing)
+        return [entry for entry in batch if entry["stix_id"] not in stored]
+
+    def _existing_ids(self, stix_ids, session, chunk_size=500):
+        """Find which of the stix-ids are in the database, in as few reads as the chunk size allows.
+        """
+        stix_ids = sorted(stix_ids)
+        existing = set()
+        if not stix_ids:
+            return existing
+        learned = {}
+        with session.transaction(TransactionType.READ) as read_transaction:
+            for start in range(0, len(stix_ids), chunk_size):
+                query = existing_ids_query(stix_ids[start:start + chunk_size])
+                for answer in read_transaction.query().match(query):
+                    stix_id = answer.get("id").get_value()
+                    existing.add(stix_id)
+                    learned[stix_id] = answer.get("x").get_iid()
+
+        if self.iid_cache is not None:
+            self.iid_cache.put_many(learned)
+        return existing
+
+    def _unresolved(self, entries):
+        """Give up on parked entries whose references never arrived.
+        """
+        for entry in entries:
+            error = ValueError(f'unresolved references of {entry["stix_id"]}, from {entry.get("refs")}')
+            if self.dead_letter is not None:
+                self.dead_letter.record("resolve", error, entry=entry)
+            else:
+                logger.error(f'{error}, object not written')
+
+    def resolve_pending(self):
+        """Check the database for the stix-ids that parked objects are waiting for, and write the
+        objects they resolve.
+
+        Parked objects are written as soon as the objects they refer to are committed through
+        this sink, with no reads, so this is only needed for references written by another
+        writer or client. It reads every missing stix-id, so it is run once an ingest is done,
+        not after each add. The parked objects left in a reference cycle, or waiting for one that
+        is, can never be written, so they are given up on, as unresolved.
+
+        Returns:
+            report {}: a dict of stix-id to the number of the batch the object was committed
+                in, or "existing", as for add, or "unresolved" if it was given up on, and
+                dead-lettered or logged
+
+        """
+        report = {}
+        if self.pending is None or not len(self.pending):
+            return report
+        with self._pool.session(self.uri, self.port, self.database) as session:
+            ready = self.pending.resolve(self._existing_ids(self.pending.missing_ids(), session))
+            if ready:
+                self._commit_batch(None, ready, session, report=report)
+        blocked, cycles = self.pending.take_blocked()
+        for cycle in cycles:
+            logger.error(f'Reference cycle, objects cannot be written -> {cycle}')
+        self._unresolved(blocked)
+        for entry in blocked:
+            report[entry["stix_id"]] = "unresolved"
+        if len(self.pending):
+            logger.info(f'{len(self.pending)} objects waiting for references, '
+                        f'missing {len(self.pending.missing_ids())} stix-ids')
+        return report
+
+    def flush_pending(self):
+        """Write the parked objects whose references are in the database, see resolve_pending,
+        and give up on the rest, writing them to the dead-letter file, or logging them.
+
+        Returns:
+            count (int): the number of objects that were still waiting for references
+
+        """
+        report = self.resolve_pending()
+        entries = self.pending.drain() if self.pending is not None else []
+        self._unresolved(entries)
+        return len(entries) + sum(1 for status in report.values() if status == "unresolved")
+
+    def _commit_parts(self, batch_no, batch, session, sizer, report=None, record=True):
+        """Write a batch, retrying on write conflicts and splitting it on conflicts and oversize errors.
+
+        A conflicting write is retried after a jittered exponential backoff. Both conflicts
+        and oversize errors shrink the sizer, and the failed batch is split down to its new
+        size, so that each retry has less to collide on or to send. Each part is recorded
+        as it commits. The error is raised once the retry policy is exhausted, or when a
+        single object is too large to send.
+
+        A batch that fails otherwise is checked for objects already in the database, which are
+        dropped, as in _skip_existing, and the rest of the batch is written again.
+
+        With a dead-letter file, a batch that still fails is bisected instead, until the
+        objects that fail on their own are isolated and written to the file.
+
+        The follow-up queries of split reference lists are written after their part commits,
+        and before it is recorded, so that a resumed ingest never skips a partial object.
+        Returns the stix-ids of the objects committed.
+        """
+        committed = []
+        pending = [batch] if batch else []
+        failures = 0
+        while pending:
+            part = pending.pop(0)
+            try:
+                self._submit_batch(part, session)
+            except Exception as e:
+                conflict = is_conflict_error(e)
+                retryable = conflict or (is_oversize_error(e) and len(part) > 1)
+                failures += 1
+                if retryable and failures < self.retry.max_attempts:
+                    size = sizer.shrink()
+                    if len(part) > size:
+                        size = min(size, (len(part) + 1) // 2)
+                        pending = [part[i:i + size] for i in range(0, len(part), size)] + pending
+                    else:
+                        pending.insert(0, part)
+                    if conflict:
+                        self.metrics.inc("write_conflicts")
+                        delay = self.retry.backoff(failures)
+                        logger.warning(f'write conflict on batch {batch_no}, retrying in {delay:.3f}s')
+                        time.sleep(delay)
+                    continue
+                if record and not retryable:
+                    # an object stored since the batch was checked, by another writer or an
+                    # earlier ingest, fails the commit on its stix-id key, so it is dropped
+                    stored = self._existing_ids({entry["stix_id"] for entry in part}, session)
+                    if stored:
+                        part = self._skip_existing(batch_no, part, stored, report)
+                        committed += sorted(stored)
+                        if part:
+                            pending.insert(0, part)
+                        failures = 0
+                        continue
+                if retryable:
+                    logger.error(f'giving up on batch {batch_no} after {failures} attempts')
+                if self.dead_letter is None:
+                    raise
+                failures = 0
+                if len(part) > 1:
+                    half = len(part) // 2
+                    pending = [part[:half], part[half:]] + pending
+                else:
+                    self.dead_letter.record("commit", e, entry=part[0])
+                continue
+            failures = 0
+            sizer.success()
+            if record:
+                self._commit_followups(batch_no, part, session, sizer)
+                self._record_batch(batch_no, part, report)
+            committed += [entry["stix_id"] for entry in part]
+
+        return committed
+
+    def _commit_followups(self, batch_no, batch, session, sizer):
+        """Write the follow-up queries of the entries of a committed batch, each in its own transaction.
+        """
+        for entry in batch:
+            for match, insert in entry.get("followups", []):
+                followup = {key: entry[key] for key in ("stix_id", "stix_type", "index", "object") if key in entry}
+                followup.update(match=match, insert=insert)
+                self._commit_batch(batch_no, [followup], session, sizer, record=False)
+
+    def replay_dead_letters(self, path, batch_size=None, max_batch_bytes=None):
+        """Ingest again the objects of a dead-letter file, once the cause of their failure is fixed.
+
+        Args:
+            path (str): path of the dead-letter file to replay
+            batch_size (int): the number of objects written per transaction
+            max_batch_bytes (int): the maximum size of the TypeQL sent in one transaction
+
+        Returns:
+            counts {}: the number of objects and batches written
+
+        Note:
+            Objects that fail again go to the dead-letter file of this sink, which must
+            not be the file being replayed.
+
+        """
+        if self.dead_letter is not None and os.path.abspath(self.dead_letter.path) == os.path.abspath(path):
+            raise ValueError(f'cannot replay the dead-letter file {path} into itself')
+        batch_size = batch_size or self.batch_size
+        max_batch_bytes = max_batch_bytes or self.max_batch_bytes
+        self._claim_journal()
+        # the objects keep their index in the input they failed in, which a journal of that input holds
+        indexed_objects = ((record["index"], record["object"]) for record in read_dead_letters(path)
+                           if record["object"] is not None)
+        return self._write_batches(indexed_objects, batch_size, max_batch_bytes)
+
+    def upsert(self, stix_data, batch_size=None):
+        """Write new versions of STIX objects, changing only what differs from the stored version.
+
+        Each object is compared with its stored version, property by property. The values of
+        the changed properties are removed and written again, and the sub-objects of changed
+        properties, such as hashes, kill chain phases and external references, are replaced,
+        while the rest of the object, its IID and the relations other objects have with it
+        are kept. Objects not yet stored are inserted, and stored versions modified later
+        than the incoming version are left as they are.
+
+        Args:
+            stix_data (STIX object OR dict OR str OR list): STIX content, as for add
+            batch_size (int): the number of objects compared and written per transaction,
+                defaults to the batch size of the sink
+
+        Returns:
+            report {}: a dict of stix-id to "inserted", "updated", "unchanged" or "stale"
+
+        Note:
+            Inserted objects are not parked when their references are missing, as in add.
+
+        """
+        batch_size = batch_size or self.batch_size
+        report = {}
+        with self._pool.session(self.uri, self.port, self.database) as session:
+            batch = []
+            for stix_obj in self._separate_objects(stix_data, self.import_type):
+                batch.append(stix_obj)
+                if len(batch) >= batch_size:
+                    self._upsert_batch(batch, session, report)
+                    batch = []
+            if batch:
+                self._upsert_batch(batch, session, report)
+
+            inserted = [stix_id for stix_id, status in report.items() if status == "inserted"]
+            if self.pending is not None and inserted:
+                ready = self.pending.resolve(inserted)
+                if ready:
+                    self._commit_batch(None, ready, session)
+
+        return report
+
+    def _upsert_batch(self, batch, session, report):
+        """Compare and write a batch of objects in one transaction, retrying write conflicts.
+
+        If the batch fails otherwise, each object is written in its own transaction, so that
+        only the objects that fail on their own are sent to the dead-letter file, or raised.
+        """
+        try:
+            report.update(self._retry_conflicts(self._submit_upserts, batch, session))
+        except Exception as e:
+            if len(batch) > 1:
+                for stix_obj in batch:
+                    self._upsert_batch([stix_obj], session, report)
+            elif self.dead_letter is None:
+                raise
+            else:
+                self.dead_letter.record("upsert", e, batch[0])
+
+    def _submit_upserts(self, batch, session):
+        """Run the upsert queries of a batch of objects in a single write transaction.
+
+        With shared sub-objects, the ones an object needs are found, or inserted, after its
+        old sub-objects are deleted, as that may delete a shared sub-object no longer in use.
+        """
+        statuses = {}
+        phases = {}
+        inserted_keys = []
+        with session.transaction(TransactionType.WRITE) as write_transaction:
+            for stix_obj in batch:
+                with collect_shared_sub_objects() if self.share_sub_objects else nullcontext() as shared:
+                    status, queries = upsert_typeql(stix_obj, write_transaction, self.import_type)
+                self._run_queries(write_transaction, [query for query in queries if query[0] == "delete"])
+                iids = self._ensure_shared(write_transaction, [{"shared": shared or []}], cached=False,
+                                           inserted=inserted_keys)
+                answers = []
+                self._run_queries(write_transaction, [(kind, rewrite_content_keys(query, iids))
+                                                      for kind, query in queries if kind != "delete"], answers)
+                if self.materialise_kill_chains:
+                    phase_vars = kill_chain_phase_vars(stix_obj)
+                    for answer in answers:
+                        collect_phases(phases, answer, phase_vars)
+                statuses[stix_obj["id"]] = status
+            created = materialise_kill_chains(write_transaction, phases) if phases else []
+
+            write_transaction.commit()
+        self._shared_iids.clear()
+        if inserted_keys:
+            self._retry_conflicts(self._submit_shared_merges, inserted_keys, session)
+        if created:
+            self._retry_conflicts(self._submit_kill_chain_merges, created, session)
+        return statuses
+
+    def delete(self, stix_ids, batch_size=None):
+        """Delete STIX objects, with the sub-objects they own, such as hashes, kill chain phases,
+        external references and extensions, so that nothing is left orphaned.
+
+        The objects it refers to, and the objects that refer to it, are kept, but lose it as a
+        role player.
+
+        Args:
+            stix_ids (str OR list): the stix-id, or stix-ids, of the objects to delete
+            batch_size (int): the number of objects deleted per transaction, defaults to the
+                batch size of the sink
+
+        Returns:
+            report {}: a dict of stix-id to "deleted", or "missing" if it was not stored
+
+        """
+        report = self._change_by_id(stix_ids, batch_size, self._submit_deletes)
+        deleted = [stix_id for stix_id, status in report.items() if status == "deleted"]
+        # shared sub-objects that only the deleted objects used are gone too
+        self._shared_iids.clear()
+        if self.iid_cache is not None:
+            self.iid_cache.invalidate(deleted)
+        if self.pending is not None:
+            self.pending.forget(deleted)
+        return report
+
+    def revoke(self, stix_ids, batch_size=None):
+        """Revoke STIX domain objects and relationships, as a new version, with revoked set to
+        true and modified set to now, keeping the rest of the object.
+
+        Args:
+            stix_ids (str OR list): the stix-id, or stix-ids, of the objects to revoke
+            batch_size (int): the number of objects revoked per transaction, defaults to the
+                batch size of the sink
+
+        Returns:
+            report {}: a dict of stix-id to "revoked", "unchanged" if it was already revoked,
+                or "missing" if it was not stored
+
+        """
+        if isinstance(stix_ids, str):
+            stix_ids = [stix_ids]
+        for stix_id in stix_ids:
+            stix_type = get_type_from_id(stix_id)
+            if not (is_sdo(stix_type) or is_sro(stix_type)):
+                raise ValueError(f'only SDOs and SROs can be revoked, not {stix_id}')
+        return self._change_by_id(stix_ids, batch_size, self._submit_revokes)
+
+    def _change_by_id(self, stix_ids, batch_size, submit):
+        """Run submit on the stix-ids in batches, each in its own transaction, retrying write conflicts.
+        """
+        if isinstance(stix_ids, str):
+            stix_ids = [stix_ids]
+        stix_ids = list(dict.fromkeys(stix_ids))
+        batch_size = batch_size or self.batch_size
+        report = {}
+        with self._pool.session(self.uri, self.port, self.database) as session:
+            for start in range(0, len(stix_ids), batch_size):
+                report.update(self._retry_conflicts(submit, stix_ids[start:start + batch_size], session))
+
+        return report
+
+    def _submit_deletes(self, stix_ids, session):
+        """Delete a batch of objects and their owned sub-graphs in a single write transaction.
+        """
+        statuses = {}
+        with session.transaction(TransactionType.WRITE) as write_transaction:
+            for stix_id in stix_ids:
+                obj_var, match = get_embedded_match(stix_id)
+                things = [answer.get(obj_var[1:]) for answer in write_transaction.query().match('match ' + match)]
+                for thing in things:
+                    for query in delete_object_queries(thing, write_transaction):
+                        write_transaction.query().delete(query)
+                statuses[stix_id] = "deleted" if things else "missing"
+
+            write_transaction.commit()
+        logger.debug(f'----------------------------- {len(stix_ids)} Objects Deleted -----------------------------')
+        return statuses
+
+    def _submit_revokes(self, stix_ids, session):
+        """Revoke a batch of objects in a single write transaction.
+        """
+        statuses = {}
+        modified = datetime.now(timezone.utc)
+        with session.transaction(TransactionType.WRITE) as write_transaction:
+            revoked_type = write_transaction.concepts().get_attribute_type("revoked")
+            for stix_id in stix_ids:
+                obj_var, match = get_embedded_match(stix_id)
+                things = [answer.get(obj_var[1:]) for answer in write_transaction.query().match('match ' + match)]
+                statuses[stix_id] = "unchanged" if things else "missing"
+                for thing in things:
+                    if any(attr.get_value() for attr in thing.as_remote(write_transaction).get_has(attribute_type=revoked_type)):
+                        continue
+                    self._run_queries(write_transaction, revoke_queries(thing.get_iid(), modified))
+                    statuses[stix_id] = "revoked"
+
+            write_transaction.commit()
+        return statuses
+
+    def _retry_conflicts(self, submit, batch, session):
+        """Run submit on a batch, retrying it after a backoff while it fails on write conflicts.
+        """
+        failures = 0
+        while True:
+            try:
+                return submit(batch, session)
+            except Exception as e:
+                failures += 1
+                if not is_conflict_error(e) or failures >= self.retry.max_attempts:
+                    raise
+                self.metrics.inc("write_conflicts")
+                delay = self.retry.backoff(failures)
+                logger.warning(f'write conflict, retrying in {delay:.3f}s')
+                time.sleep(delay)
+
+    @staticmethod
+    def _run_queries(write_transaction, queries, answers=None):
+        """Run a list of ("delete" or "insert", typeql) queries in order, adding the insert
+        answers to answers, if given.
+        """
+        for kind, query in queries:
+            logger.debug(f'{kind} query ->\n{query}')
+            if kind == "delete":
+                write_transaction.query().delete(query)
+            else:
+                for result in write_transaction.query().insert(query):
+                    logger.debug(f'typedb response ->\n{result}')
+                    if answers is not None:
+                        answers.append(result)
+
+    def _run_insert(self, write_transaction, insert_tql, entry, learned, phases=None):
+        """Run one insert query, adding the IIDs of the object and its references to learned,
+        and if phases is given, the IIDs of its kill chain phases to it, by kill chain name.
+
+        Returns True if the query matched and inserted anything.
+        """
+        answered = False
+        bound = match_vars(entry["match"]) if self.iid_cache is not None else {}
+        var = object_var(entry["stix_type"])
+        with self.metrics.timer("execute", entry["stix_type"]):
+            for result in write_transaction.query().insert(insert_tql):
+                answered = True
+                logger.debug(f'typedb response ->\n{result}')
+                if phases is not None and "kill_chains" in entry:
+                    collect_phases(phases, result, entry["kill_chains"])
+                if self.iid_cache is None:
+                    continue
+                for name, concept in result.map().items():
+                    stix_id = bound.get(name, entry["stix_id"] if name == var else None)
+                    if stix_id is not None:
+                        learned[stix_id] = concept.get_iid()
+
+        return answered
+
+    def _record_batch(self, batch_no, batch, report=None):
+        """Account for a committed batch, in the report and in the checkpoint journal.
+        """
+        if report is not None:
+            for entry in batch:
+                report[entry["stix_id"]] = batch_no
+        if self.journal is not None:
+            self.journal.record(batch_no, batch)
+
+    def _submit_pooled_batch(self, batch_no, batch, sizer=None, report=None):
+        """Write a batch of converted STIX objects on a session checked out from the pool.
+        """
+        with self._pool.session(self.uri, self.port, self.database) as session:
+            self._commit_batch(batch_no, batch, session, sizer, report)
+
+    def _submit_Stix_object(self, stix_obj, import_type, session):
+        """Write the given STIX object to the TypeDB database.
+        """
+        entries = [self._convert_Stix_object(stix_obj, import_type)]
+        for batch in self._batch_entries(entries, 1):
+            self._commit_batch(0, batch, session)
         
         
 class TypeDBSource(DataSource):
@@ -180,11 +1241,13 @@ class TypeDBSource(DataSource):
             - user (str): Username for TypeDB, if cluster, otherwise None
             - password (str): Password for TypeDB, if cluster, otherwise None
         - import_type (str): It forces the parser to use either the stix2.1, or mitre att&ck
+        - pool (TypeDBConnectionPool): The client and session pool to use, defaults to the shared pool
+        - metrics (MetricsRegistry): The registry that the stage timings of the source are
+            recorded in, defaults to the shared default_metrics
 
     """
-    def __init__(self, connection, import_type="STIX21", **kwargs):	
+    def __init__(self, connection, import_type="STIX21", pool=None, metrics=None, **kwargs):	
         super(TypeDBSource, self).__init__()
-        print(f'TypeDBSink: {connection}')
         self._stix_connection = connection
         self.uri = connection["uri"]
         self.port = connection["port"]
@@ -192,6 +1255,8 @@ class TypeDBSource(DataSource):
         self.user = connection["user"]
         self.password = connection["password"]
         self.import_type = import_type
+        self._pool = pool or default_pool
+        self.metrics = metrics or default_metrics
         if self.import_type == "STIX21":
             self.allow_custom = False
         else:
@@ -220,17 +1285,18 @@ class TypeDBSource(DataSource):
             obj_var, type_ql = get_embedded_match(stix_id)
             match = 'match ' + type_ql
             logger.debug(f' typeql -->: {match}')
-            g_uri = self.uri + ':' + self.port
-            with TypeDB.core_client(g_uri) as client:
-                with client.session(self.database, SessionType.DATA) as session:
-                    with session.transaction(TransactionType.READ) as read_transaction:
+            with self._pool.session(self.uri, self.port, self.database) as session:
+                with session.transaction(TransactionType.READ) as read_transaction:
+                    stix_type = get_type_from_id(stix_id)
+                    with self.metrics.timer("expand", stix_type):
                         answer_iterator = read_transaction.query().match(match)
                         #logger.debug((f'have read the query -> {answer_iterator}'))
-                        stix_dict = convert_ans_to_stix(answer_iterator, read_transaction, 'STIX21')
+                        res = convert_ans_to_res(answer_iterator, read_transaction, 'STIX21')
+                    with self.metrics.timer("convert", stix_type):
+                        stix_dict = convert_res_to_stix(res, 'STIX21')
                         stix_obj = parse(stix_dict)
-                        logger.debug(f'stix_obj -> {stix_obj}')
-                        with open("export_final.json", "w") as outfile:  
-                            json.dump(stix_dict, outfile)
+                    self.metrics.inc("objects_read", stix_type=stix_type)
+                    logger.debug(f'stix_obj -> {stix_obj}')
                 
         except Exception as e:
             logger.error(f'Stix Object Retrieval Error: {e}')
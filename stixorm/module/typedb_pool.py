@@ -0,0 +1,203 @@
+"""Shared TypeDB client and session pool, used by the TypeDB Source/Sink"""
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+from typedb.client import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TypeDBConnectionPool:
+    """Keeps TypeDB clients and DATA sessions open across calls.
+
+    One client is kept per server url, and a set of DATA sessions is kept per
+    (url, database) pair. Sessions are checked out for the duration of a call and
+    handed back afterwards, so that repeated adds and gets do not pay for a new
+    gRPC handshake and session open each time.
+
+    Each database has a generation, which invalidate moves on. A session checked out
+    before that is closed when it is handed back, instead of being pooled again.
+
+    Args:
+        - max_sessions (int): The maximum number of sessions open at once for one database
+        - idle_timeout (float): Seconds a session can sit unused in the pool before it is closed
+        - checkout_timeout (float): Seconds to wait for a free session, before raising a TimeoutError
+
+    """
+    def __init__(self, max_sessions=8, idle_timeout=300.0, checkout_timeout=30.0):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self._clients = {}
+        self._idle = {}
+        self._in_use = {}
+        self._generations = {}
+        self._condition = threading.Condition()
+
+    def get_client(self, url):
+        """
+            Return the open client for the url, reconnecting if the previous client has closed.
+            The client is connected outside the lock, as it is a network round trip, and if another
+            thread has connected one in the meantime, that one is used and the new one closed
+        Args:
+            url (): the uri and port of the TypeDB server
+
+        Returns:
+            client: an open TypeDB core client
+        """
+        with self._condition:
+            client = self._clients.get(url)
+            if client is not None and client.is_open():
+                return client
+
+        logger.debug(f'opening TypeDB client to {url}')
+        new_client = TypeDB.core_client(url)
+        with self._condition:
+            client = self._clients.get(url)
+            if client is None or not client.is_open():
+                client = self._clients[url] = new_client
+        if client is not new_client:
+            _close_quietly(new_client)
+        return client
+
+    @contextmanager
+    def session(self, uri, port, database):
+        """
+            Check out an open DATA session for the duration of a with block
+        Args:
+            uri (): URI to TypeDB
+            port (): Port to TypeDB
+            database (): Name of TypeDB database
+
+        Returns:
+            session: an open DATA session, returned to the pool when the block exits
+        """
+        key = (uri + ":" + port, database)
+        session, generation = self._checkout(key)
+        try:
+            yield session
+        finally:
+            self._checkin(key, session, generation)
+
+    def invalidate(self, uri, port, database):
+        """
+            Close the sessions for a database, for example after it has been deleted and re-created.
+            The idle sessions are closed now, and the ones checked out when they are handed back
+        Args:
+            uri (): URI to TypeDB
+            port (): Port to TypeDB
+            database (): Name of TypeDB database
+        """
+        key = (uri + ":" + port, database)
+        with self._condition:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            idle = self._idle.pop(key, [])
+        for session, last_used in idle:
+            _close_quietly(session)
+
+    def close(self):
+        """
+            Close every idle session and every client held by the pool
+        """
+        with self._condition:
+            idle = self._idle
+            clients = self._clients
+            self._idle = {}
+            self._clients = {}
+        for sessions in idle.values():
+            for session, last_used in sessions:
+                _close_quietly(session)
+        for client in clients.values():
+            _close_quietly(client)
+
+    def _checkout(self, key):
+        """
+            Take a healthy idle session from the pool, or open a new one if under the size limit,
+            returning it with the generation of its database. Sessions are closed outside the lock
+        """
+        deadline = time.monotonic() + self.checkout_timeout
+        stale = []
+        try:
+            with self._condition:
+                while True:
+                    stale += self._evict_idle()
+                    idle = self._idle.setdefault(key, [])
+                    while idle:
+                        session, last_used = idle.pop()
+                        if session.is_open():
+                            self._in_use[key] = self._in_use.get(key, 0) + 1
+                            return session, self._generations.get(key, 0)
+                        stale.append(session)
+
+                    if self._in_use.get(key, 0) < self.max_sessions:
+                        self._in_use[key] = self._in_use.get(key, 0) + 1
+                        generation = self._generations.get(key, 0)
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f'No TypeDB session available for {key[1]} at {key[0]}')
+                    self._condition.wait(remaining)
+        finally:
+            for session in stale:
+                _close_quietly(session)
+
+        # open the new session outside the lock, as it is a network round trip
+        url, database = key
+        try:
+            logger.debug(f'opening TypeDB session to {database} at {url}')
+            return self.get_client(url).session(database, SessionType.DATA), generation
+        except Exception:
+            with self._condition:
+                self._in_use[key] -= 1
+                self._condition.notify()
+            raise
+
+    def _checkin(self, key, session, generation):
+        """
+            Hand a session back to the pool, closing it instead if it is no longer open, or its
+            database was invalidated since it was checked out
+        """
+        with self._condition:
+            self._in_use[key] -= 1
+            keep = session.is_open() and generation == self._generations.get(key, 0)
+            if keep:
+                self._idle.setdefault(key, []).append((session, time.monotonic()))
+            self._condition.notify()
+        if not keep:
+            _close_quietly(session)
+
+    def _evict_idle(self):
+        """
+            Remove the sessions that have been idle for longer than the idle timeout, returning
+            them to be closed
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        evicted = []
+        for key, idle in self._idle.items():
+            keep = []
+            for session, last_used in idle:
+                if last_used < cutoff:
+                    evicted.append(session)
+                else:
+                    keep.append((session, last_used))
+            self._idle[key] = keep
+        return evicted
+
+
+def _close_quietly(resource):
+    """
+        Close a session or client, ignoring errors from a connection that has already gone
+    """
+    try:
+        resource.close()
+    except Exception as e:
+        logger.debug(f'error closing TypeDB resource: {e}')
+
+
+# the pool shared by every TypeDB Source and Sink that is not given its own
+default_pool = TypeDBConnectionPool()
+atexit.register(default_pool.close)
@@ -0,0 +1,245 @@
+"""Offline TypeQL export, writing the generated queries to chunk files for later loading"""
+import glob
+import gzip
+import json
+import os
+
+from .bundle_stream import open_bundle, open_stream, iter_bundle_objects
+from .dead_letter import DeadLetterQueue
+from .ingest_pipeline import convert_chunk, convert_in_processes, dead_letter_failures, iter_stix_dicts
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# the marker line in front of each query in a .tql chunk, followed by the json header of the entry,
+# whose match_length is the number of characters of the query that are its match
+tql_header = "#! "
+chunk_formats = ("ndjson", "tql")
+
+
+class TypeQLExport:
+    """Convert STIX content to TypeQL without a TypeDB server, writing it to chunk files.
+
+    The (match, insert) queries are written in input order to numbered chunk files in
+    the directory, each of which is closed once it reaches max_chunk_bytes, so that
+    the chunks of a large corpus can be loaded in parallel by TypeDBSink.load_chunks,
+    or compared between releases.
+
+    In the ndjson format each line is the json batch entry of an object, with its
+    stix-id, type, input index, match and insert. In the tql format, each query is
+    preceded by a comment line holding the same header, with the length of its match,
+    so the file stays readable TypeQL, and reads back as a separate match and insert.
+
+    Args:
+        - directory (str): The directory for the chunk files, created if needed
+        - import_type (str): It forces the parser to use either the stix2.1, or mitre att&ck
+        - file_format (str): The chunk file format, "ndjson" or "tql"
+        - compress (bool): If True, the chunk files are gzipped
+        - max_chunk_bytes (int): The size of TypeQL after which a chunk file is closed
+        - trusted (bool): If True, json and dict input is converted without the stix2 parse
+        - processes (int): If above 0, TypeQL is generated on this many processes
+        - dead_letter (str or DeadLetterQueue): If given, objects that fail to convert are
+            written to it, rather than stopping the export
+        - max_refs (int): The longest reference list written in one query, as for TypeDBSink.
+            The follow-up queries are kept with their object, in the same chunk
+        - share_sub_objects (bool): If True, hashes, kill chain phases and external references
+            are shared by content key, as for TypeDBSink, and each entry holds the sub-objects
+            that the sink creates first, if they are not stored yet
+
+    """
+    def __init__(self, directory, import_type="STIX21", file_format="ndjson", compress=False,
+                 max_chunk_bytes=64 * 1024 * 1024, trusted=False, processes=0, dead_letter=None, max_refs=1000,
+                 share_sub_objects=False):
+        if file_format not in chunk_formats:
+            raise ValueError(f'chunk format must be one of {chunk_formats}, not {file_format}')
+        self.directory = directory
+        self.import_type = import_type
+        self.file_format = file_format
+        self.compress = compress
+        self.max_chunk_bytes = max_chunk_bytes
+        self.trusted = trusted
+        self.processes = processes
+        if isinstance(dead_letter, str):
+            dead_letter = DeadLetterQueue(dead_letter)
+        self.dead_letter = dead_letter
+        self.max_refs = max_refs
+        self.share_sub_objects = share_sub_objects
+        self.allow_custom = import_type != "STIX21"
+        self.counts = {"objects": 0, "chunks": 0}
+        self._index = 0
+        self._file = None
+        self._chunk_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, stix_data):
+        """Convert and export STIX objects.
+
+        Args:
+            stix_data (STIX object OR dict OR str OR list): STIX content, as for TypeDBSink.add
+
+        Returns:
+            counts {}: the number of objects and chunk files written so far
+
+        """
+        indexed_dicts = ((self._next_index(), stix_dict) for stix_dict in iter_stix_dicts(stix_data))
+        dead_letter = self.dead_letter is not None
+        if self.processes > 0:
+            entries = convert_in_processes(indexed_dicts, self.processes, 64, self.import_type, self.trusted,
+                                           self.allow_custom, dead_letter, self.max_refs, self.share_sub_objects)
+        else:
+            entries = (entry for indexed_dict in indexed_dicts
+                       for entry in convert_chunk([indexed_dict], self.import_type, self.trusted,
+                                                  self.allow_custom, dead_letter, self.max_refs,
+                                                  self.share_sub_objects))
+        if dead_letter:
+            entries = dead_letter_failures(entries, self.dead_letter)
+        for entry in entries:
+            entry.pop("object", None)
+            self._write(entry)
+        return self.counts
+
+    def add_file(self, path):
+        """Stream the STIX objects of a bundle file, optionally gzipped, into the export.
+        """
+        with open_bundle(path) as stream:
+            return self.add_stream(stream)
+
+    def add_stream(self, stream):
+        """Stream the STIX objects from a file object, pipe or gzip stream into the export.
+        """
+        return self.add(iter_bundle_objects(open_stream(stream)))
+
+    def _next_index(self):
+        index = self._index
+        self._index += 1
+        return index
+
+    def _write(self, entry):
+        """
+            Write one entry to the current chunk, starting a new chunk when it is full
+        """
+        if not entry["match"] and not entry["insert"]:
+            return
+        if self.file_format == "ndjson":
+            text = json.dumps(entry) + "\n"
+        else:
+            header = {key: entry[key] for key in ("stix_id", "stix_type", "index", "refs", "shared", "kill_chains")
+                      if key in entry}
+            header["match_length"] = len(entry["match"])
+            text = tql_header + json.dumps(header) + "\n" + entry["match"] + entry["insert"] + "\n"
+            header.pop("shared", None)
+            header.pop("kill_chains", None)
+            for followup_no, (match, insert) in enumerate(entry.get("followups", [])):
+                header["followup"] = followup_no
+                header["match_length"] = len(match)
+                text += tql_header + json.dumps(header) + "\n" + match + insert + "\n"
+        text_bytes = len(text.encode("utf-8"))
+        if self._file is not None and self._chunk_bytes + text_bytes > self.max_chunk_bytes:
+            self._close_chunk()
+        if self._file is None:
+            self._open_chunk()
+        self._file.write(text)
+        self._chunk_bytes += text_bytes
+        self.counts["objects"] += 1
+
+    def _open_chunk(self):
+        name = f'chunk-{self.counts["chunks"]:06d}.{self.file_format}' + (".gz" if self.compress else "")
+        path = os.path.join(self.directory, name)
+        if self.compress:
+            self._file = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            self._file = open(path, "w", encoding="utf-8")
+        self._chunk_bytes = 0
+        self.counts["chunks"] += 1
+        logger.debug(f'writing TypeQL chunk {path}')
+
+    def _close_chunk(self):
+        self._file.close()
+        self._file = None
+
+    def close(self):
+        if self._file is not None:
+            self._close_chunk()
+        if self.dead_letter is not None:
+            self.dead_letter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def list_chunks(directory):
+    """
+        Find the chunk files of an export, in the order they were written
+    Args:
+        directory (): the export directory
+
+    Returns:
+        paths []: the chunk file paths
+    """
+    paths = []
+    for file_format in chunk_formats:
+        paths += glob.glob(os.path.join(directory, f'chunk-*.{file_format}'))
+        paths += glob.glob(os.path.join(directory, f'chunk-*.{file_format}.gz'))
+    return sorted(paths, key=os.path.basename)
+
+
+def read_chunk(path):
+    """
+        Read the batch entries back from a chunk file of either format, gzipped or not
+    Args:
+        path (): the chunk file path
+
+    Returns:
+        entry {}: each batch entry in turn, with its stix-id, type, index, match and insert
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as chunk_file:
+        if ".ndjson" in os.path.basename(path):
+            for line in chunk_file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        # the follow-up queries of an entry come straight after it
+        entry = None
+        for header, match, insert in _iter_tql_queries(chunk_file):
+            if "followup" in header:
+                entry["followups"].append((match, insert))
+                continue
+            if entry is not None:
+                yield entry
+            entry = dict(header, match=match, insert=insert, followups=[])
+        if entry is not None:
+            yield entry
+
+
+def _iter_tql_queries(chunk_file):
+    """
+        Read the queries of a tql chunk, each running to the next header, less the newline
+        written after it, and split into its match and insert by the match length in its header
+
+    Returns:
+        (header, match, insert): the header, without the match length, match and insert of each query
+    """
+    header = None
+    lines = []
+    for line in chunk_file:
+        if line.startswith(tql_header):
+            if header is not None:
+                yield _split_tql_query(header, lines)
+            header = json.loads(line[len(tql_header):])
+            lines = []
+        else:
+            lines.append(line)
+    if header is not None:
+        yield _split_tql_query(header, lines)
+
+
+def _split_tql_query(header, lines):
+    query = "".join(lines)[:-1]
+    match_length = header.pop("match_length", 0)
+    return header, query[:match_length], query[match_length:]
@@ -0,0 +1,149 @@
+"""Upsert of new STIX object versions, as the minimal TypeQL difference from the stored version"""
+import json
+from collections.abc import Mapping
+from datetime import datetime, timezone
+
+from stix2.base import _STIXBase
+
+from .import_stix_to_typeql import raw_stix2_to_typeql
+from .import_stix_utilities import (get_embedded_match, add_property_to_typeql, add_relation_to_typeql,
+                                    coerce_trusted_dict)
+from .conversion_plans import conversion_plan, split_on_plan
+from .export_typeql_to_intermediate import convert_ans_to_res
+from .export_intermediate_to_stix import convert_res_to_stix
+from .delete_stix_typeql import (owned_sub_graph, sub_object_relations, delete_iids_queries,
+                                 delete_attribute_query, delete_role_players_query)
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+# the references that are role players of a sighting itself, and can change between versions
+sighting_role_refs = {"observed_data_refs": "observed", "where_sighted_refs": "where-sighted"}
+# the references that fix what a relationship or sighting is about, and so never change
+immutable_refs = ("source_ref", "target_ref", "sighting_of_ref")
+# flags that are not written to typedb when False, so False and absent are the same
+false_is_absent = ("defanged", "revoked", "summary")
+
+
+def upsert_typeql(stix_obj, tx, import_type="STIX21"):
+    """
+        Compare a STIX object with its stored version, and assemble the typeql that brings the
+        stored version up to date. Only the properties whose values changed are removed and added
+        again, and only the sub-objects, such as hashes, kill chain phases and external references,
+        of the properties that changed are deleted and inserted again. The stored object keeps its
+        IID, so the relations other objects have with it are untouched
+    Args:
+        stix_obj (): the incoming STIX object, or trusted STIX dict
+        tx (): a write transaction, used to read the stored version
+        import_type (): the type of import STIX21 or ATT&CK
+
+    Returns:
+        status: "inserted" if the object was not stored yet, "updated", "unchanged", or "stale"
+            if the stored version was modified later than the incoming one
+        queries []: the ("delete" or "insert", typeql) queries to run in the transaction, in order
+    """
+    stored_var, stored_match = get_embedded_match(stix_obj["id"])
+    answers = list(tx.query().match('match ' + stored_match))
+    if not answers:
+        match, insert = raw_stix2_to_typeql(stix_obj, import_type)
+        return "inserted", [("insert", match + insert)]
+    if len(answers) > 1:
+        logger.warning(f'{len(answers)} objects stored with stix-id {stix_obj["id"]}, updating the first')
+    if stix_obj["type"] == "marking-definition":
+        # marking definitions are immutable
+        return "unchanged", []
+
+    thing = answers[0].get(stored_var[1:])
+    iid = thing.get_iid()
+    old = coerce_trusted_dict(convert_res_to_stix(convert_ans_to_res(answers[:1], tx, import_type), import_type))
+    new = dict(stix_obj) if isinstance(stix_obj, _STIXBase) else coerce_trusted_dict(stix_obj)
+    if old.get("modified") and new.get("modified") and new["modified"] < old["modified"]:
+        return "stale", []
+
+    changed = [prop for prop in sorted((set(old) | set(new)) - {"id", "type"})
+               if _canonical(_value(old, prop)) != _canonical(_value(new, prop))]
+    if not changed:
+        return "unchanged", []
+    for prop in changed:
+        if prop in immutable_refs:
+            raise ValueError(f'{prop} of {stix_obj["id"]} cannot change between versions')
+
+    plan = conversion_plan(stix_obj["type"], import_type)
+    obj_tql = plan["typeql"]
+    role_refs = [prop for prop in changed if prop in sighting_role_refs]
+    properties, relations = split_on_plan([prop for prop in changed if prop not in role_refs], plan)
+    # granular markings point at property values, so they are rewritten whenever anything changes
+    granular = "granular_markings" in old or "granular_markings" in new
+    if granular and "granular_markings" not in relations:
+        relations.append("granular_markings")
+
+    # 1. remove the values of the changed properties, the changed sub-objects and sighting roles
+    queries = [("delete", delete_attribute_query(iid, obj_tql[prop])) for prop in properties if _value(old, prop) is not None]
+    relation_types = set()
+    for prop in relations:
+        if _value(old, prop) is not None:
+            relation_types |= sub_object_relations(prop, old[prop])
+    if relation_types:
+        owned_relations, sub_objects = owned_sub_graph(thing, tx, relation_types)
+        queries += [("delete", query) for query in delete_iids_queries(owned_relations + sub_objects)]
+    queries += [("delete", delete_role_players_query(iid, sighting_role_refs[prop])) for prop in role_refs]
+
+    # 2. add the new values, matching the unchanged ones if granular markings select them
+    obj_var = '$' + stix_obj["type"]
+    match = 'match \n ' + obj_var + ' iid ' + iid + ';\n'
+    insert = has_tql = value_tql = ''
+    prop_var_list = []
+    all_properties, _ = split_on_plan([prop for prop in new if prop not in ("id", "type")
+                                       and prop not in sighting_role_refs and prop not in immutable_refs], plan)
+    for prop in all_properties:
+        type_ql, type_ql_props, prop_var_list = add_property_to_typeql(prop, obj_tql, new, prop_var_list)
+        if prop in properties:
+            has_tql += type_ql
+            value_tql += type_ql_props
+        elif granular and type_ql:
+            match += ' ' + obj_var + type_ql[1:] + ';' + type_ql_props + '\n'
+    if has_tql:
+        insert += ' ' + obj_var + has_tql[1:] + ';' + value_tql + '\n'
+    for j, prop in enumerate(relations):
+        if _value(new, prop) is not None:
+            match2, insert2 = add_relation_to_typeql(prop, new, obj_var, prop_var_list, j)
+            match += match2
+            insert += insert2
+    for prop in role_refs:
+        role_players = []
+        for i, ref in enumerate(new.get(prop) or []):
+            ref_var, ref_match = get_embedded_match(ref, sighting_role_refs[prop][0] + str(i))
+            match += ref_match
+            role_players.append(sighting_role_refs[prop] + ':' + ref_var)
+        if role_players:
+            insert += ' ' + obj_var + ' (' + ', '.join(role_players) + ');\n'
+    if insert:
+        queries.append(("insert", match + 'insert \n' + insert))
+
+    logger.debug(f'upsert of {stix_obj["id"]} changes {changed}')
+    return "updated", queries
+
+
+def _value(stix_dict, prop):
+    """
+        Get a property value, taking the flags that are not stored when False as absent
+    """
+    value = stix_dict.get(prop)
+    if prop in false_is_absent and value is False:
+        return None
+    return value
+
+
+def _canonical(value):
+    """
+        Normalise a property value for comparison with the stored version, which keeps no list order
+        and may hold its timestamps at a different precision
+    """
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).isoformat()
+    if isinstance(value, Mapping):
+        return {key: _canonical(sub_value) for key, sub_value in value.items()}
+    if isinstance(value, list):
+        return sorted((_canonical(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True, default=str))
+    return value
@@ -23,38 +23,50 @@ from typedb.client import *
 import logging
 logger = logging.getLogger(__name__)
 
+import hashlib
 import pkgutil
+import threading
 
-def initialise_database(uri, port, database, user, password, clear=False):
+# the databases this process has found, or made, up to date, as (url, database, fingerprint)
+_attached = set()
+_attached_lock = threading.Lock()
+
+
+def initialise_database(uri, port, database, user, password, clear=False, attach=False):
+    """
+        Create the database with the STIX schema and the TLP markings, or attach to it if it exists
+    Args:
+        uri (): URI to TypeDB
+        port (): Port to TypeDB
+        database (): Name of TypeDB database
+        user (): Username for TypeDB, if cluster, otherwise None
+        password (): Password for TypeDB, if cluster, otherwise None
+        clear (): if True, an existing database is deleted and created again
+        attach (): if True, an existing database is used as it is when its schema fingerprint
+            matches the bundled schema, and brought up to date when it does not. If False, an
+            existing database raises a ValueError
+    """
     url = uri + ":" + port
+    fingerprint = schema_fingerprint()
+    if attach and not clear:
+        with _attached_lock:
+            if (url, database, fingerprint) in _attached:
+                return
     with TypeDB.core_client(url) as client:
         if client.databases().contains(database):
             if clear:
                 client.databases().get(database).delete()
+            elif attach:
+                attach_database(client, database, fingerprint)
+                with _attached_lock:
+                    _attached.add((url, database, fingerprint))
+                return
             else:
                 raise ValueError(f"Database '{database}' already exists")
         client.databases().create(database)
         # Stage 1: Create the schema
         with client.session(database, SessionType.SCHEMA) as session:
-            #schema = files('stixorm.schema').joinpath('cti-schema-v2.tql').read_text()
-            #rules = files('stixorm.schema').joinpath('cti-rules.tql').read_text()
-            schema = pkgutil.get_data(__name__, "cti-schema-v2.tql")
-            rules = pkgutil.get_data(__name__, "cti-rules.tql")
-
-            logger.debug('.....')
-            logger.debug('Inserting schema ...')
-            logger.debug('.....')
-            with session.transaction(TransactionType.WRITE) as write_transaction:
-                write_transaction.query().define(schema)
-                write_transaction.commit()
-            logger.debug('Inserting rules...')
-            logger.debug('.....')
-            # with session.transaction(TransactionType.WRITE) as write_transaction:
-            #    write_transaction.query().define(rules)
-            #    write_transaction.commit()
-            logger.debug('.....')
-            logger.debug('Successfully committed schema!')
-            logger.debug('.....')
+            define_schema(session)
             session.close()
         
         
@@ -65,16 +77,126 @@ def initialise_database(uri, port, database, user, password, clear=False):
                     for line in mark_list:
                         type_ql += line
                         
-                    logger.debug(f'--------------------------------------------------------------------------------')
+                    logger.debug('--------------------------------------------------------------------------------')
                     logger.debug(f'{type_ql}')
                     write_transaction.query().insert(type_ql)
                 
+                write_transaction.query().insert(fingerprint_insert(fingerprint))
                 write_transaction.commit()
             
             logger.debug('Successfully committed white, green, amber and red markings!')
             logger.debug('.....')
-            logger.debug(f'--------------------------- Initialisation Phase Complete -----------------------------------------------------')
+            logger.debug('--------------------------- Initialisation Phase Complete -----------------------------------------------------')
             session.close()
+    with _attached_lock:
+        _attached.add((url, database, fingerprint))
+
+
+def define_schema(session):
+    """
+        Define the bundled STIX schema in a schema session. TypeDB only writes the definitions
+        that the database does not have already
+    """
+    #schema = files('stixorm.schema').joinpath('cti-schema-v2.tql').read_text()
+    #rules = files('stixorm.schema').joinpath('cti-rules.tql').read_text()
+    schema = pkgutil.get_data(__name__, "cti-schema-v2.tql")
+    rules = pkgutil.get_data(__name__, "cti-rules.tql")
+
+    logger.debug('.....')
+    logger.debug('Inserting schema ...')
+    logger.debug('.....')
+    with session.transaction(TransactionType.WRITE) as write_transaction:
+        write_transaction.query().define(schema)
+        write_transaction.commit()
+    logger.debug('Inserting rules...')
+    logger.debug('.....')
+    # with session.transaction(TransactionType.WRITE) as write_transaction:
+    #    write_transaction.query().define(rules)
+    #    write_transaction.commit()
+    logger.debug('.....')
+    logger.debug('Successfully committed schema!')
+    logger.debug('.....')
+
+
+def attach_database(client, database, fingerprint):
+    """
+        Attach to an existing database, checking the schema fingerprint stored in it. When it
+        matches, nothing else is read or written. When it does not, the bundled schema is defined
+        again, which adds only the missing definitions, the missing TLP markings are inserted,
+        and the new fingerprint is stored. A database made before stix-id was a key raises a
+        ValueError, as it has to be copied by migrate_database instead
+    Args:
+        client (): the TypeDB client
+        database (): Name of TypeDB database
+        fingerprint (): the fingerprint of the bundled schema and markings
+    """
+    with client.session(database, SessionType.DATA) as session:
+        with session.transaction(TransactionType.READ) as read_transaction:
+            if stored_fingerprint(read_transaction) == fingerprint:
+                logger.debug(f'attached to database {database}, schema {fingerprint[:12]} is up to date')
+                return
+            if not stix_id_is_key(read_transaction):
+                raise ValueError(f"Database '{database}' was made before stix-id was a key, and cannot be "
+                                 f"brought up to date in place, migrate it with stixorm.schema.migrate")
+
+    logger.info(f'schema of database {database} is out of date, applying the missing definitions')
+    with client.session(database, SessionType.SCHEMA) as session:
+        define_schema(session)
+
+    with client.session(database, SessionType.DATA) as session:
+        with session.transaction(TransactionType.WRITE) as write_transaction:
+            for mark_list in initial_markings:
+                stix_id = mark_list[1].split('"')[1]
+                if any(True for _ in write_transaction.query().match(f'match $m has stix-id "{stix_id}";')):
+                    continue
+                write_transaction.query().insert(" insert " + "".join(mark_list))
+            write_transaction.query().delete('match $f isa schema-fingerprint; delete $f isa schema-fingerprint;')
+            write_transaction.query().insert(fingerprint_insert(fingerprint))
+            write_transaction.commit()
+
+
+def stored_fingerprint(transaction):
+    """
+        Read the schema fingerprint stored in a database, None if it has none, as databases
+        created before fingerprints do not
+    """
+    if transaction.concepts().get_attribute_type("schema-fingerprint") is None:
+        return None
+    for answer in transaction.query().match('match $f isa schema-fingerprint;'):
+        return answer.get("f").get_value()
+    return None
+
+
+def stix_id_is_key(transaction):
+    """
+        Check whether the schema of a database has stix-id as a key of the STIX domain objects,
+        which databases made before the key do not
+    """
+    sdo_type = transaction.concepts().get_thing_type("stix-domain-object")
+    return any(owned.get_label().name() == "stix-id"
+               for owned in sdo_type.as_remote(transaction).get_owns(keys_only=True))
+
+
+def fingerprint_insert(fingerprint):
+    return f'insert $f "{fingerprint}" isa schema-fingerprint;'
+
+
+def schema_fingerprint():
+    """
+        Fingerprint the bundled schema and the TLP markings, which are what initialise_database writes
+    Returns:
+        fingerprint: the hex digest
+    """
+    global _fingerprint
+    if _fingerprint is None:
+        digest = hashlib.sha256(pkgutil.get_data(__name__, "cti-schema-v2.tql"))
+        for mark_list in initial_markings:
+            digest.update("".join(mark_list).encode("utf-8"))
+        _fingerprint = digest.hexdigest()
+    return _fingerprint
+
+
+_fingerprint = None
 
 # make sure the four TLP Markings are loaded when the database initialises
 initial_markings = [[
@@ -0,0 +1,150 @@
+"""Copy a database made before stix-id was a key into a new one, merging the duplicate objects"""
+from typedb.client import *
+
+from stix2.utils import get_type_from_id
+
+from stixorm.schema.initialise import initialise_database, initial_markings
+from stixorm.module.typedb import TypeDBSink
+from stixorm.module.typedb_pool import default_pool
+from stixorm.module.pending_refs import existing_ids_query
+from stixorm.module.iid_cache import object_var
+from stixorm.module.export_typeql_to_intermediate import convert_ans_to_res
+from stixorm.module.export_intermediate_to_stix import convert_res_to_stix
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def migrate_database(connection, new_database, import_type="STIX21", batch_size=500, dead_letter=None):
+    """
+        Copy the STIX objects of a database into a new database, whose schema has stix-id as a key.
+        TypeDB cannot move the ownership of stix-id to the keyed types while objects own it, so a
+        database made before the key is migrated by copying it. The stix-ids are read in batches,
+        and the objects that share a stix-id are merged into one, so the copy has a single object
+        per stix-id, which every reference to it is matched to
+    Args:
+        connection (): the connection dict of the database to migrate, as for TypeDBSink
+        new_database (): the name of the database to create, which must not exist yet
+        import_type (): the type of import STIX21 or ATT&CK
+        batch_size (): the number of stix-ids read, and of objects written, in one transaction
+        dead_letter (): a dead-letter file for the objects that cannot be written to the new database
+
+    Returns:
+        report {}: the number of objects copied, of stix-ids that had duplicates, of the duplicates
+            merged away, and of objects whose references were never found, which are not copied,
+            but dead-lettered or logged
+    """
+    if new_database == connection["database"]:
+        raise ValueError("the migrated database must have a new name")
+    initialise_database(connection["uri"], connection["port"], new_database,
+                        connection["user"], connection["password"])
+    new_connection = dict(connection, database=new_database)
+    # the pending store is unbounded, so that no object is evicted before the objects it refers to are copied
+    sink = TypeDBSink(new_connection, import_type=import_type, batch_size=batch_size, dead_letter=dead_letter,
+                      defer_missing=True, max_pending=None)
+    # the TLP markings are written by initialise_database already
+    marking_ids = {mark_list[1].split('"')[1] for mark_list in initial_markings}
+
+    report = {"objects": 0, "duplicates": 0, "merged": 0, "unresolved": 0}
+    with default_pool.session(connection["uri"], connection["port"], connection["database"]) as session:
+        for stix_ids in iter_stix_id_batches(session, batch_size):
+            stix_objects = []
+            for stix_id, versions in read_versions(session, stix_ids, import_type).items():
+                if stix_id in marking_ids:
+                    continue
+                if len(versions) > 1:
+                    report["duplicates"] += 1
+                    report["merged"] += len(versions) - 1
+                    logger.info(f'merging {len(versions)} objects with stix-id {stix_id}')
+                stix_objects.append(merge_duplicates(versions))
+            sink.add(stix_objects, batch_size=batch_size)
+            report["objects"] += len(stix_objects)
+            logger.info(f'migrated {report["objects"]} objects to {new_database}')
+    report["unresolved"] = sink.flush_pending()
+    if report["unresolved"]:
+        logger.error(f'{report["unresolved"]} objects refer to stix-ids missing from {connection["database"]}, '
+                     f'and were not copied to {new_database}')
+    return report
+
+
+def iter_stix_id_batches(session, batch_size):
+    """
+        Read every stix-id of a database, a batch per read transaction, so that no transaction
+        stays open for the whole migration. Each stix-id is one attribute, however many objects own it
+    Args:
+        session (): a data session on the database
+        batch_size (): the number of stix-ids read in one transaction
+
+    Returns:
+        stix_ids []: yields a sorted batch of stix-ids at a time
+    """
+    offset = 0
+    while True:
+        with session.transaction(TransactionType.READ) as read_transaction:
+            query = f'match $id isa stix-id; get $id; sort $id; offset {offset}; limit {batch_size};'
+            stix_ids = [answer.get("id").get_value() for answer in read_transaction.query().match(query)]
+        if not stix_ids:
+            return
+        yield stix_ids
+        offset += len(stix_ids)
+
+
+def read_versions(session, stix_ids, import_type):
+    """
+        Read the objects owning each of the stix-ids, one STIX dict per object, so that the
+        duplicates of a stix-id are read apart rather than merged by the exporter
+    Args:
+        session (): a data session on the database
+        stix_ids (): the stix-ids to read
+        import_type (): the type of import STIX21 or ATT&CK
+
+    Returns:
+        versions {}: the stix-id to the list of STIX dicts of the objects owning it
+    """
+    versions = {}
+    with session.transaction(TransactionType.READ) as read_transaction:
+        owners = {}
+        for answer in read_transaction.query().match(existing_ids_query(stix_ids)):
+            owners.setdefault(answer.get("id").get_value(), []).append(answer.get("x").get_iid())
+        for stix_id, iids in owners.items():
+            var = '$' + object_var(get_type_from_id(stix_id))
+            for iid in iids:
+                answers = read_transaction.query().match(f'match {var} iid {iid};')
+                res = convert_ans_to_res(answers, read_transaction, import_type)
+                versions.setdefault(stix_id, []).append(convert_res_to_stix(res, import_type))
+    return versions
+
+
+def merge_duplicates(versions):
+    """
+        Merge the objects that share a stix-id into one. The latest modified one is kept, as the
+        current version of the object, and when several are equally recent, as observables with no
+        modified timestamp are, the properties missing from the first are taken from the others
+    Args:
+        versions (): the STIX dicts of the objects
+
+    Returns:
+        stix_dict {}: the merged STIX dict
+    """
+    ordered = sorted(versions, key=lambda version: str(version.get("modified", "")), reverse=True)
+    merged = dict(ordered[0])
+    for version in ordered[1:]:
+        if str(version.get("modified", "")) != str(merged.get("modified", "")):
+            break
+        for prop, value in version.items():
+            merged.setdefault(prop, value)
+    return merged
+
+
+# if this file is run directly, then start here
+if __name__ == '__main__':
+    # migrate the localhost and default stix2 setup
+    connection = {
+        "uri": "localhost",
+        "port": "1729",
+        "database": "stix2",
+        "user": None,
+        "password": None
+    }
+
+    print(migrate_database(connection, "stix2_keyed"))
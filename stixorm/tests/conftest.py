@@ -0,0 +1,212 @@
+import re
+from contextlib import contextmanager
+
+import pytest
+
+
+stix_id_pattern = re.compile(r'has stix-id "([^"]+)"')
+bound_pattern = re.compile(r'\$([\w-]+) isa [\w-]+, has stix-id "([^"]+)";')
+iid_pattern = re.compile(r'\$([\w-]+) iid (0x[0-9a-f]+);')
+inserted_pattern = re.compile(r'insert \$([\w-]+) isa [\w-]+,\s*has stix-id "([^"]+)"')
+# the insert that raw_stix2_to_typeql writes, binding each value to a variable of the attribute name
+converted_pattern = re.compile(r'insert \$([\w-]+) isa [\w-]+,[^;]*has stix-id \$stix-id[^;]*;.*?\$stix-id "([^"]+)"',
+                               re.DOTALL)
+
+
+class FakeConcept:
+    def __init__(self, iid=None, value=None):
+        self.iid = iid
+        self.value = value
+
+    def get_iid(self):
+        return self.iid
+
+    def get_value(self):
+        return self.value
+
+
+class FakeAnswer:
+    def __init__(self, concepts):
+        self.concepts = concepts
+
+    def get(self, var):
+        return self.concepts[var]
+
+    def map(self):
+        return dict(self.concepts)
+
+
+class FakeQueryManager:
+    def __init__(self, transaction):
+        self.transaction = transaction
+
+    def match(self, query):
+        return iter(self.transaction.run("match", query))
+
+    def insert(self, query):
+        return iter(self.transaction.run("insert", query))
+
+    def delete(self, query):
+        self.transaction.run("delete", query)
+
+
+class FakeTransaction:
+    def __init__(self, database, transaction_type):
+        self.database = database
+        self.transaction_type = transaction_type
+        self.queries = []
+        self.inserted = {}
+        self.duplicates = []
+
+    def query(self):
+        return FakeQueryManager(self)
+
+    def run(self, kind, query):
+        self.queries.append((kind, query))
+        self.database.queries.append((kind, query))
+        return self.database.answer(kind, query, self)
+
+    def commit(self):
+        self.database.commit(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+class FakeSession:
+    def __init__(self, database):
+        self.database = database
+
+    def transaction(self, transaction_type):
+        return FakeTransaction(self.database, transaction_type)
+
+
+class FakeDatabase:
+    """An in-memory stand-in for a TypeDB database, holding the stix-ids of the objects inserted.
+
+    An insert answers once, binding its object and the objects its match looks up by stix-id
+    or iid, if every stix-id of its match is stored, or inserted earlier in the transaction,
+    and answers nothing otherwise, as TypeDB does. A match of stix-ids, as existing_ids_query
+    writes, answers with the stored ones. Other queries are recorded and answer nothing,
+    unless answers has a function for them.
+
+    The commit fails on a stix-id inserted twice, as stix-id is a key, on an object in
+    rejected, and with each exception in commit_errors, first to last.
+    """
+    def __init__(self):
+        self.stored = {}
+        self.queries = []
+        self.commits = []
+        self.commit_errors = []
+        self.rejected = set()
+        self.answers = []
+        self._next_iid = 1
+
+    def new_iid(self):
+        iid = f'0x{self._next_iid:04x}'
+        self._next_iid += 1
+        return iid
+
+    def store(self, *stix_ids):
+        for stix_id in stix_ids:
+            self.stored[stix_id] = self.new_iid()
+
+    def reads(self):
+        return [query for kind, query in self.queries if kind == "match" and "get $x, $id" in query]
+
+    def answer(self, kind, query, transaction):
+        for answers in self.answers:
+            result = answers(kind, query, transaction)
+            if result is not None:
+                return result
+        if kind == "match" and "get $x, $id" in query:
+            return [FakeAnswer({"x": FakeConcept(iid=self.stored[stix_id]), "id": FakeConcept(value=stix_id)})
+                    for stix_id in stix_id_pattern.findall(query.replace('$id = "', 'has stix-id "'))
+                    if stix_id in self.stored]
+        if kind != "insert":
+            return []
+        match, _, insert = query.rpartition("insert ")
+        known = dict(self.stored, **transaction.inserted)
+        concepts = {}
+        for var, stix_id in bound_pattern.findall(match):
+            if stix_id not in known:
+                return []
+            concepts[var] = FakeConcept(iid=known[stix_id])
+        for var, iid in iid_pattern.findall(match):
+            concepts[var] = FakeConcept(iid=iid)
+        inserted = inserted_pattern.search("insert " + insert) or converted_pattern.search("insert " + insert)
+        if inserted is not None:
+            var, stix_id = inserted.groups()
+            iid = self.new_iid()
+            if stix_id in known:
+                transaction.duplicates.append(stix_id)
+            transaction.inserted.setdefault(stix_id, iid)
+            concepts[var] = FakeConcept(iid=iid)
+        return [FakeAnswer(concepts)]
+
+    def commit(self, transaction):
+        if self.commit_errors:
+            raise self.commit_errors.pop(0)
+        if transaction.duplicates:
+            raise Exception(f'[THG03] The key of stix-id "{transaction.duplicates[0]}" is already taken')
+        rejected = sorted(self.rejected & transaction.inserted.keys())
+        if rejected:
+            raise Exception(f'[TYR03] Invalid write of {rejected[0]}')
+        self.stored.update(transaction.inserted)
+        self.commits.append(sorted(transaction.inserted))
+
+
+class FakePool:
+    """A connection pool whose sessions are all on one FakeDatabase"""
+    def __init__(self, database):
+        self.database = database
+
+    @contextmanager
+    def session(self, uri, port, database, session_type=None):
+        yield FakeSession(self.database)
+
+    def invalidate(self, uri, port, database):
+        pass
+
+
+def _fake_entry(stix_id, refs=(), index=None):
+    """A batch entry of an object referring to refs, in the form make_entry writes it"""
+    stix_type = stix_id.split("--")[0]
+    match = "".join(f' ${ref.split("--")[0].replace("-", "")}{i} isa {ref.split("--")[0]}, has stix-id "{ref}";'
+                    for i, ref in enumerate(refs))
+    return {
+        "stix_id": stix_id,
+        "stix_type": stix_type,
+        "index": index,
+        "refs": sorted(refs),
+        "match": "match" + match + "\n" if refs else "",
+        "insert": f'insert ${stix_type} isa {stix_type},\n has stix-id "{stix_id}";\n',
+    }
+
+
+@pytest.fixture
+def fake_entry():
+    return _fake_entry
+
+
+@pytest.fixture
+def fake_database():
+    return FakeDatabase()
+
+
+@pytest.fixture
+def make_sink(monkeypatch, fake_database):
+    """Build TypeDBSinks on the fake database, without initialising a schema"""
+    typedb = pytest.importorskip("stixorm.module.typedb")
+    from stixorm.module.metrics import MetricsRegistry
+    monkeypatch.setattr(typedb, "initialise_database", lambda *args, **kwargs: None)
+
+    def make(database=None, **kwargs):
+        connection = {"uri": "localhost", "port": "1729", "database": "stix", "user": None, "password": None}
+        kwargs.setdefault("metrics", MetricsRegistry())
+        return typedb.TypeDBSink(connection, pool=FakePool(database or fake_database), **kwargs)
+
+    return make
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+async_typedb = pytest.importorskip("stixorm.module.async_typedb")
+
+
+class FakeSink:
+    def __init__(self):
+        self.threads = []
+
+    def add(self, stix_data, **kwargs):
+        self.threads.append(threading.current_thread())
+        return {stix_data["id"]: 0}
+
+
+class FakeSource:
+    """Answers get after a delay, recording how many gets ran at once"""
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.running = 0
+        self.most_running = 0
+        self.started = []
+        self._lock = threading.Lock()
+
+    def get(self, stix_id, _composite_filters=None):
+        with self._lock:
+            self.started.append(stix_id)
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        time.sleep(0.01)
+        with self._lock:
+            self.running -= 1
+        return None if stix_id in self.missing else {"id": stix_id}
+
+
+def test_add_runs_off_the_event_loop():
+    sink = FakeSink()
+
+    async def add():
+        async with async_typedb.AsyncTypeDBSink(None, sink=sink) as async_sink:
+            return await async_sink.add({"id": "identity--1"})
+
+    assert asyncio.run(add()) == {"identity--1": 0}
+    assert sink.threads[0] is not threading.main_thread()
+
+
+def test_iter_get_bounded_and_skips_missing():
+    source = FakeSource(missing=["identity--3"])
+    stix_ids = [f'identity--{n}' for n in range(10)]
+
+    async def get_all():
+        async with async_typedb.AsyncTypeDBSource(None, max_concurrency=3, source=source) as async_source:
+            return [stix_obj["id"] async for stix_obj in async_source.iter_get(stix_ids)]
+
+    found = asyncio.run(get_all())
+    assert sorted(found) == sorted(set(stix_ids) - {"identity--3"})
+    assert source.most_running <= 3
+
+
+def test_iter_get_stops_scheduling_when_the_consumer_stops():
+    source = FakeSource()
+
+    async def first():
+        async with async_typedb.AsyncTypeDBSource(None, max_concurrency=2, source=source) as async_source:
+            async for stix_obj in async_source.iter_get(f'identity--{n}' for n in range(100)):
+                return stix_obj
+
+    assert asyncio.run(first()) is not None
+    assert len(source.started) <= 3
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+buffered_sink = pytest.importorskip("stixorm.module.buffered_sink")
+
+
+class FakeSink:
+    journal = None
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.written = threading.Event()
+
+    def add(self, stix_data, batch_size=None):
+        if self.fail:
+            raise RuntimeError("commit failed")
+        self.batches.append([stix_obj["id"] for stix_obj in stix_data])
+        self.written.set()
+
+
+def objects(count):
+    return [{"type": "identity", "id": f'identity--{n}'} for n in range(count)]
+
+
+def test_full_batches_written_and_the_rest_on_flush():
+    sink = FakeSink()
+    with buffered_sink.BufferedTypeDBSink(sink, batch_size=2, flush_interval=60) as buffered:
+        buffered.add(objects(5))
+        assert buffered.flush(timeout=5)
+        assert sink.batches == [["identity--0", "identity--1"], ["identity--2", "identity--3"], ["identity--4"]]
+        assert buffered.counts == {"objects": 5, "batches": 3}
+
+
+def test_partial_batch_written_when_its_window_ends():
+    sink = FakeSink()
+    with buffered_sink.BufferedTypeDBSink(sink, batch_size=100, flush_interval=0.05) as buffered:
+        started = time.monotonic()
+        buffered.add(objects(1))
+        assert sink.written.wait(5)
+        assert time.monotonic() - started >= 0.05
+        assert sink.batches == [["identity--0"]]
+
+
+def test_close_writes_the_queue_and_refuses_more():
+    sink = FakeSink()
+    buffered = buffered_sink.BufferedTypeDBSink(sink, batch_size=100, flush_interval=60)
+    buffered.add(objects(3))
+    buffered.close()
+    assert sink.batches == [["identity--0", "identity--1", "identity--2"]]
+    with pytest.raises(ValueError):
+        buffered.add(objects(1))
+
+
+def test_write_errors_raised_to_the_producer():
+    buffered = buffered_sink.BufferedTypeDBSink(FakeSink(fail=True), batch_size=1, flush_interval=60)
+    buffered.add(objects(1))
+    with pytest.raises(RuntimeError, match="commit failed"):
+        buffered.flush(timeout=5)
+    buffered.close()
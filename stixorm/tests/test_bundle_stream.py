@@ -0,0 +1,58 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from stixorm.module.bundle_stream import open_stream, iter_bundle_objects
+
+
+objects = [
+    {"type": "identity", "id": "identity--1", "name": "ACME, \"Inc\" [x]"},
+    {"type": "malware", "id": "malware--1", "name": "{braces}", "is_family": False},
+]
+bundle = {"type": "bundle", "id": "bundle--1", "objects": objects}
+
+
+def read_all(text, chunk_size=65536):
+    return list(iter_bundle_objects(io.StringIO(text), chunk_size=chunk_size))
+
+
+def test_bundle():
+    assert read_all(json.dumps(bundle)) == objects
+
+
+def test_bundle_with_objects_first():
+    text = json.dumps({"objects": objects, "type": "bundle", "id": "bundle--1"})
+    assert read_all(text) == objects
+
+
+def test_small_chunks():
+    assert read_all(json.dumps(bundle, indent=4), chunk_size=3) == objects
+
+
+def test_list():
+    assert read_all(json.dumps(objects)) == objects
+
+
+def test_single_object():
+    assert read_all(json.dumps(objects[0])) == [objects[0]]
+
+
+def test_empty_stream():
+    assert read_all("") == []
+
+
+def test_not_json_object_or_list():
+    with pytest.raises(ValueError):
+        read_all('"bundle"')
+
+
+def test_gzip_stream():
+    stream = io.BytesIO(gzip.compress(json.dumps(bundle).encode("utf-8")))
+    assert list(iter_bundle_objects(open_stream(stream))) == objects
+
+
+def test_binary_stream():
+    stream = io.BytesIO(json.dumps(bundle).encode("utf-8"))
+    assert list(iter_bundle_objects(open_stream(stream))) == objects
@@ -0,0 +1,88 @@
+import copy
+
+import pytest
+
+from stixorm.module.definitions.stix21 import stix_models
+from stixorm.module.conversion_plans import conversion_plan, split_on_plan, compile_plan, plans
+
+
+def old_obj_tql(obj_type, import_type):
+    """
+        The mapping the if/elif dispatch of the conversions built for a type, before the plans
+    """
+    models = copy.deepcopy(stix_models)
+    dispatch = models["dispatch_stix"]
+    if obj_type in ("relationship", "sighting"):
+        obj_tql = dispatch[obj_type]
+        obj_tql.update(models["sro_base_typeql_dict"])
+    elif obj_type in models["sco_obj"]:
+        obj_tql = dispatch[obj_type]
+        obj_tql.update(models["sco_base_typeql_dict"])
+    elif import_type == "STIX21":
+        obj_tql = dispatch[obj_type]
+        obj_tql.update(models["sdo_typeql_dict"])
+    else:
+        if obj_type in dispatch:
+            obj_tql = dispatch[obj_type]
+            obj_tql.update(models["dispatch_attack"][obj_type])
+        else:
+            obj_tql = models["dispatch_attack"][obj_type]
+        obj_tql.update(models["sdo_typeql_dict"])
+    return obj_tql
+
+
+stix_types = list(stix_models["sdo_obj"]) + list(stix_models["sco_obj"]) + ["relationship", "sighting"]
+
+
+@pytest.mark.parametrize("obj_type", stix_types)
+def test_stix_plan_matches_old_dispatch(obj_type):
+    assert dict(conversion_plan(obj_type)["typeql"]) == old_obj_tql(obj_type, "STIX21")
+
+
+@pytest.mark.parametrize("obj_type", stix_types)
+def test_attack_plan_of_stix_types(obj_type):
+    if obj_type in stix_models["dispatch_attack"]:
+        expected = old_obj_tql(obj_type, "ATT&CK")
+    else:
+        expected = old_obj_tql(obj_type, "STIX21")
+    assert dict(conversion_plan(obj_type, "ATT&CK")["typeql"]) == expected
+
+
+def test_attack_properties_merged_as_the_old_dispatch():
+    obj_tql = {"name": "name", "x_mitre_version": "x-mitre-version", "created": "stix-created"}
+    attack_tql = {"x_mitre_version": "mitre-version", "x_mitre_domains": "x-mitre-domains"}
+    base_tql = {"created": "created", "type": "stix-type"}
+    plan = compile_plan(obj_tql, base_tql, ["x_mitre_domains"], attack_tql)
+    old = dict(obj_tql)
+    old.update(attack_tql)
+    old.update(base_tql)
+    assert dict(plan["typeql"]) == old
+    assert plan["is_list"] == {"x_mitre_domains"}
+
+
+def test_plans_do_not_change_the_models():
+    dispatch = copy.deepcopy(stix_models["dispatch_stix"])
+    for obj_type in stix_types:
+        conversion_plan(obj_type)
+    assert stix_models["dispatch_stix"] == dispatch
+
+
+def test_plan_read_only():
+    with pytest.raises(TypeError):
+        plans["STIX21"]["identity"]["typeql"]["name"] = "x"
+
+
+def test_unknown_type():
+    with pytest.raises(ValueError):
+        conversion_plan("x-unknown")
+    with pytest.raises(ValueError):
+        conversion_plan("identity", "STIX20")
+
+
+def test_split_on_plan():
+    plan = conversion_plan("identity")
+    properties, relations = split_on_plan(["name", "external_references"], plan)
+    assert properties == ["name"]
+    assert relations == ["external_references"]
+    with pytest.raises(ValueError):
+        split_on_plan(["not_a_property"], plan)
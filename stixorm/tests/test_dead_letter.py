@@ -0,0 +1,31 @@
+import pytest
+
+from conftest import FakeSession
+
+dead_letter = pytest.importorskip("stixorm.module.dead_letter")
+
+
+def test_failing_object_isolated_by_bisection(make_sink, fake_database, fake_entry, tmp_path):
+    path = str(tmp_path / "dead.ndjson")
+    sink = make_sink(dead_letter=path)
+    fake_database.rejected = {"identity--2"}
+    batch = [fake_entry(f'identity--{n}', index=n) for n in range(5)]
+    report = {}
+    committed = sink._commit_parts(0, batch, FakeSession(fake_database), sink._new_sizer(5), report)
+    sink.dead_letter.close()
+
+    assert sorted(committed) == ["identity--0", "identity--1", "identity--3", "identity--4"]
+    assert sorted(stix_id for commit in fake_database.commits for stix_id in commit) == sorted(committed)
+    records = list(dead_letter.read_dead_letters(path))
+    assert [(record["stage"], record["stix_id"], record["index"]) for record in records] == \
+        [("commit", "identity--2", 2)]
+    assert "TYR03" in records[0]["reason"]
+
+
+def test_failing_batch_raised_without_a_dead_letter_file(make_sink, fake_database, fake_entry):
+    sink = make_sink()
+    fake_database.rejected = {"identity--2"}
+    batch = [fake_entry(f'identity--{n}') for n in range(3)]
+    with pytest.raises(Exception, match="TYR03"):
+        sink._commit_parts(0, batch, FakeSession(fake_database), sink._new_sizer(3))
+    assert fake_database.commits == []
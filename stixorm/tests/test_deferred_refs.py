@@ -0,0 +1,79 @@
+import pytest
+
+from conftest import FakeSession
+
+
+@pytest.fixture
+def sink(make_sink):
+    return make_sink()
+
+
+def commit(sink, database, *entries):
+    report = {}
+    sink._commit_batch(0, list(entries), FakeSession(database), report=report)
+    return report
+
+
+def test_missing_reference_parked_until_its_target_commits(sink, fake_database, fake_entry):
+    report = commit(sink, fake_database, fake_entry("relationship--1", ["malware--1", "identity--1"]),
+                    fake_entry("identity--1"))
+    assert report == {"identity--1": 0}
+    assert len(sink.pending) == 1
+    assert len(fake_database.reads()) == 1
+
+    report = commit(sink, fake_database, fake_entry("malware--1", ["identity--1"]))
+    assert report == {"malware--1": 0, "relationship--1": 0}
+    assert len(sink.pending) == 0
+    assert fake_database.commits == [["identity--1"], ["malware--1"], ["relationship--1"]]
+    # identity--1 and malware--1 were committed through the sink, so nothing more is read
+    assert len(fake_database.reads()) == 1
+
+
+def test_no_read_when_every_reference_is_known(sink, fake_database, fake_entry):
+    commit(sink, fake_database, fake_entry("identity--1"))
+    reads = len(fake_database.reads())
+    report = commit(sink, fake_database, fake_entry("malware--1", ["identity--1"]),
+                    fake_entry("malware--2", ["identity--1", "malware--1"]))
+    assert report == {"malware--1": 0, "malware--2": 0}
+    assert len(fake_database.reads()) == reads
+
+
+def test_stored_objects_reported_as_existing(sink, fake_database, fake_entry):
+    fake_database.store("identity--1")
+    report = commit(sink, fake_database, fake_entry("identity--1"), fake_entry("malware--1", ["identity--1"]))
+    assert report == {"identity--1": "existing", "malware--1": 0}
+    assert fake_database.commits == [["malware--1"]]
+
+
+def test_add_does_not_sweep_the_pending_store(sink, fake_database, fake_entry):
+    commit(sink, fake_database, fake_entry("malware--1", ["identity--1"]))
+    # another client writes the target, which the sink only reads on resolve_pending
+    fake_database.store("identity--1")
+    reads = len(fake_database.reads())
+    commit(sink, fake_database, fake_entry("indicator--1"))
+    assert len(sink.pending) == 1
+    assert not any("identity--1" in query for query in fake_database.reads()[reads:])
+
+    assert sink.resolve_pending() == {"malware--1": None}
+    assert len(sink.pending) == 0
+
+
+def test_cycles_given_up_on_by_resolve_pending(sink, fake_database, fake_entry):
+    commit(sink, fake_database, fake_entry("malware--1", ["malware--2"]), fake_entry("malware--2", ["malware--1"]),
+           fake_entry("indicator--1", ["malware--1"]), fake_entry("indicator--2", ["identity--1"]))
+    assert len(sink.pending) == 4
+    report = sink.resolve_pending()
+    assert report == {"malware--1": "unresolved", "malware--2": "unresolved", "indicator--1": "unresolved"}
+    assert len(sink.pending) == 1
+    assert sink.flush_pending() == 1
+    assert len(sink.pending) == 0
+    assert fake_database.commits == []
+
+
+def test_evicted_objects_dead_lettered(make_sink, fake_database, fake_entry, tmp_path):
+    from stixorm.module.dead_letter import read_dead_letters
+    path = str(tmp_path / "dead.ndjson")
+    sink = make_sink(max_pending=1, dead_letter=path)
+    commit(sink, fake_database, fake_entry("malware--1", ["identity--1"]), fake_entry("malware--2", ["identity--1"]))
+    sink.dead_letter.close()
+    assert [record["stix_id"] for record in read_dead_letters(path)] == ["malware--1"]
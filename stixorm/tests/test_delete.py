@@ -0,0 +1,97 @@
+import pytest
+
+delete = pytest.importorskip("stixorm.module.delete_stix_typeql")
+
+
+class FakeRole:
+    def __init__(self, name):
+        self.label = name
+
+    def get_label(self):
+        return self
+
+    def name(self):
+        return self.label
+
+
+class FakeThing:
+    def __init__(self, iid, *attribute_types):
+        self.iid = iid
+        self.attribute_types = attribute_types
+        self.playing = []
+
+    def get_iid(self):
+        return self.iid
+
+    def as_remote(self, tx):
+        return self
+
+    def is_entity(self):
+        return True
+
+    def get_has(self, attribute_type):
+        return iter([attribute_type] if attribute_type in self.attribute_types else [])
+
+    def get_relations(self, role_types=None):
+        names = None if role_types is None else {role.get_label().name() for role in role_types}
+        return [rel for rel, role in self.playing if names is None or role in names]
+
+
+class FakeRelation:
+    def __init__(self, iid, rel_type, **players):
+        self.iid = iid
+        self.type = FakeRole(rel_type)
+        self.players = {role.replace("_", "-"): things for role, things in players.items()}
+        for role, things in self.players.items():
+            for thing in things:
+                thing.playing.append((self, role))
+
+    def get_iid(self):
+        return self.iid
+
+    def get_type(self):
+        return self.type
+
+    def as_remote(self, tx):
+        return self
+
+    def get_players_by_role_type(self):
+        return {FakeRole(role): things for role, things in self.players.items()}
+
+
+class FakeConcepts:
+    def concepts(self):
+        return self
+
+    def get_attribute_type(self, name):
+        return name
+
+
+def test_owned_sub_graph_deleted_with_the_object():
+    malware = FakeThing("0x10", "stix-id")
+    identity, report = FakeThing("0x11", "stix-id"), FakeThing("0x12", "stix-id")
+    hash_value, own_reference = FakeThing("0x30"), FakeThing("0x31", "content-key")
+    FakeRelation("0x20", "hashes", owner=[malware], pointed_to=[hash_value])
+    FakeRelation("0x21", "external-references", referencing=[malware], referenced=[own_reference])
+    FakeRelation("0x23", "created-by", created=[malware], creator=[identity])
+    FakeRelation("0x24", "obj-ref", object=[report], referred=[malware])
+
+    queries = delete.delete_object_queries(malware, FakeConcepts())
+    assert queries == ['match $x iid 0x10, has stix-id $id;\ndelete $id isa stix-id;'] + \
+        delete.delete_iids_queries(["0x20", "0x21", "0x23", "0x30", "0x31", "0x10"])
+
+
+def test_shared_sub_object_kept_while_another_object_holds_it():
+    malware, tool = FakeThing("0x10", "stix-id"), FakeThing("0x11", "stix-id")
+    shared_reference = FakeThing("0x31", "content-key")
+    FakeRelation("0x21", "external-references", referencing=[malware], referenced=[shared_reference])
+    FakeRelation("0x22", "external-references", referencing=[tool], referenced=[shared_reference])
+
+    relations, entities = delete.owned_sub_graph(malware, FakeConcepts())
+    assert (relations, entities) == (["0x21"], [])
+
+
+def test_delete_iids_queries_chunked():
+    queries = delete.delete_iids_queries(["0x1", "0x2", "0x3"], chunk_size=2)
+    assert queries == ['match $t0 iid 0x1; $t1 iid 0x2;\ndelete $t0 isa thing; $t1 isa thing;',
+                       'match $t0 iid 0x3;\ndelete $t0 isa thing;']
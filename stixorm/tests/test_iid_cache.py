@@ -0,0 +1,180 @@
+import pytest
+
+from conftest import FakeAnswer, FakeConcept
+from stixorm.module.iid_cache import (IIDCache, object_var, match_vars, content_keys_query,
+                                      rewrite_content_keys)
+
+
+match = 'match $identity0 isa identity, has stix-id "identity--1";\n' \
+        ' $marking1 isa marking, has stix-id "marking-definition--1";\n'
+
+
+def test_object_var():
+    assert object_var("marking-definition") == "marking"
+    assert object_var("identity") == "identity"
+
+
+def test_match_vars():
+    assert match_vars(match) == {"identity0": "identity--1", "marking1": "marking-definition--1"}
+
+
+def test_rewrite_known_ids_only():
+    cache = IIDCache()
+    cache.put_many({"identity--1": "0x826e80018000000000000000"})
+    rewritten, used = cache.rewrite_match(match)
+    assert rewritten == 'match $identity0 iid 0x826e80018000000000000000;\n' \
+                       ' $marking1 isa marking, has stix-id "marking-definition--1";\n'
+    assert used == ["identity--1"]
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_least_recently_used_evicted():
+    cache = IIDCache(max_size=2)
+    cache.put_many({"a": "0x1", "b": "0x2"})
+    assert cache.get("a") == "0x1"
+    cache.put_many({"c": "0x3"})
+    assert cache.get("b") is None
+    assert cache.get("a") == "0x1"
+    assert len(cache) == 2
+
+
+def test_invalidate_and_clear():
+    cache = IIDCache()
+    cache.put_many({"a": "0x1", "b": "0x2"})
+    cache.invalidate(["a", "x"])
+    assert cache.get("a") is None
+    assert cache.get("b") == "0x2"
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_content_keys():
+    assert content_keys_query(["ab12"]) == 'match $s has content-key $k; $k = "ab12"; get $s, $k;'
+    shared = ' $hash0 isa hash, has content-key "ab12";\n $hash1 isa hash, has content-key "cd34";\n'
+    assert rewrite_content_keys(shared, {"cd34": "0x9"}) == \
+        ' $hash0 isa hash, has content-key "ab12";\n $hash1 iid 0x9;\n'
+
+
+class FakeLabel:
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+
+class FakeType:
+    def __init__(self, name):
+        self.label = FakeLabel(name)
+
+    def get_label(self):
+        return self.label
+
+
+class FakeThing:
+    def __init__(self, iid, relations=()):
+        self.iid = iid
+        self.relations = list(relations)
+
+    def get_iid(self):
+        return self.iid
+
+    def as_remote(self, tx):
+        return self
+
+    def get_relations(self):
+        return list(self.relations)
+
+
+class FakeRelation(FakeThing):
+    def __init__(self, iid, rel_type, players):
+        super().__init__(iid)
+        self.type = FakeType(rel_type)
+        self.players = players
+        for things in players.values():
+            for thing in things:
+                thing.relations.append(self)
+
+    def get_type(self):
+        return self.type
+
+    def get_players_by_role_type(self):
+        return {FakeType(role): list(things) for role, things in self.players.items()}
+
+    def add_player(self, role, thing):
+        self.players[role.get_label().name()].append(thing)
+
+    def remove_player(self, role, thing):
+        self.players[role.get_label().name()].remove(thing)
+
+
+class FakeMergeTransaction:
+    def __init__(self, stored):
+        self.stored = stored
+        self.deleted = []
+
+    def query(self):
+        return self
+
+    def match(self, query):
+        for key, things in self.stored.items():
+            if f'"{key}"' in query:
+                for thing in things:
+                    yield FakeAnswer({"s": thing, "k": FakeConcept(value=key)})
+
+    def delete(self, query):
+        self.deleted.append(query)
+
+
+def test_duplicate_shared_sub_objects_merged_into_the_lowest_iid():
+    delete_stix_typeql = pytest.importorskip("stixorm.module.delete_stix_typeql")
+    kept, duplicate = FakeThing("0x02"), FakeThing("0x05")
+    nested = FakeThing("0x09")
+    owner_a, owner_b = FakeThing("0x10"), FakeThing("0x11")
+    held_a = FakeRelation("0x20", "hashes", {"owner": [owner_a], "pointed-to": [kept]})
+    held_b = FakeRelation("0x21", "hashes", {"owner": [owner_b], "pointed-to": [duplicate]})
+    owned = FakeRelation("0x22", "hashes", {"owner": [duplicate], "pointed-to": [nested]})
+    tx = FakeMergeTransaction({"ab12": [duplicate, kept]})
+
+    assert delete_stix_typeql.merge_shared_sub_objects(tx, ["ab12", "ab12"]) == ({"ab12": "0x02"}, 1)
+    assert held_a.players["pointed-to"] == [kept]
+    assert held_b.players["pointed-to"] == [kept]
+    assert owned.players["pointed-to"] == [nested]
+    assert tx.deleted == delete_stix_typeql.delete_iids_queries(["0x22", "0x05"])
+
+
+def test_nothing_merged_without_duplicates():
+    delete_stix_typeql = pytest.importorskip("stixorm.module.delete_stix_typeql")
+    tx = FakeMergeTransaction({"ab12": [FakeThing("0x02")]})
+    assert delete_stix_typeql.merge_shared_sub_objects(tx, ["ab12", "cd34"]) == ({"ab12": "0x02"}, 0)
+    assert tx.deleted == []
+
+
+def test_inserted_shared_sub_objects_merged_after_commit(make_sink, fake_database, fake_entry):
+    from conftest import FakeSession
+    sink = make_sink(share_sub_objects=True)
+    concurrent = FakeConcept(iid="0x0001")
+
+    def content_keys(kind, query, transaction):
+        if kind == "match" and "content-key" in query:
+            # another writer committed the same hash once this batch read the content keys
+            return [FakeAnswer({"s": concurrent, "k": FakeConcept(value="ab12")})] if fake_database.commits else []
+        if kind == "insert" and query.startswith("insert $hash0"):
+            return [FakeAnswer({"hash0": FakeConcept(iid="0x00ff")})]
+        return None
+
+    fake_database.answers.append(content_keys)
+    entry = dict(fake_entry("file--1"), match='match $hash0 isa sha-256, has content-key "ab12";\n',
+                 shared=[{"key": "ab12", "var": "hash0", "match": "",
+                          "insert": '$hash0 isa sha-256, has hash-value "x",\n has content-key "ab12";\n'}])
+    sink._submit_batch([entry], FakeSession(fake_database))
+
+    assert any(kind == "insert" and "$hash0 iid 0x00ff;" in query for kind, query in fake_database.queries)
+    merge_reads = [query for kind, query in fake_database.queries if kind == "match" and "content-key" in query]
+    assert len(merge_reads) == 2
+    assert sink._shared_iids.get("ab12") == "0x0001"
+
+
+def test_sink_keeps_its_empty_cache(make_sink):
+    assert isinstance(make_sink().iid_cache, IIDCache)
+    assert make_sink(iid_cache=False).iid_cache is None
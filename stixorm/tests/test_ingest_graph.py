@@ -0,0 +1,70 @@
+from stixorm.module.ingest_graph import get_object_refs, build_reference_graph, topological_waves, find_cycles
+
+
+identity = {"type": "identity", "id": "identity--1", "name": "ACME"}
+marking = {"type": "marking-definition", "id": "marking-definition--1", "created_by_ref": "identity--1"}
+malware = {
+    "type": "malware",
+    "id": "malware--1",
+    "created_by_ref": "identity--1",
+    "object_marking_refs": ["marking-definition--1"],
+    "granular_markings": [{"marking_ref": "marking-definition--2", "selectors": ["name"]}],
+}
+relationship = {
+    "type": "relationship",
+    "id": "relationship--1",
+    "source_ref": "malware--1",
+    "target_ref": "identity--1",
+}
+
+
+def test_refs_found_at_any_depth():
+    assert get_object_refs(malware) == {"identity--1", "marking-definition--1", "marking-definition--2"}
+
+
+def test_own_id_not_a_ref():
+    note = {"type": "note", "id": "note--1", "object_refs": ["note--1", "malware--1"]}
+    assert get_object_refs(note) == {"malware--1"}
+
+
+def test_graph_keeps_only_refs_in_the_collection():
+    graph = build_reference_graph([identity, marking, malware, relationship])
+    assert graph == {
+        "identity--1": set(),
+        "marking-definition--1": {"identity--1"},
+        "malware--1": {"identity--1", "marking-definition--1"},
+        "relationship--1": {"malware--1", "identity--1"},
+    }
+
+
+def test_waves_follow_the_references():
+    graph = build_reference_graph([relationship, malware, marking, identity])
+    waves, cycles = topological_waves(graph)
+    assert waves == [["identity--1"], ["marking-definition--1"], ["malware--1"], ["relationship--1"]]
+    assert cycles == []
+
+
+def test_independent_objects_share_a_wave():
+    waves, cycles = topological_waves({"b": set(), "a": set(), "c": {"a", "b"}})
+    assert waves == [["a", "b"], ["c"]]
+
+
+def test_cycles_and_their_dependants_left_out_of_the_waves():
+    graph = {"a": set(), "b": {"a", "c"}, "c": {"b"}, "d": {"c"}}
+    waves, cycles = topological_waves(graph)
+    assert waves == [["a"]]
+    assert cycles == [["b", "c"]]
+
+
+def test_find_cycles():
+    graph = {"a": {"b"}, "b": {"c"}, "c": {"a"}, "d": {"d"}, "e": {"a"}, "f": set()}
+    assert sorted(find_cycles(graph)) == [["a", "b", "c"], ["d"]]
+
+
+def test_find_cycles_on_a_long_chain():
+    length = 5000
+    graph = {str(i): {str(i + 1)} for i in range(length)}
+    graph[str(length)] = {"0"}
+    cycles = find_cycles(graph)
+    assert len(cycles) == 1
+    assert len(cycles[0]) == length + 1
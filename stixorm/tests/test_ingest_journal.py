@@ -0,0 +1,86 @@
+import pytest
+
+from stixorm.module.ingest_journal import IngestJournal
+
+
+def entries(start, stop):
+    return [{"index": index, "stix_id": f'indicator--{index}'} for index in range(start, stop)]
+
+
+def test_resume_after_reopen(tmp_path):
+    path = str(tmp_path / "ingest.journal")
+    with IngestJournal(path) as journal:
+        journal.record(0, entries(0, 10))
+        journal.record(2, entries(20, 30))
+        journal.record(1, entries(10, 15))
+    with IngestJournal(path) as journal:
+        assert len(journal) == 25
+        assert journal.resume_index == 15
+        assert journal.is_committed(3, "indicator--3")
+        assert journal.is_committed(25, "indicator--25")
+        assert not journal.is_committed(17, "indicator--17")
+
+
+def test_truncated_tail_cut_off(tmp_path):
+    path = str(tmp_path / "ingest.journal")
+    with IngestJournal(path) as journal:
+        journal.record(0, entries(0, 5))
+    with open(path, "a", encoding="utf-8") as journal_file:
+        journal_file.write('{"batch": 1, "objects": [[5, "indicator--5"], [6, "indic')
+    with IngestJournal(path) as journal:
+        assert journal.resume_index == 5
+        assert not journal.is_committed(5, "indicator--5")
+        journal.record(1, entries(5, 8))
+    with IngestJournal(path) as journal:
+        assert journal.resume_index == 8
+    with open(path, encoding="utf-8") as journal_file:
+        assert len(journal_file.read().splitlines()) == 2
+
+
+def test_mismatch_stops_skipping(tmp_path):
+    path = str(tmp_path / "ingest.journal")
+    with IngestJournal(path, sample_every=4) as journal:
+        journal.record(0, entries(0, 10))
+    with IngestJournal(path, sample_every=4) as journal:
+        assert journal.is_committed(1, "indicator--1")
+        assert not journal.is_committed(4, "malware--4")
+        assert not journal.is_committed(1, "indicator--1")
+
+
+def test_entries_without_index_not_recorded(tmp_path):
+    path = str(tmp_path / "ingest.journal")
+    with IngestJournal(path) as journal:
+        journal.record(0, [{"index": None, "stix_id": "indicator--x"}] + entries(0, 2))
+        assert len(journal) == 2
+        assert not journal.is_committed(None, "indicator--x")
+
+
+def identity(n):
+    return {"type": "identity", "spec_version": "2.1", "id": f'identity--{n:08d}-0000-4000-8000-000000000000',
+            "created": "2020-01-01T00:00:00.000Z", "modified": "2020-01-01T00:00:00.000Z", "name": f'identity {n}'}
+
+
+def test_input_numbered_before_parsing(make_sink, tmp_path):
+    path = str(tmp_path / "ingest.journal")
+    sink = make_sink(journal=path, dead_letter=str(tmp_path / "dead.ndjson"))
+    broken = dict(identity(2), created="not a timestamp")
+    sink.add([identity(1), broken, identity(3)])
+    sink.journal.close()
+    with IngestJournal(path, sample_every=1) as journal:
+        assert journal.is_committed(0, identity(1)["id"])
+        assert journal.is_committed(2, identity(3)["id"])
+        assert len(journal) == 2
+
+
+def test_journal_holds_a_single_ingest(make_sink, tmp_path):
+    sink = make_sink(journal=str(tmp_path / "ingest.journal"))
+    sink.add(identity(1))
+    with pytest.raises(ValueError):
+        sink.add(identity(2))
+
+
+def test_buffered_sink_refuses_a_journal(make_sink, tmp_path):
+    from stixorm.module.buffered_sink import BufferedTypeDBSink
+    sink = make_sink(journal=str(tmp_path / "ingest.journal"))
+    with pytest.raises(ValueError):
+        BufferedTypeDBSink(sink)
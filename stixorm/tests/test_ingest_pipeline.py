@@ -0,0 +1,45 @@
+import pytest
+
+pipeline = pytest.importorskip("stixorm.module.ingest_pipeline")
+
+
+def identity(n):
+    return {"type": "identity", "spec_version": "2.1", "id": f'identity--{n:08d}-0000-4000-8000-000000000000',
+            "created": "2020-01-01T00:00:00.000Z", "modified": "2020-01-01T00:00:00.000Z", "name": f'identity {n}'}
+
+
+def test_convert_chunk_keeps_the_input_index():
+    entries = pipeline.convert_chunk([(7, identity(1))], "STIX21", False, False)
+    assert [(entry["stix_id"], entry["index"]) for entry in entries] == [(identity(1)["id"], 7)]
+    assert "insert $identity isa identity" in entries[0]["insert"]
+
+
+def test_convert_chunk_returns_failures_for_the_dead_letter_file():
+    broken = dict(identity(2), created="not a timestamp")
+    entries = pipeline.convert_chunk([(0, identity(1)), (1, broken)], "STIX21", False, False, dead_letter=True)
+    assert entries[0]["object"] == identity(1)
+    assert (entries[1]["failed"], entries[1]["index"], entries[1]["object"]) == ("parse", 1, broken)
+    with pytest.raises(Exception):
+        pipeline.convert_chunk([(1, broken)], "STIX21", False, False)
+
+
+def test_chunked():
+    assert list(pipeline._chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+
+
+def test_pipeline_converts_in_processes_and_writes_on_threads(make_sink, fake_database):
+    sink = make_sink()
+    report = {}
+    counts = pipeline.IngestPipeline(sink, processes=1, writers=2, chunk_size=2).run(
+        [identity(n) for n in range(5)], batch_size=2, report=report)
+    assert counts == {"objects": 5, "batches": 3}
+    assert sorted(report) == sorted(identity(n)["id"] for n in range(5))
+    assert sorted(fake_database.stored) == sorted(report)
+    assert len(fake_database.commits) == 3
+
+
+def test_writer_failure_stops_the_pipeline(make_sink, fake_database):
+    fake_database.rejected = {identity(1)["id"]}
+    with pytest.raises(Exception, match="TYR03"):
+        pipeline.IngestPipeline(make_sink(), processes=1, writers=1).run(
+            [identity(n) for n in range(3)], batch_size=3)
@@ -0,0 +1,148 @@
+import pytest
+
+from stixorm.module.ingest_retry import (RetryPolicy, AdaptiveBatchSizer, error_codes, grpc_status,
+                                         is_conflict_error, is_oversize_error)
+
+
+class FakeStatus:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeRpcError(Exception):
+    def __init__(self, name, details):
+        super().__init__(details)
+        self._code = FakeStatus(name)
+
+    def code(self):
+        return self._code
+
+
+def caused_by(error, cause):
+    try:
+        raise error from cause
+    except Exception as raised:
+        return raised
+
+
+def test_error_codes():
+    error = Exception("[CLI04] Transaction closed with errors: [TXN08] Transaction isolation violation")
+    assert error_codes(error) == {"TXN08", "CLI04"}
+
+
+def test_conflict_error():
+    assert is_conflict_error(Exception("[TXN08] Transaction isolation violation: modified concurrently"))
+    assert is_conflict_error(Exception("[CLI04] Transaction closed with errors: "
+                                       "[TXN09] Concurrent transactions attempted to create 'stix-id'"))
+
+
+@pytest.mark.parametrize("message", [
+    "[TXN07] The transaction has been closed and no further operation is allowed.",
+    "[TXN10] Only write transactions can be committed.",
+    "[TXN12] Attempted data writes when session type does not allow.",
+    "[CLI04] Transaction closed with errors: [TXN07] The transaction has been closed. "
+    "[TQL03] There is a syntax error near line 1",
+    "[CLI04] Transaction closed with errors: [TXN08] Transaction isolation violation "
+    "[TYR03] Invalid type 'x'",
+    "[TYR03] Invalid type 'x'",
+    "transaction conflict in the message only",
+])
+def test_not_conflict_error(message):
+    assert not is_conflict_error(Exception(message))
+
+
+def test_grpc_status_from_cause():
+    error = caused_by(Exception("[CLI05] unexpected error"), FakeRpcError("RESOURCE_EXHAUSTED", "too big"))
+    assert grpc_status(error) == "RESOURCE_EXHAUSTED"
+    assert grpc_status(Exception("no cause")) is None
+
+
+def test_oversize_error():
+    assert is_oversize_error(caused_by(Exception("failed"), FakeRpcError("RESOURCE_EXHAUSTED", "failed")))
+    assert is_oversize_error(Exception("Received message larger than max (5000000 vs. 4194304)"))
+    assert not is_oversize_error(caused_by(Exception("failed"), FakeRpcError("UNAVAILABLE", "failed")))
+
+
+@pytest.mark.parametrize("attempt, cap", [(1, 0.05), (2, 0.1), (4, 0.4), (20, 5.0)])
+def test_backoff_within_cap(attempt, cap):
+    policy = RetryPolicy()
+    for _ in range(100):
+        assert 0 <= policy.backoff(attempt) <= cap
+
+
+def test_sizer_halves_down_to_minimum():
+    sizer = AdaptiveBatchSizer(100, minimum=10)
+    assert sizer.shrink() == 50
+    assert sizer.shrink() == 25
+    assert sizer.shrink() == 12
+    assert sizer.shrink() == 10
+    assert sizer.size == 10
+
+
+def test_sizer_grows_after_successes_in_a_row():
+    sizer = AdaptiveBatchSizer(100, grow_after=2)
+    sizer.shrink()
+    sizer.shrink()
+    assert sizer.size == 25
+    assert sizer.success() == 25
+    assert sizer.success() == 31
+    sizer.success()
+    sizer.shrink()
+    assert sizer.success() == 15
+    for _ in range(40):
+        sizer.success()
+    assert sizer.size == 100
+
+
+def test_sizer_grows_from_one():
+    sizer = AdaptiveBatchSizer(4, grow_after=1)
+    for _ in range(3):
+        sizer.shrink()
+    assert sizer.size == 1
+    assert sizer.success() == 2
+
+
+conflict = Exception("[TXN08] Transaction isolation violation on commit")
+
+
+@pytest.fixture
+def retrying_sink(make_sink):
+    return make_sink(retry=RetryPolicy(max_attempts=3, base_delay=0), batch_size=4)
+
+
+def commit_parts(sink, database, batch):
+    from conftest import FakeSession
+    report = {}
+    committed = sink._commit_parts(0, batch, FakeSession(database), sink._new_sizer(len(batch)), report)
+    return committed, report
+
+
+def test_conflicting_batch_split_and_retried(retrying_sink, fake_database, fake_entry):
+    fake_database.commit_errors = [conflict]
+    batch = [fake_entry(f'identity--{n}') for n in range(4)]
+    committed, report = commit_parts(retrying_sink, fake_database, batch)
+    assert committed == [f'identity--{n}' for n in range(4)]
+    assert fake_database.commits == [["identity--0", "identity--1"], ["identity--2", "identity--3"]]
+    assert sum(retrying_sink.metrics.snapshot()["counters"]["write_conflicts"].values()) == 1
+
+
+def test_oversize_batch_split_without_backoff(retrying_sink, fake_database, fake_entry):
+    fake_database.commit_errors = [Exception("Received message larger than max (5000000 vs. 4194304)")]
+    batch = [fake_entry(f'identity--{n}') for n in range(4)]
+    commit_parts(retrying_sink, fake_database, batch)
+    assert len(fake_database.commits) == 2
+    assert "write_conflicts" not in retrying_sink.metrics.snapshot()["counters"]
+
+
+def test_conflicts_raised_once_the_retries_run_out(retrying_sink, fake_database, fake_entry):
+    fake_database.commit_errors = [conflict] * 3
+    with pytest.raises(Exception, match="TXN08"):
+        commit_parts(retrying_sink, fake_database, [fake_entry("identity--1")])
+    assert fake_database.commits == []
+
+
+def test_other_errors_not_retried(retrying_sink, fake_database, fake_entry):
+    fake_database.commit_errors = [Exception("[TXN06] The transaction has been closed"), conflict]
+    with pytest.raises(Exception, match="TXN06"):
+        commit_parts(retrying_sink, fake_database, [fake_entry("identity--1")])
+    assert fake_database.commit_errors == [conflict]
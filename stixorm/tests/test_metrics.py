@@ -0,0 +1,54 @@
+from stixorm.module.metrics import MetricsRegistry
+
+
+def test_counters():
+    metrics = MetricsRegistry()
+    metrics.inc("objects_written", 2, stix_type="identity")
+    metrics.inc("objects_written", stix_type="identity")
+    metrics.inc("batches_committed")
+    assert metrics.snapshot()["counters"] == {"batches_committed": {"": 1}, "objects_written": {"identity": 3}}
+
+
+def test_histogram_snapshot():
+    metrics = MetricsRegistry(buckets=(0.1, 1.0))
+    metrics.observe("commit", 0.05)
+    metrics.observe("commit", 0.5)
+    metrics.observe("commit", 2.0)
+    commit = metrics.snapshot()["stages"]["commit"][""]
+    assert commit["count"] == 3
+    assert commit["max"] == 2.0
+    assert commit["buckets"] == {"0.1": 1, "1.0": 1, "+Inf": 1}
+
+
+def test_timer_labels_changed_in_block():
+    metrics = MetricsRegistry()
+    with metrics.timer("parse") as labels:
+        labels["stix_type"] = "malware"
+    assert metrics.snapshot()["stages"]["parse"]["malware"]["count"] == 1
+
+
+def test_prometheus_text():
+    metrics = MetricsRegistry(buckets=(0.1, 1.0))
+    metrics.inc("objects_written", 3, stix_type="identity")
+    metrics.inc("batches_committed")
+    metrics.observe("execute", 0.05, stix_type="identity")
+    metrics.observe("execute", 0.5, stix_type="identity")
+    assert metrics.prometheus_text().splitlines() == [
+        '# TYPE stixorm_batches_committed_total counter',
+        'stixorm_batches_committed_total 1',
+        '# TYPE stixorm_objects_written_total counter',
+        'stixorm_objects_written_total{stix_type="identity"} 3',
+        '# TYPE stixorm_stage_seconds histogram',
+        'stixorm_stage_seconds_bucket{stage="execute",stix_type="identity",le="0.1"} 1',
+        'stixorm_stage_seconds_bucket{stage="execute",stix_type="identity",le="1.0"} 2',
+        'stixorm_stage_seconds_bucket{stage="execute",stix_type="identity",le="+Inf"} 2',
+        'stixorm_stage_seconds_sum{stage="execute",stix_type="identity"} 0.55',
+        'stixorm_stage_seconds_count{stage="execute",stix_type="identity"} 2',
+    ]
+
+
+def test_reset():
+    metrics = MetricsRegistry()
+    metrics.inc("objects_written")
+    metrics.reset()
+    assert metrics.prometheus_text() == "\n"
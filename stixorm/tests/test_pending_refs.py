@@ -0,0 +1,61 @@
+from stixorm.module.pending_refs import PendingStore, existing_ids_query
+
+
+def entry(stix_id):
+    return {"stix_id": stix_id, "match": "", "insert": ""}
+
+
+def test_existing_ids_query():
+    assert existing_ids_query(["identity--1"]) == \
+        'match $x has stix-id $id; $id = "identity--1"; get $x, $id;'
+    assert existing_ids_query(["identity--1", "malware--1"]) == \
+        'match $x has stix-id $id; {$id = "identity--1";} or {$id = "malware--1";}; get $x, $id;'
+
+
+def test_released_once_every_ref_resolved():
+    store = PendingStore()
+    store.park(entry("relationship--1"), {"malware--1", "identity--1"})
+    store.park(entry("malware--2"), {"identity--1"})
+    assert sorted(store.missing_ids()) == ["identity--1", "malware--1"]
+    assert store.resolve(["identity--1"]) == [entry("malware--2")]
+    assert len(store) == 1
+    assert store.resolve(["malware--1"]) == [entry("relationship--1")]
+    assert len(store) == 0
+    assert store.missing_ids() == []
+
+
+def test_known_ids_bounded():
+    store = PendingStore(max_known=2)
+    store.resolve(["a", "b", "c"])
+    assert not store.is_known("a")
+    assert store.is_known("b") and store.is_known("c")
+    store.forget(["b"])
+    assert not store.is_known("b")
+
+
+def test_oldest_evicted_when_full():
+    store = PendingStore(max_pending=2)
+    assert store.park(entry("a"), {"x"}) == []
+    assert store.park(entry("b"), {"x"}) == []
+    assert store.park(entry("c"), {"y"}) == [entry("a")]
+    assert store.resolve(["x"]) == [entry("b")]
+
+
+def test_unbounded():
+    store = PendingStore(max_pending=None)
+    for i in range(1000):
+        assert store.park(entry(f'note--{i}'), {"x"}) == []
+    assert len(store.resolve(["x"])) == 1000
+
+
+def test_take_blocked_cycles():
+    store = PendingStore()
+    store.park(entry("a"), {"b"})
+    store.park(entry("b"), {"a"})
+    store.park(entry("c"), {"a"})
+    store.park(entry("d"), {"identity--1"})
+    entries, cycles = store.take_blocked()
+    assert entries == [entry("a"), entry("b"), entry("c")]
+    assert cycles == [["a", "b"]]
+    assert store.drain() == [entry("d")]
+    assert len(store) == 0
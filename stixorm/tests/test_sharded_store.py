@@ -0,0 +1,88 @@
+from contextlib import contextmanager
+from itertools import count
+
+import pytest
+
+from conftest import FakeDatabase, FakeSession
+
+
+class FakeShardPool:
+    """A connection pool with one FakeDatabase per database name"""
+    def __init__(self, databases):
+        self.databases = databases
+
+    @contextmanager
+    def session(self, uri, port, database, session_type=None):
+        yield FakeSession(self.databases[database])
+
+    def invalidate(self, uri, port, database):
+        pass
+
+
+@pytest.fixture
+def sharded(monkeypatch):
+    typedb = pytest.importorskip("stixorm.module.typedb")
+    from stixorm.module.sharded_store import ShardedTypeDBSink
+    from stixorm.module.metrics import MetricsRegistry
+    monkeypatch.setattr(typedb, "initialise_database", lambda *args, **kwargs: None)
+    databases = {"shard0": FakeDatabase(), "shard1": FakeDatabase()}
+    connections = [{"uri": "localhost", "port": "1729", "database": name, "user": None, "password": None}
+                   for name in databases]
+    return ShardedTypeDBSink(connections, pool=FakeShardPool(databases), metrics=MetricsRegistry())
+
+
+def stix_id(stix_type, shard_no):
+    """The first stix-id of the type that is stored in the shard"""
+    from stixorm.module.sharded_store import shard_index
+    ids = (f'{stix_type}--{n:08d}-0000-4000-8000-000000000000' for n in count())
+    return next(candidate for candidate in ids if shard_index(candidate, 2) == shard_no)
+
+
+def database(sink, shard_no):
+    return sink.shards[shard_no]._pool.databases[f'shard{shard_no}']
+
+
+def test_route_keeps_order_within_each_shard(sharded):
+    objects = [{"id": stix_id("identity", 1)}, {"id": stix_id("identity", 0)},
+               {"id": stix_id("malware", 1)}, {"id": stix_id("malware", 0)}]
+    groups = sharded._route(objects)
+    assert groups == {1: [objects[0], objects[2]], 0: [objects[1], objects[3]]}
+
+
+def test_stubs_written_once_for_references_in_other_shards(sharded):
+    local, foreign = stix_id("identity", 0), stix_id("identity", 1)
+    malware = {"id": stix_id("malware", 0), "created_by_ref": foreign, "object_marking_refs": [local]}
+    assert sharded._write_stubs(0, [malware]) == set()
+    assert database(sharded, 0).commits == [[foreign]]
+    assert database(sharded, 1).commits == []
+
+    sharded._write_stubs(0, [malware])
+    assert database(sharded, 0).commits == [[foreign]]
+
+
+def test_reference_to_a_relation_in_another_shard_unresolved(sharded):
+    relationship = stix_id("relationship", 1)
+    grouping = {"id": stix_id("grouping", 0), "object_refs": [relationship, stix_id("identity", 1)]}
+    report = sharded._add_to_shard(0, [grouping], None)
+    assert report == {grouping["id"]: "unresolved"}
+    assert database(sharded, 0).commits == []
+
+
+def test_delete_removes_the_stubs_in_other_shards(sharded, monkeypatch):
+    from stixorm.module.sharded_store import delete_stub_query
+    identity = stix_id("identity", 1)
+    sharded._write_stubs(0, [{"id": stix_id("malware", 0), "created_by_ref": identity}])
+    monkeypatch.setattr(sharded.shards[1], "delete", lambda stix_ids, batch_size=None:
+                        dict.fromkeys(stix_ids, "deleted"))
+
+    assert sharded.delete(identity) == {identity: "deleted"}
+    assert ("delete", delete_stub_query(identity)) in database(sharded, 0).queries
+    assert not any(kind == "delete" for kind, query in database(sharded, 1).queries)
+
+
+def test_shared_iid_cache_refused_even_when_empty():
+    pytest.importorskip("stixorm.module.typedb")
+    from stixorm.module.sharded_store import ShardedTypeDBSink
+    from stixorm.module.iid_cache import IIDCache
+    with pytest.raises(ValueError):
+        ShardedTypeDBSink([{"uri": "localhost", "port": "1729", "database": "shard0"}], iid_cache=IIDCache())
@@ -0,0 +1,30 @@
+import pytest
+
+utilities = pytest.importorskip("stixorm.module.import_stix_utilities")
+
+
+def test_each_mapping_reaches_its_method():
+    handlers = utilities.sub_object_handlers
+    for name, config in utilities.key_value_configs.items():
+        assert handlers[name][1] is config
+    for name in ("kill_chain_phases", "external_references"):
+        assert handlers[name][1] is utilities.list_of_object_configs[name]
+    for name in ("created_by_ref", "object_marking_refs", "object_refs"):
+        assert handlers[name][1] is utilities.embedded_relation_configs[name]
+    assert handlers["hashes"][1] is None
+
+
+def test_dispatch_matches_the_direct_call():
+    obj = {"id": "file--1", "hashes": {"MD5": "0a1b"},
+           "kill_chain_phases": [{"kill_chain_name": "lockheed", "phase_name": "recon"}],
+           "created_by_ref": "identity--1"}
+    assert utilities.add_relation_to_typeql("hashes", obj, "$file") == utilities.hashes("hashes", obj["hashes"], "$file")
+    assert utilities.add_relation_to_typeql("kill_chain_phases", obj, "$file") == utilities.list_of_object(
+        "kill_chain_phases", obj["kill_chain_phases"], "$file", utilities.list_of_object_configs["kill_chain_phases"])
+    assert utilities.add_relation_to_typeql("created_by_ref", obj, "$file", [], 3) == utilities.embedded_relation(
+        "created_by_ref", "identity--1", "$file", 3, utilities.embedded_relation_configs["created_by_ref"])
+
+
+@pytest.mark.parametrize("rel", utilities.sro_role_refs + ("no_such_property",))
+def test_role_refs_and_unknown_properties_write_nothing(rel):
+    assert utilities.add_relation_to_typeql(rel, {"id": "sighting--1", rel: "identity--1"}, "$sighting") == ('', '')
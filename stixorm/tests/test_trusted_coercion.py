@@ -0,0 +1,67 @@
+import pytest
+
+stix2 = pytest.importorskip("stix2")
+
+from stixorm.module.import_stix_utilities import coerce_trusted_dict
+
+
+indicator = {
+    "type": "indicator",
+    "spec_version": "2.1",
+    "id": "indicator--8e2e2d2b-17d4-4cbf-938f-98ee46b3cd3f",
+    "created": "2016-04-06T20:03:00.000Z",
+    "modified": "2016-04-06T20:03:00.000Z",
+    "indicator_types": ["malicious-activity"],
+    "pattern": "[file:hashes.'SHA-256' = 'aec070645fe53ee3b3763059376134f058cc337247c978add178b6ccdfb0019f']",
+    "pattern_type": "stix",
+    "valid_from": "2016-01-01T00:00:00Z"
+}
+
+ipv4 = {
+    "type": "ipv4-addr",
+    "id": "ipv4-addr--ff26c055-6336-5bc5-b98d-13d6226742dd",
+    "value": "198.51.100.3"
+}
+
+
+def test_indicator_pattern_version_defaulted_as_parse_does():
+    parsed = stix2.parse(indicator)
+    coerced = coerce_trusted_dict(indicator)
+    assert coerced["pattern_version"] == parsed["pattern_version"]
+    assert coerced["created"] == parsed["created"]
+
+
+def test_observable_spec_version_defaulted_as_parse_does():
+    parsed = stix2.parse(ipv4)
+    coerced = coerce_trusted_dict(ipv4)
+    assert coerced["spec_version"] == parsed["spec_version"]
+
+
+def test_timestamps_not_defaulted_to_now():
+    incomplete = {key: value for key, value in indicator.items() if key not in ("created", "modified")}
+    coerced = coerce_trusted_dict(incomplete)
+    assert "created" not in coerced
+    assert "modified" not in coerced
+
+
+def test_input_not_changed():
+    coerce_trusted_dict(ipv4)
+    assert "spec_version" not in ipv4
+
+
+def test_trusted_failures_dead_lettered(make_sink, tmp_path):
+    from stixorm.module.dead_letter import read_dead_letters
+    path = str(tmp_path / "dead.ndjson")
+    sink = make_sink(trusted=True, validate_sample=1.0, dead_letter=path)
+    bad_timestamp = dict(indicator, id="indicator--0a4e4c1b-41a4-4d43-9c76-0ce9c4f6d3a1", created="not a time")
+    bad_object = {key: value for key, value in indicator.items() if key != "pattern"}
+    separated = list(sink._separate_objects([bad_timestamp, ipv4, bad_object, "{not json"], "STIX21"))
+    sink.dead_letter.close()
+    assert [stix_obj["id"] for stix_obj in separated] == [ipv4["id"]]
+    assert [record["stage"] for record in read_dead_letters(path)] == ["parse"] * 3
+
+
+def test_trusted_failure_raised_without_dead_letter(make_sink):
+    sink = make_sink(trusted=True)
+    with pytest.raises(Exception):
+        list(sink._separate_objects(dict(indicator, created="not a time"), "STIX21"))
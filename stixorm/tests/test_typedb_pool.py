@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+typedb_pool = pytest.importorskip("stixorm.module.typedb_pool")
+
+
+class FakeClient:
+    def __init__(self):
+        self.open = True
+
+    def is_open(self):
+        return self.open
+
+    def close(self):
+        self.open = False
+
+
+def test_client_connected_outside_the_lock(monkeypatch):
+    pool = typedb_pool.TypeDBConnectionPool()
+    connecting = threading.Event()
+    release = threading.Event()
+
+    def core_client(url):
+        connecting.set()
+        release.wait(5)
+        return FakeClient()
+
+    monkeypatch.setattr(typedb_pool.TypeDB, "core_client", core_client)
+    clients = []
+    thread = threading.Thread(target=lambda: clients.append(pool.get_client("localhost:1729")))
+    thread.start()
+    assert connecting.wait(5)
+    # the lock is free while the client connects, so other databases are not held up
+    assert pool._condition.acquire(timeout=1)
+    pool._condition.release()
+    release.set()
+    thread.join(5)
+    assert pool.get_client("localhost:1729") is clients[0]
+
+
+def test_client_connected_by_two_threads_at_once_kept_once(monkeypatch):
+    pool = typedb_pool.TypeDBConnectionPool()
+    barrier = threading.Barrier(2)
+    made = []
+
+    def core_client(url):
+        barrier.wait(5)
+        made.append(FakeClient())
+        return made[-1]
+
+    monkeypatch.setattr(typedb_pool.TypeDB, "core_client", core_client)
+    clients = []
+    threads = [threading.Thread(target=lambda: clients.append(pool.get_client("localhost:1729")))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert clients[0] is clients[1]
+    assert sorted(client.is_open() for client in made) == [False, True]
+
+
+def test_closed_client_reconnected(monkeypatch):
+    pool = typedb_pool.TypeDBConnectionPool()
+    monkeypatch.setattr(typedb_pool.TypeDB, "core_client", lambda url: FakeClient())
+    client = pool.get_client("localhost:1729")
+    client.close()
+    assert pool.get_client("localhost:1729") is not client
@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("stix2")
+
+from stixorm.module.typeql_export import TypeQLExport, list_chunks, read_chunk
+
+
+entries = [
+    {"stix_id": "identity--1", "stix_type": "identity", "index": 0, "refs": [],
+     "match": "", "insert": "insert $identity isa identity,\n has stix-id \"identity--1\";\n"},
+    {"stix_id": "report--1", "stix_type": "report", "index": 1, "refs": ["identity--1"],
+     "match": "match $identity0 isa identity, has stix-id \"identity--1\";\n",
+     "insert": "insert $report isa report,\n has stix-id \"report--1\";\n"},
+]
+
+
+def export(directory, file_format, compress=False, max_chunk_bytes=64 * 1024 * 1024):
+    with TypeQLExport(str(directory), file_format=file_format, compress=compress,
+                      max_chunk_bytes=max_chunk_bytes) as exporter:
+        for entry in entries:
+            exporter._write(entry)
+    return list_chunks(str(directory))
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_ndjson_round_trip(tmp_path, compress):
+    paths = export(tmp_path, "ndjson", compress)
+    assert len(paths) == 1
+    assert list(read_chunk(paths[0])) == entries
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_tql_round_trip(tmp_path, compress):
+    paths = export(tmp_path, "tql", compress)
+    assert list(read_chunk(paths[0])) == [dict(entry, followups=[]) for entry in entries]
+
+
+def test_tql_followups_kept_with_their_entry(tmp_path):
+    followups = [("match $report iid 0x1; $identity0 isa identity, has stix-id \"identity--2\";\n",
+                  "insert $report (object:$identity0);"),
+                 ("", "insert $identity isa identity,\n has stix-id \"identity--3\";")]
+    entry = dict(entries[1], shared=[{"key": "ab12"}], kill_chains={"lockheed": ["0x2"]}, followups=followups)
+    with TypeQLExport(str(tmp_path), file_format="tql") as exporter:
+        exporter._write(entry)
+        exporter._write(entries[0])
+    read = list(read_chunk(list_chunks(str(tmp_path))[0]))
+    assert read == [dict(entry, followups=followups), dict(entries[0], followups=[])]
+
+
+def test_chunks_split_and_listed_in_order(tmp_path):
+    paths = export(tmp_path, "ndjson", max_chunk_bytes=1)
+    assert [path.rsplit("/", 1)[1] for path in paths] == ["chunk-000000.ndjson", "chunk-000001.ndjson"]
+    assert [entry for path in paths for entry in read_chunk(path)] == entries
+
+
+def test_tql_chunk_loaded_with_references_matched_by_iid(tmp_path, make_sink, fake_database):
+    path = export(tmp_path, "tql")[0]
+    sink = make_sink()
+    fake_database.store("identity--1")
+    sink.iid_cache.put_many({"identity--1": fake_database.stored["identity--1"]})
+    sink._load_chunk(path, 10, None, sink._new_sizer(10))
+    inserts = [query for kind, query in fake_database.queries if kind == "insert"]
+    assert inserts[-1].startswith(f'match $identity0 iid {fake_database.stored["identity--1"]};')
+    assert fake_database.commits[-1] == ["report--1"]
@@ -0,0 +1,75 @@
+import pytest
+
+from conftest import FakeAnswer, FakeConcept
+
+update = pytest.importorskip("stixorm.module.update_stix_to_typeql")
+
+
+identity = {"type": "identity", "spec_version": "2.1", "id": "identity--f431f809-377b-45e0-aa1c-6a4751cae5ff",
+            "created": "2020-01-01T00:00:00.000Z", "modified": "2020-01-01T00:00:00.000Z",
+            "name": "ACME", "identity_class": "organization"}
+
+
+class FakeMatchTransaction:
+    def __init__(self, stored):
+        self.stored = stored
+        self.queries = []
+
+    def query(self):
+        return self
+
+    def match(self, query):
+        self.queries.append(query)
+        return [FakeAnswer({"identity1": FakeConcept(iid="0x0001")})] if self.stored else []
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """Read the stored version as the dict given, instead of from the answers"""
+    def store(stix_dict):
+        monkeypatch.setattr(update, "convert_ans_to_res", lambda answers, tx, import_type: None)
+        monkeypatch.setattr(update, "convert_res_to_stix", lambda res, import_type: dict(stix_dict))
+        return FakeMatchTransaction(stix_dict)
+    return store
+
+
+def test_new_object_inserted_whole():
+    status, queries = update.upsert_typeql(identity, FakeMatchTransaction(None))
+    assert status == "inserted"
+    assert [kind for kind, query in queries] == ["insert"]
+    assert '$stix-id "' + identity["id"] + '"' in queries[0][1]
+
+
+def test_same_version_unchanged(stored):
+    assert update.upsert_typeql(identity, stored(identity)) == ("unchanged", [])
+
+
+def test_older_version_stale(stored):
+    newer = dict(identity, modified="2021-01-01T00:00:00.000Z")
+    assert update.upsert_typeql(identity, stored(newer)) == ("stale", [])
+
+
+def test_only_changed_properties_rewritten(stored):
+    renamed = dict(identity, name="ACME Corp", modified="2021-01-01T00:00:00.000Z")
+    status, queries = update.upsert_typeql(renamed, stored(identity))
+    assert status == "updated"
+    deletes = [query for kind, query in queries if kind == "delete"]
+    assert deletes == [update.delete_attribute_query("0x0001", "modified"),
+                       update.delete_attribute_query("0x0001", "name")]
+    kind, insert = queries[-1]
+    assert kind == "insert"
+    assert "$identity iid 0x0001;" in insert
+    assert 'has name $name' in insert and '$name "ACME Corp"' in insert
+    assert "identity-class" not in insert
+
+
+def test_relationship_ends_cannot_change(stored):
+    relationship = {"type": "relationship", "spec_version": "2.1", "relationship_type": "uses",
+                    "id": "relationship--2f9a9aa9-108a-4333-a1a9-2b1c3a7d5c7a",
+                    "created": "2020-01-01T00:00:00.000Z", "modified": "2020-01-01T00:00:00.000Z",
+                    "source_ref": identity["id"], "target_ref": "malware--1f3e5a63-1e3a-4c4d-9e0b-0a2f5f5d7b11"}
+    moved = dict(relationship, target_ref="malware--9c1b2e0a-5f3e-4a7b-8c2d-3e4f5a6b7c8d")
+    transaction = stored(relationship)
+    transaction.match = lambda query: [FakeAnswer({"relationship1": FakeConcept(iid="0x0002")})]
+    with pytest.raises(ValueError):
+        update.upsert_typeql(moved, transaction)